@@ -0,0 +1,67 @@
+import hashlib
+import json
+import random
+
+from benchmarks.mesh import BRANCHES
+
+TARGETS = [ ("tp-link-tl-wr841n-nd-v9", 3932160), ("tp-link-archer-c7-v2", 7602176),
+        ("ubiquiti-unifi-ap", 7340032), ("gl-inet-gl-ar150", 5242880),
+        ("avm-fritz-box-4040", 7864320), ("x86-64", 17825792) ]
+
+def firmwareName(target,version):
+    return f"gluon-ffki-{ version }-{ target }-sysupgrade.bin"
+
+def writeFirmwareTree(path,branches=BRANCHES,targets=TARGETS):
+    """
+    Create a firmware directory with a sysupgrade manifest for every branch,
+    as read by ffua.branch.recurse_firmware_directory.
+    """
+    for priority, (branch, (_, version, _)) in enumerate(branches.items()):
+        sysupgrade = path / branch / "sysupgrade"
+        sysupgrade.mkdir(parents=True,exist_ok=True)
+        (path / branch / "factory").mkdir(exist_ok=True)
+        lines = [ f"BRANCH={ branch }", "DATE=2024-01-10 12:00:00+01:00", f"PRIORITY={ priority }", "" ]
+        for target, size in targets:
+            filename = firmwareName(target,version)
+            digest = hashlib.sha256(filename.encode()).hexdigest()
+            lines.append(f"{ target } { version } { digest } { size } { filename }")
+        (sysupgrade / f"{ branch }.manifest").write_text("\n".join(lines) + "\n")
+    return path
+
+def writeFirmwareLog(path,mesh,share=0.3,seed=0,targets=TARGETS):
+    """
+    Write an Apache log in the firmware LogFormat, in which a share of the
+    nodes of mesh download the firmware of their branch. Manifest polls,
+    factory downloads and failed requests are mixed in.
+    """
+    rnd = random.Random(seed)
+    nodes = [ node for node in mesh.nodes if node is not None
+            and 'autoupdater' in node['nodeinfo']['software'] ]
+    lines = list()
+    for node in rnd.sample(nodes,int(len(nodes) * share)):
+        address = rnd.choice(node['nodeinfo']['network']['addresses'])
+        branch = node['nodeinfo']['software']['autoupdater']['branch']
+        version = BRANCHES[branch][1]
+        target, size = rnd.choice(targets)
+        lines.append(f'{ address } "GET /firmware/{ branch }/sysupgrade/{ branch }.manifest HTTP/1.1" 200 1543')
+        if rnd.random() < 0.05:
+            lines.append(f'{ address } "GET /firmware/{ branch }/sysupgrade/{ firmwareName(target,version) } HTTP/1.1" 403 199')
+        lines.append(f'{ address } "GET /firmware/{ branch }/sysupgrade/{ firmwareName(target,version) } HTTP/1.1" 200 { size }')
+        if rnd.random() < 0.02:
+            lines.append(f'{ address } "GET /firmware/{ branch }/factory/{ firmwareName(target,version) } HTTP/1.1" 200 { size }')
+    with path.open("w") as output:
+        output.write("\n".join(lines) + "\n")
+    return path
+
+def writeConfig(path,hopglass,firmware_path,mesh,branches=BRANCHES):
+    """
+    Write an ffua config for the synthetic mesh and firmware tree.
+    """
+    config = { 'hopglass': str(hopglass),
+            'startnodes': mesh.startnodes(),
+            'firmware_path': str(firmware_path),
+            'branches': list(branches),
+            'incompatible': { 'stable': [ "experimental" ], 'experimental': [ "stable" ] },
+            'nets': [ "fda1:384a:74de:4242::/64" ] }
+    path.write_text(json.dumps(config,indent=2))
+    return path
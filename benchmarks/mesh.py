@@ -0,0 +1,147 @@
+import attr
+import json
+import random
+import time
+
+# Share of nodes, current and previous firmware version of each branch
+BRANCHES = {
+        'stable': (0.85, "v2023.2.1", "v2022.1.4"),
+        'beta': (0.10, "v2023.2.2~beta", "v2023.2.1"),
+        'experimental': (0.05, "v2024.1~exp20240110", "v2023.2.2~beta"),
+        }
+
+MODELS = [ "TP-Link TL-WR841N/ND v9", "TP-Link Archer C7 v2", "Ubiquiti UniFi AP",
+        "GL.iNet GL-AR150", "AVM FRITZ!Box 4040", "x86-64" ]
+
+def nodeIdent(num):
+    return f"{ 0x02caffee0000 + num:012x}"
+
+def nodeMac(ident):
+    return ":".join(ident[pos:pos + 2] for pos in range(0,12,2))
+
+def _timestamp(epoch):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z",time.gmtime(epoch))
+
+@attr.s
+class Mesh:
+    """
+    Synthetic batman-adv mesh. Node records are in the shape of hopglass
+    nodes.json entries, links are (source, target, tq) between positions
+    in nodes and given in both directions.
+    """
+    nodes = attr.ib(factory=list)
+    links = attr.ib(factory=list)
+    gateways = attr.ib(factory=list)
+    anonymous = attr.ib(factory=set)
+    timestamp = attr.ib(default=0)
+
+    def startnodes(self):
+        return [ nodeIdent(num) for num in self.gateways ]
+
+    def addresses(self,branch=None):
+        """
+        Addresses of the nodes with node info, optionally of one branch.
+        """
+        for node in self.nodes:
+            if node is None:
+                continue
+            autoupdater = node['nodeinfo']['software'].get('autoupdater',{})
+            if branch is None or autoupdater.get('branch') == branch:
+                yield node['nodeinfo']['node_id'], node['nodeinfo']['network']['addresses']
+
+    def nodesDocument(self):
+        return { 'timestamp': _timestamp(self.timestamp),
+                'nodes': [ node for node in self.nodes if node is not None ] }
+
+    def graphDocument(self):
+        nodes = list()
+        for num, node in enumerate(self.nodes):
+            ident = nodeIdent(num)
+            if num in self.anonymous:
+                nodes.append({ 'id': nodeMac(ident) })
+            else:
+                nodes.append({ 'id': nodeMac(ident), 'node_id': ident })
+        links = list()
+        for source, target, tq in self.links:
+            links.append({ 'source': source, 'target': target, 'tq': tq, 'vpn': False })
+            links.append({ 'source': target, 'target': source, 'tq': tq, 'vpn': False })
+        return { 'version': 1, 'timestamp': _timestamp(self.timestamp),
+                'batadv': { 'directed': True, 'graph': None, 'nodes': nodes, 'links': links } }
+
+    def write(self,path):
+        """
+        Write nodes.json and graph.json into the directory path.
+        """
+        path.mkdir(parents=True,exist_ok=True)
+        with (path / "nodes.json").open("w") as output:
+            json.dump(self.nodesDocument(),output)
+        with (path / "graph.json").open("w") as output:
+            json.dump(self.graphDocument(),output)
+        return path
+
+def _record(rnd,num,now,branch=None,online=True,gateway=False):
+    ident = nodeIdent(num)
+    addresses = [ f"fe80::{ num >> 16 & 0xffff:x}:{ num & 0xffff:x}",
+            f"fda1:384a:74de:4242::{ num >> 16 & 0xffff:x}:{ num & 0xffff:x}" ]
+    software = { 'firmware': { 'base': "gluon", 'release': "" } }
+    if gateway:
+        hostname = f"gw{ num + 1:02d}"
+        software['firmware']['release'] = "server"
+    else:
+        hostname = f"ffnode-{ num }"
+        _, current, previous = BRANCHES[branch]
+        software['firmware']['release'] = current if rnd.random() < 0.6 else previous
+        software['autoupdater'] = { 'enabled': True, 'branch': branch }
+    lastseen = now if online else now - rnd.randrange(3600,30 * 86400)
+    return { 'firstseen': _timestamp(now - 180 * 86400), 'lastseen': _timestamp(lastseen),
+            'flags': { 'online': online, 'gateway': gateway },
+            'nodeinfo': { 'node_id': ident, 'hostname': hostname,
+                'hardware': { 'model': "server" if gateway else rnd.choice(MODELS) },
+                'network': { 'mac': nodeMac(ident), 'addresses': addresses },
+                'software': software, 'flags': { 'online': online } },
+            'statistics': { 'clients': 0 if gateway else rnd.randrange(0,12) } }
+
+def generateMesh(num_nodes,seed=0,uplink_share=0.3,cluster_size=12,offline_share=0.1,
+        anonymous_share=0.005,now=None):
+    """
+    Build a mesh of num_nodes nodes resembling a Freifunk community.
+
+    A few fully meshed gateways carry the VPN uplinks of a share of the
+    nodes. Every other node joins a wireless cluster hanging off an uplink
+    node; clusters are trees with some redundant links. A share of the
+    nodes is offline and a few appear in graph.json only.
+    """
+    rnd = random.Random(seed)
+    now = int(time.time() if now is None else now)
+    mesh = Mesh(timestamp=now)
+    num_gateways = min(max(2,num_nodes // 2000),16)
+    names = list(BRANCHES)
+    shares = [ BRANCHES[name][0] for name in names ]
+    for num in range(num_gateways):
+        mesh.gateways.append(num)
+        mesh.nodes.append(_record(rnd,num,now,gateway=True))
+        for other in range(num):
+            mesh.links.append((other,num,1.0))
+
+    cluster = list()
+    for num in range(num_gateways,max(num_nodes,num_gateways + 1)):
+        branch = rnd.choices(names,shares)[0]
+        online = rnd.random() >= offline_share
+        if rnd.random() < anonymous_share:
+            mesh.anonymous.add(num)
+            mesh.nodes.append(None)
+        else:
+            mesh.nodes.append(_record(rnd,num,now,branch,online))
+        if len(cluster) == 0 or len(cluster) >= cluster_size or rnd.random() < uplink_share:
+            # VPN uplink node starting a new cluster
+            for gateway in rnd.sample(mesh.gateways,min(2,num_gateways)):
+                mesh.links.append((gateway,num,round(rnd.uniform(0.8,1.0),3)))
+            cluster = [num]
+            continue
+        parent = rnd.choice(cluster)
+        mesh.links.append((parent,num,round(rnd.uniform(0.2,1.0),3)))
+        other = rnd.choice(cluster)
+        if other != parent and rnd.random() < 0.3:
+            mesh.links.append((other,num,round(rnd.uniform(0.1,0.6),3)))
+        cluster.append(num)
+    return mesh
@@ -0,0 +1,198 @@
+import attr
+import contextlib
+import io
+import json
+import logging
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+
+from benchmarks.firmware import writeConfig, writeFirmwareLog, writeFirmwareTree
+from benchmarks.mesh import generateMesh
+from ffua.config import Config
+from ffua.graph import addVirtualNode, spantree
+from ffua.hopglass import getDataFromHopGlass
+from ffua.htaccess import generateHtAccessRulesForBranch
+from ffua.mechanism import mechanismFactory, mechansim_dict
+from ffua.snapshot import readSnapshot, writeSnapshot
+from ffua.upgrade import UpgradeModel
+
+@attr.s
+class Environment:
+    """
+    Synthetic mesh, firmware tree, log and config of one benchmark size.
+    """
+    path = attr.ib(type=Path)
+    mesh = attr.ib()
+    snapshot = attr.ib(type=Path,default=None)
+    firmware = attr.ib(type=Path,default=None)
+    logfile = attr.ib(type=Path,default=None)
+    config_path = attr.ib(type=Path,default=None)
+
+    @classmethod
+    def create(cls,path,num_nodes,seed=0):
+        env = cls(path,generateMesh(num_nodes,seed))
+        env.snapshot = env.mesh.write(path / "hopglass")
+        env.firmware = writeFirmwareTree(path / "firmware")
+        env.logfile = writeFirmwareLog(path / "firmware.log",env.mesh,seed=seed)
+        env.config_path = writeConfig(path / "config.json",env.snapshot,env.firmware,env.mesh)
+        return env
+
+    def config(self):
+        config = Config()
+        with self.config_path.open() as config_file:
+            config.load(config_file)
+        return config
+
+    def graph(self):
+        return getDataFromHopGlass(str(self.snapshot))
+
+    def tree(self,compact=False):
+        config = self.config()
+        graph = self.graph()
+        root = addVirtualNode(graph,config.startnodes)
+        if compact:
+            graph = graph.compact()
+        return config, graph, spantree(graph,root)
+
+@attr.s
+class Result:
+    name = attr.ib(type=str)
+    nodes = attr.ib(type=int)
+    seconds = attr.ib(type=float)
+    peak = attr.ib(type=int)
+
+# Benchmarks by name. Each prepares its input from an Environment and
+# returns the callable to measure.
+benchmarks = dict()
+
+def benchmark(name):
+    def register(function):
+        benchmarks[name] = function
+        return function
+    return register
+
+@benchmark("getDataFromHopGlass")
+def benchHopGlass(env):
+    return env.graph
+
+@benchmark("readSnapshot")
+def benchSnapshot(env):
+    config, graph, tree = env.tree()
+    path = env.path / "graph.snap"
+    writeSnapshot(path,graph,tree)
+
+    def load():
+        snapshot = readSnapshot(path)
+        return snapshot.graph(), snapshot.tree()
+    return load
+
+@benchmark("spantree")
+def benchSpantree(env):
+    config, graph, tree = env.tree()
+    return lambda: spantree(graph,tree.root_node)
+
+@benchmark("spantree compact")
+def benchSpantreeCompact(env):
+    config, graph, tree = env.tree(compact=True)
+    return lambda: spantree(graph,tree.root_node)
+
+def benchMechanism(name):
+    def prepare(env):
+        config, graph, tree = env.tree()
+        mechanism = mechanismFactory(name,config)
+        return lambda: list(mechanism(graph,tree,config.branches))
+    return prepare
+
+for name in mechansim_dict:
+    benchmark(f"mechanism { name }")(benchMechanism(name))
+
+@benchmark("UpgradeModel")
+def benchUpgradeModel(env):
+    config, graph, tree = env.tree()
+    model = UpgradeModel(graph,tree,mechanismFactory("outerToInnerUpgrade",config))
+    return lambda: model.evaluate(config)
+
+@benchmark("htaccess")
+def benchHtAccess(env):
+    config, graph, tree = env.tree()
+    model = UpgradeModel(graph,tree,mechanismFactory("outerToInnerUpgrade",config))
+    allowed = [ (branch,nodes) for branch, nodes, _ in model.evaluate(config) ]
+
+    def write():
+        for branch, nodes in allowed:
+            (config.branches[branch].getSysupgradePath() / ".htaccess").unlink(missing_ok=True)
+            generateHtAccessRulesForBranch(branch,nodes,config)
+    return write
+
+@benchmark("readlog verify")
+def benchVerify(env):
+    import readlog
+
+    def verify():
+        with contextlib.redirect_stdout(io.StringIO()):
+            readlog.cli.main(["--config",str(env.config_path),"verify",str(env.logfile)],
+                    obj=dict(),standalone_mode=False)
+    return verify
+
+def benchStartup(module):
+    def prepare(env):
+        root = Path(__file__).parents[1]
+        return lambda: subprocess.run([sys.executable,"-c",f"import { module }"],cwd=root,check=True)
+    return prepare
+
+# Interpreter start and imports of the command line tools, cron jobs pay
+# these on every run
+for module in ("readlog","upgrade"):
+    benchmark(f"startup { module }")(benchStartup(module))
+
+def measure(name,env,repeat=3):
+    """
+    Best wall clock time of repeat runs and the peak of memory allocated
+    during an extra run under tracemalloc.
+    """
+    function = benchmarks[name](env)
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds,elapsed)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return Result(name,len(env.mesh.nodes),seconds,peak)
+
+def runBenchmarks(sizes,names=None,repeat=3,seed=0,workdir=None):
+    names = list(benchmarks) if not names else names
+    for name in names:
+        if name not in benchmarks:
+            raise Exception(f"Unknown benchmark { name }")
+    with tempfile.TemporaryDirectory(prefix="ffua-bench-",dir=workdir) as tmpdir:
+        for size in sizes:
+            env = Environment.create(Path(tmpdir) / str(size),size,seed)
+            for name in names:
+                yield measure(name,env,repeat)
+
+@click.command()
+@click.option("--nodes","-n","sizes",multiple=True,type=int,default=[100,1000,10000],show_default=True,help="Mesh sizes")
+@click.option("--benchmark","-b","names",multiple=True,type=click.Choice(list(benchmarks)),help="Benchmarks to run, all by default")
+@click.option("--repeat","-r",default=3,show_default=True,help="Timed runs per benchmark")
+@click.option("--seed",default=0,show_default=True,help="Seed of the mesh generator")
+@click.option("--json","json_output",type=click.File(mode='w'),help="Also write the results as JSON")
+def cli(sizes,names,repeat,seed,json_output):
+    logging.basicConfig(level=logging.CRITICAL)
+    results = list()
+    for result in runBenchmarks(sizes,names,repeat,seed):
+        print(f"{ result.nodes:>7} { result.name:<34} { result.seconds:10.4f}s { result.peak / 2**20:9.1f} MiB",flush=True)
+        results.append(result)
+    if json_output is not None:
+        json.dump([ attr.asdict(result) for result in results ],json_output,indent=2)
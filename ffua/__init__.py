@@ -1,8 +1,15 @@
-import ffua.branch
-import ffua.config
-import ffua.graph
-import ffua.hopglass
-import ffua.htaccess
-import ffua.manifest
-import ffua.mechanism
-import ffua.node
+import importlib
+
+# Submodules are imported on first access, see PEP 562. Command line tools
+# only pay for the modules their subcommand uses.
+__all__ = [ "address", "branch", "columns", "compact", "config", "daemon", "delta",
+        "graph", "hopglass", "htaccess", "logfile", "manifest", "mechanism",
+        "metrics", "node", "snapshot", "store", "upgrade", "util" ]
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"{ __name__ }.{ name }")
+    raise AttributeError(f"module { __name__ !r} has no attribute { name !r}")
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
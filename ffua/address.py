@@ -0,0 +1,143 @@
+import attr
+import ipaddress
+import logging
+
+LINK_LOCAL = "link-local"
+ULA = "ula"
+GLOBAL = "global"
+
+def parseAddress(address):
+    try:
+        return ipaddress.ip_address(address)
+    except ValueError:
+        return None
+
+def addressScope(address):
+    """
+    Classify an address into link-local, unique local or global scope.
+    """
+    if address.is_link_local:
+        return LINK_LOCAL
+    if address.version == 6 and address in ipaddress.ip_network("fc00::/7"):
+        return ULA
+    return GLOBAL
+
+def addressFromKey(version,value):
+    if version == 6:
+        return ipaddress.IPv6Address(value)
+    return ipaddress.IPv4Address(value)
+
+def addressKey(address):
+    return (address.version, int(address))
+
+def prefixKey(address):
+    """
+    Key of the network an address belongs to, /64 for IPv6 and /24 for IPv4.
+    """
+    prefixlen = 64 if address.version == 6 else 24
+    network = ipaddress.ip_network((address, prefixlen), strict=False)
+    return (address.version, int(network.network_address), prefixlen)
+
+@attr.s
+class AddressIndex:
+    """
+    Maps normalized addresses and their prefixes to graph nodes.
+    Several nodes may announce the same address, the node indexed first
+    is returned until it is removed.
+    """
+    addresses = attr.ib(factory=dict)
+    prefixes = attr.ib(factory=dict)
+    nodes = attr.ib(factory=dict)
+
+    def add(self,node,addresses):
+        keys = list()
+        for address in addresses:
+            parsed = parseAddress(address)
+            if parsed is None:
+                logging.warning(f"Node { node } has invalid address { address }")
+                continue
+            key = addressKey(parsed)
+            self.addresses.setdefault(key,list()).append(node)
+            prefix = prefixKey(parsed)
+            scope = addressScope(parsed)
+            self.prefixes.setdefault(scope,dict()).setdefault(prefix,set()).add(node)
+            keys.append((key,prefix,scope))
+        self.nodes.setdefault(node,list()).extend(keys)
+
+    def remove(self,node):
+        for key,prefix,scope in self.nodes.pop(node,list()):
+            owners = self.addresses[key]
+            owners.remove(node)
+            if len(owners) == 0:
+                del self.addresses[key]
+            members = self.prefixes[scope][prefix]
+            members.discard(node)
+            if len(members) == 0:
+                del self.prefixes[scope][prefix]
+
+    def find(self,address):
+        """
+        Returns the node owning address or None.
+        """
+        parsed = parseAddress(address)
+        if parsed is None:
+            return None
+        owners = self.addresses.get(addressKey(parsed))
+        if owners:
+            return owners[0]
+        return None
+
+    def findPrefix(self,network):
+        """
+        Returns the set of nodes having an address in network.
+        """
+        network = ipaddress.ip_network(network, strict=False)
+        prefixlen = 64 if network.version == 6 else 24
+        if network.prefixlen >= prefixlen:
+            supernet = network.supernet(new_prefix=prefixlen)
+            scope = addressScope(supernet.network_address)
+            key = (network.version, int(supernet.network_address), prefixlen)
+            members = self.prefixes.get(scope,dict()).get(key,set())
+            if network.prefixlen == prefixlen:
+                return set(members)
+            # Narrower than the indexed prefix, check the addresses itself
+            return set(node for node in members if self._nodeInNetwork(node,network))
+        nodes = set()
+        for prefixes in self.prefixes.values():
+            for (version, value, _), members in prefixes.items():
+                if version == network.version and addressFromKey(version,value) in network:
+                    nodes.update(members)
+        return nodes
+
+    def findScope(self,scope):
+        """
+        Returns the set of nodes having an address of given scope.
+        """
+        nodes = set()
+        for members in self.prefixes.get(scope,dict()).values():
+            nodes.update(members)
+        return nodes
+
+    def _nodeInNetwork(self,node,network):
+        for (version, value), _, _ in self.nodes.get(node,list()):
+            if version == network.version and addressFromKey(version,value) in network:
+                return True
+        return False
+
+    def numAddresses(self):
+        return len(self.addresses)
+
+    def knownAddresses(self):
+        """
+        All indexed addresses as ipaddress objects.
+        """
+        return [ addressFromKey(version,value) for version, value in self.addresses ]
+
+    @classmethod
+    def from_graph(cls,graph):
+        index = cls()
+        for node in graph.getNodes():
+            data = graph.getNodeData(node)
+            if data is not None:
+                index.add(node,data.getAddresses())
+        return index
@@ -2,25 +2,38 @@ import attr
 import logging
 from pathlib import Path
 
-from ffua.manifest import Manifest
+from ffua.manifest import Manifest, ManifestCache
 
 @attr.s
 class Branch:
+    """
+    A branch directory of the firmware tree. The manifest is parsed on
+    first use, through the manifest cache if given.
+    """
     path = attr.ib(type=Path)
     has_factory = attr.ib(type=bool)
     manifest = attr.ib(type=Manifest,default=None)
+    cache = attr.ib(type=ManifestCache,default=None,repr=False,eq=False)
 
     def getSysupgradePath(self):
         return self.path / "sysupgrade"
 
+    def getManifestPath(self):
+        return self.getSysupgradePath() / (self.path.name + ".manifest")
+
     def getManifest(self):
+        if self.manifest is None:
+            if self.cache is None:
+                self.manifest = Manifest.from_path(self.getManifestPath())
+            else:
+                self.manifest = self.cache.load(self.getManifestPath())
         return self.manifest
 
     def getFirmwareVersion(self):
-        return self.manifest.getFirmwareVersion()
+        return self.getManifest().getFirmwareVersion()
 
     @classmethod
-    def from_path(cls,path):
+    def from_path(cls,path,cache=None):
         # The important stuff
         sysupgrade_path = path / "sysupgrade"
         if not sysupgrade_path.is_dir():
@@ -28,18 +41,22 @@ class Branch:
         manifest_path = sysupgrade_path / (path.name + ".manifest")
         if not manifest_path.is_file():
             raise Exception(f"No valid branch directory { path } - missing sysupgrade manifest")
-        manifest = Manifest.from_path(manifest_path)
         # The goodies
         factory_path = path / "factory"
         has_factory = factory_path.is_dir()
         # GoGoGo
-        return cls(path,has_factory,manifest)
+        return cls(path,has_factory,cache=cache)
 
 
-def recurse_firmware_directory(firmware_path: Path):
+def recurse_firmware_directory(firmware_path: Path,names=None,cache=None):
+    """
+    Branches of the firmware directory, only those in names if given.
+    """
     for branch_directory in firmware_path.iterdir():
+        if names is not None and branch_directory.name not in names:
+            continue
         try:
-            yield (branch_directory.name,Branch.from_path(branch_directory))
+            yield (branch_directory.name,Branch.from_path(branch_directory,cache))
         except Exception as e:
             logging.exception(e)
 
@@ -0,0 +1,103 @@
+import attr
+import logging
+
+from ffua.graph import getSubtreeIndex
+
+# numpy is imported by available(), it is slow to import
+numpy = None
+_missing = False
+
+def available():
+    """
+    Whether columnar evaluation is possible, it needs numpy.
+    """
+    global numpy, _missing
+    if numpy is None and not _missing:
+        try:
+            import numpy
+        except ImportError:
+            _missing = True
+    return numpy is not None
+
+def _ids(values,mapping):
+    return numpy.fromiter((mapping.setdefault(value,len(mapping)) for value in values),
+            dtype=numpy.int32,count=len(values))
+
+@attr.s
+class NodeTable:
+    """
+    Columns of the node data of a spanning tree, one row per tree node in
+    the depth first order of its SubtreeIndex. Branches and firmware
+    versions are numbered, rows without node data have id -1 and a
+    lastseen of nan.
+    """
+    index = attr.ib()
+    data = attr.ib(factory=list)
+    hasdata = attr.ib(default=None)
+    distance = attr.ib(default=None)
+    parent = attr.ib(default=None)
+    branch = attr.ib(default=None)
+    version = attr.ib(default=None)
+    lastseen = attr.ib(default=None)
+    branch_ids = attr.ib(factory=dict)
+    version_ids = attr.ib(factory=dict)
+
+    @classmethod
+    def from_tree(cls,graph,tree):
+        if not available():
+            raise Exception("Columnar evaluation needs numpy")
+        index = getSubtreeIndex(tree)
+        table = cls(index)
+        table.data = [ graph.getNodeData(node) for node in index.order ]
+        rows = len(table.data)
+        table.hasdata = numpy.fromiter((data is not None for data in table.data),dtype=bool,count=rows)
+        table.distance = numpy.fromiter((tree.getNodeData(node) for node in index.order),
+                dtype=numpy.int32,count=rows)
+        table.parent = numpy.asarray(index.parent,dtype=numpy.int32)
+        present = [ data for data in table.data if data is not None ]
+        table.branch = numpy.full(rows,-1,dtype=numpy.int32)
+        table.branch[table.hasdata] = _ids([ data.getBranch() for data in present ],table.branch_ids)
+        table.version = numpy.full(rows,-1,dtype=numpy.int32)
+        table.version[table.hasdata] = _ids([ data.getFirmwareVersion() for data in present ],table.version_ids)
+        table.lastseen = numpy.full(rows,numpy.nan)
+        table.lastseen[table.hasdata] = [ numpy.nan if data.getLastSeenEpoch() is None
+                else data.getLastSeenEpoch() for data in present ]
+        logging.debug(f"Node table: { rows } rows, { len(table.branch_ids) } branches, "
+                f"{ len(table.version_ids) } firmware versions")
+        return table
+
+    def __len__(self):
+        return len(self.data)
+
+    def keptMask(self,pruned):
+        """
+        Rows left after removing the subtrees of the nodes in pruned.
+        """
+        kept = numpy.ones(len(self),dtype=bool)
+        for node in pruned:
+            pos = self.index.position[node]
+            kept[pos:self.index.end[pos]] = False
+        return kept
+
+    def isBranch(self,branches):
+        return numpy.isin(self.branch,[ self.branch_ids[b] for b in branches if b in self.branch_ids ])
+
+    def isVersion(self,versions):
+        return numpy.isin(self.version,[ self.version_ids[v] for v in versions if v in self.version_ids ])
+
+    def childCount(self,mask):
+        """
+        Number of childs of each row which are selected by mask.
+        """
+        childs = mask & (self.parent >= 0)
+        return numpy.bincount(self.parent[childs],minlength=len(self))
+
+    def degree(self,kept):
+        """
+        Degree of each row in the tree reduced to the kept rows.
+        """
+        return self.childCount(kept) + (self.parent >= 0)
+
+    def select(self,mask):
+        data = self.data
+        return [ data[pos] for pos in numpy.flatnonzero(mask) ]
@@ -0,0 +1,333 @@
+import array
+from collections.abc import Mapping
+import attr
+import math
+
+from ffua.address import AddressIndex
+
+def _weight(w):
+    try:
+        return float(w)
+    except (TypeError, ValueError):
+        return math.nan
+
+class EdgeView(Mapping):
+    """
+    Read only view on the live edges of one node, in the shape of the
+    arrows_out and arrows_in dicts of Graph.GraphNode.
+    """
+
+    def __init__(self,graph,ptr,idx,weights,pos):
+        self.graph = graph
+        if pos is None:
+            self.start = self.end = 0
+        else:
+            self.start = ptr[pos]
+            self.end = ptr[pos + 1]
+        self.idx = idx
+        self.weights = weights
+
+    def _positions(self):
+        alive = self.graph.alive
+        for edge in range(self.start,self.end):
+            if alive[self.idx[edge]]:
+                yield edge
+
+    def __iter__(self):
+        ids = self.graph.ids
+        for edge in self._positions():
+            yield ids[self.idx[edge]]
+
+    def __len__(self):
+        return sum(1 for _ in self._positions())
+
+    def __getitem__(self,node):
+        pos = self.graph.index.get(node)
+        if pos is not None and self.graph.alive[pos]:
+            for edge in range(self.start,self.end):
+                if self.idx[edge] == pos:
+                    return self.weights[edge]
+        raise KeyError(node)
+
+    def __contains__(self,node):
+        pos = self.graph.index.get(node)
+        if pos is None or not self.graph.alive[pos]:
+            return False
+        return any(self.idx[edge] == pos for edge in range(self.start,self.end))
+
+class NodeView:
+    """
+    Stand in for Graph.GraphNode of a node in a CompactGraph.
+    """
+    __slots__ = ('graph','pos')
+
+    def __init__(self,graph,pos):
+        self.graph = graph
+        self.pos = pos
+
+    @property
+    def arrows_out(self):
+        g = self.graph
+        return EdgeView(g,g.out_ptr,g.out_idx,g.out_weights,self.pos)
+
+    @property
+    def arrows_in(self):
+        g = self.graph
+        return EdgeView(g,g.in_ptr,g.in_idx,g.in_weights,self.pos)
+
+    @property
+    def ident(self):
+        return self.graph.idents[self.pos]
+
+    @property
+    def data(self):
+        return self.graph.data[self.pos]
+
+    @data.setter
+    def data(self,data):
+        self.graph.data[self.pos] = data
+
+    def degree(self):
+        return len(self.arrows_in) + len(self.arrows_out)
+
+    def isNeighbor(self,node_id):
+        return node_id in self.arrows_out or node_id in self.arrows_in
+
+def _csr(num_nodes,sources,targets,weights):
+    """
+    Counting sort of an edge list into compressed sparse row arrays.
+    """
+    ptr = array.array('l',[0]) * (num_nodes + 1)
+    for source in sources:
+        ptr[source + 1] += 1
+    for pos in range(num_nodes):
+        ptr[pos + 1] += ptr[pos]
+    fill = array.array('l',ptr[:-1])
+    idx = array.array('l',[0]) * len(sources)
+    wgt = array.array('d',[0.0]) * len(sources)
+    for source, target, weight in zip(sources,targets,weights):
+        edge = fill[source]
+        idx[edge] = target
+        wgt[edge] = weight
+        fill[source] += 1
+    return ptr, idx, wgt
+
+@attr.s
+class CompactGraph:
+    """
+    Directed graph stored in compressed sparse row arrays.
+
+    Nodes are addressed by their integer ids just like in Graph, internally
+    they are numbered by position. The structure is fixed after construction,
+    removeNode only tombstones the node. Edge weights are stored as floats,
+    weights without a numeric value become nan.
+    """
+    ids = attr.ib(factory=lambda: array.array('q'))
+    index = attr.ib(factory=dict)
+    out_ptr = attr.ib(factory=lambda: array.array('l',[0]))
+    out_idx = attr.ib(factory=lambda: array.array('l'))
+    out_weights = attr.ib(factory=lambda: array.array('d'))
+    in_ptr = attr.ib(factory=lambda: array.array('l',[0]))
+    in_idx = attr.ib(factory=lambda: array.array('l'))
+    in_weights = attr.ib(factory=lambda: array.array('d'))
+    alive = attr.ib(factory=bytearray)
+    data = attr.ib(factory=list)
+    idents = attr.ib(factory=list)
+    identmap = attr.ib(factory=dict)
+    addressindex = attr.ib(default=None)
+    num_alive = attr.ib(default=0)
+
+    @classmethod
+    def from_edges(cls,ids,edges,data=None,idents=None):
+        """
+        Build from a list of node ids and (source id, target id, weight) edges.
+        """
+        graph = cls()
+        graph.ids = array.array('q',ids)
+        graph.index = { node: pos for pos, node in enumerate(ids) }
+        num_nodes = len(graph.ids)
+        sources = array.array('l')
+        targets = array.array('l')
+        weights = array.array('d')
+        for n1, n2, w in edges:
+            sources.append(graph.index[n1])
+            targets.append(graph.index[n2])
+            weights.append(_weight(w))
+        graph.out_ptr, graph.out_idx, graph.out_weights = _csr(num_nodes,sources,targets,weights)
+        graph.in_ptr, graph.in_idx, graph.in_weights = _csr(num_nodes,targets,sources,weights)
+        graph.alive = bytearray(b'\x01') * num_nodes
+        graph.num_alive = num_nodes
+        graph.data = list(data) if data is not None else [None] * num_nodes
+        graph.idents = list(idents) if idents is not None else [None] * num_nodes
+        for pos, ident in enumerate(graph.idents):
+            if ident is not None:
+                graph.identmap[ident] = graph.ids[pos]
+        return graph
+
+    @classmethod
+    def from_graph(cls,graph):
+        ids = list(graph.getNodes())
+        edges = [ (n1, n2, w) for n1 in ids for n2, w in graph.getOutEdges(n1).items() ]
+        compact = cls.from_edges(ids,edges,
+                [ graph.getNode(node).data for node in ids ],
+                [ graph.getNode(node).ident for node in ids ])
+        compact.identmap = dict(graph.identmap)
+        if graph.addressindex is not None:
+            compact.buildAddressIndex()
+        return compact
+
+    def _pos(self,node):
+        pos = self.index.get(node)
+        if pos is None or not self.alive[pos]:
+            return None
+        return pos
+
+    def addEdge(self,n1,n2,w):
+        raise Exception("CompactGraph does not support adding edges")
+
+    def getOutEdges(self,node):
+        return EdgeView(self,self.out_ptr,self.out_idx,self.out_weights,self._pos(node))
+
+    def getNode(self,node):
+        pos = self._pos(node)
+        if pos is None:
+            raise Exception(f"No such node { node }")
+        return NodeView(self,pos)
+
+    def getNodeData(self,node):
+        return self.getNode(node).data
+
+    def setNodeData(self,node,data):
+        self.getNode(node).data = data
+
+    def setNodeIdent(self,node,ident):
+        self.idents[self.getNode(node).pos] = ident
+        self.identmap[ident] = node
+
+    def getNodeDataByIdent(self,ident):
+        return self.getNodeData(self.getGraphIdentFromIdent(ident))
+
+    def getGraphIdentFromIdent(self,ident):
+        try:
+            return self.identmap[ident]
+        except:
+            raise Exception(f"No graph ident for { ident }")
+
+    def removeNode(self,node):
+        pos = self._pos(node)
+        if pos is not None:
+            self.alive[pos] = 0
+            self.num_alive -= 1
+            if self.addressindex is not None:
+                self.addressindex.remove(node)
+
+    def getNodes(self):
+        ids = self.ids
+        return [ ids[pos] for pos, alive in enumerate(self.alive) if alive ]
+
+    def getEdges(self):
+        ids = self.ids
+        alive = self.alive
+        for pos in range(len(ids)):
+            if not alive[pos]:
+                continue
+            for edge in range(self.out_ptr[pos],self.out_ptr[pos + 1]):
+                target = self.out_idx[edge]
+                if alive[target]:
+                    yield (ids[pos],ids[target])
+
+    def buildAddressIndex(self):
+        self.addressindex = AddressIndex.from_graph(self)
+        return self.addressindex
+
+    def getNodeByAddress(self,address):
+        if self.addressindex is None:
+            self.buildAddressIndex()
+        return self.addressindex.find(address)
+
+    def hasNode(self,n):
+        return self._pos(n) is not None
+
+    def numNodes(self):
+        return self.num_alive
+
+    def degree(self,pos):
+        alive = self.alive
+        count = 0
+        for edge in range(self.out_ptr[pos],self.out_ptr[pos + 1]):
+            count += alive[self.out_idx[edge]]
+        for edge in range(self.in_ptr[pos],self.in_ptr[pos + 1]):
+            count += alive[self.in_idx[edge]]
+        return count
+
+    def spantree(self,start):
+        """
+        Breadth first spanning tree along outgoing edges, see ffua.graph.spantree.
+        """
+        root = self._pos(start)
+        if root is None:
+            raise Exception(f"Node {start} not in graph")
+        alive = self.alive
+        distance = array.array('l',[-1]) * len(self.ids)
+        distance[root] = 0
+        order = array.array('l',[root])
+        parents = array.array('l')
+        for pos in order:
+            weight = distance[pos] + 1
+            for edge in range(self.out_ptr[pos],self.out_ptr[pos + 1]):
+                target = self.out_idx[edge]
+                if alive[target] and distance[target] < 0:
+                    distance[target] = weight
+                    order.append(target)
+                    parents.append(pos)
+        ids = self.ids
+        tree = CompactTree.from_edges(
+                [ ids[pos] for pos in order ],
+                [ (ids[parent], ids[child], distance[child])
+                    for parent, child in zip(parents,order[1:]) ],
+                [ distance[pos] for pos in order ])
+        tree.root_node = start
+        return tree
+
+    def getLeafs(self):
+        ids = self.ids
+        return [ ids[pos] for pos, alive in enumerate(self.alive)
+                if alive and self.degree(pos) == 1 ]
+
+    def getComponents(self):
+        parent = array.array('l',range(len(self.ids)))
+
+        def find(pos):
+            root = pos
+            while parent[root] != root:
+                root = parent[root]
+            while parent[pos] != root:
+                parent[pos], pos = root, parent[pos]
+            return root
+
+        alive = self.alive
+        linked = bytearray(len(self.ids))
+        for pos in range(len(self.ids)):
+            if not alive[pos]:
+                continue
+            for edge in range(self.out_ptr[pos],self.out_ptr[pos + 1]):
+                target = self.out_idx[edge]
+                if alive[target]:
+                    linked[pos] = linked[target] = 1
+                    r1, r2 = find(pos), find(target)
+                    if r1 != r2:
+                        parent[r2] = r1
+        components = dict()
+        for pos in range(len(self.ids)):
+            if linked[pos]:
+                components.setdefault(find(pos),set()).add(self.ids[pos])
+        return list(components.values())
+
+@attr.s
+class CompactTree(CompactGraph):
+    root_node = attr.ib(default=None)
+    subtreeindex = attr.ib(default=None)
+
+    def removeNode(self,node):
+        self.subtreeindex = None
+        super().removeNode(node)
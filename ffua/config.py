@@ -3,7 +3,7 @@ import ipaddress
 import json
 from pathlib import Path
 
-from ffua.manifest import parse_manifest
+from ffua.manifest import ManifestCache, parse_manifest
 from ffua.branch import recurse_firmware_directory
 
 @attr.s
@@ -15,6 +15,14 @@ class Config:
     incompatible = attr.ib(factory=dict)
     mechanism = attr.ib(factory=dict)
     nets = attr.ib(factory=list)
+    cache = attr.ib(factory=dict)
+    workers = attr.ib(default=1)
+    executor = attr.ib(default="thread")
+    manifests = attr.ib(factory=ManifestCache)
+    aggregate = attr.ib(default=None)
+    comments = attr.ib(default=True)
+    output = attr.ib(default="htaccess")
+    rewritemap = attr.ib(factory=dict)
 
     def load(self,config_file):
         config = json.load(config_file)
@@ -22,13 +30,27 @@ class Config:
             raise Exception("Config is malformed, expected dict")
         if "hopglass" in config:
             self.hopglass = config['hopglass']
+            # A list of hopglass instances, one per mesh domain
+            if not isinstance(self.hopglass,str) and (not isinstance(self.hopglass,list)
+                    or len(self.hopglass) == 0 or not all(isinstance(url,str) for url in self.hopglass)):
+                raise Exception("Config is malformed, hopglass is no url or list of urls")
         if "startnodes" in config:
             self.startnodes = config['startnodes']
         else:
             raise Exception("Missing startnodes in config")
+        if "cache" in config:
+            self.cache = config["cache"]
+            if "path" in self.cache:
+                self.manifests = ManifestCache(Path(self.cache['path']) / "manifests.json")
         if "firmware_path" in config:
             self.firmware_path = Path(config['firmware_path'])
-            branches = dict(recurse_firmware_directory(self.firmware_path))
+        # Only branches which are configured or named as incompatible are
+        # read, their manifests on first use.
+        names = set(config.get('branches',["stable"]))
+        for branch, others in config.get('incompatible',{}).items():
+            names.add(branch)
+            names.update(others)
+        branches = dict(recurse_firmware_directory(self.firmware_path,names,self.manifests))
         if "branches" not in config:
             if "stable" in branches:
                 self.branches["stable"] = branches["stable"]
@@ -50,6 +72,31 @@ class Config:
             self.mechansim = config['mechansim']
         if "nets" in config:
             self.nets = config["nets"]
+        if "workers" in config:
+            if not isinstance(config["workers"],int) or config["workers"] < 1:
+                raise Exception(f"Config is malformed, workers must be a positive number, not '{ config['workers'] }'")
+            self.workers = config["workers"]
+        if "executor" in config:
+            if config["executor"] not in ("thread","process"):
+                raise Exception(f"Unknown executor '{ config['executor'] }'")
+            self.executor = config["executor"]
+        if "aggregate" in config:
+            if config["aggregate"] not in (None,"cidr","prefix"):
+                raise Exception(f"Unknown aggregate mode '{ config['aggregate'] }'")
+            self.aggregate = config["aggregate"]
+        if "comments" in config:
+            self.comments = bool(config["comments"])
+        if "output" in config:
+            if config["output"] not in ("htaccess","rewritemap"):
+                raise Exception(f"Unknown output '{ config['output'] }'")
+            self.output = config["output"]
+        if "rewritemap" in config:
+            self.rewritemap = config["rewritemap"]
+        if self.output == "rewritemap":
+            if "path" not in self.rewritemap:
+                raise Exception("Missing rewritemap path in config")
+            if self.rewritemap.get('type',"gdbm") not in ("txt","gdbm","ndbm"):
+                raise Exception(f"Unknown rewritemap type '{ self.rewritemap['type'] }'")
 
     def get_branch(self,branch):
         return self.branches[branch]
@@ -0,0 +1,152 @@
+import attr
+import logging
+from pathlib import Path
+import time
+
+from ffua.delta import diffGraphs
+from ffua.graph import VIRTUAL_IDENT, DynamicSpanTree, addVirtualNode
+from ffua.hopglass import Fetcher, documentPaths, readDocuments
+from ffua.htaccess import generateRulesForBranch, writeRewriteSnippet
+from ffua.mechanism import Mechanism
+from ffua.metrics import Metrics
+from ffua.upgrade import UpgradeModel
+
+def allowKey(nodes):
+    """
+    Everything of the allowed nodes that ends up in the htaccess rules.
+    """
+    key = set()
+    for data in nodes:
+        if data is None:
+            continue
+        key.add((data.ident, data.getHostname(), data.getFirmwareVersion(),
+            data.getBranch(), tuple(data.getAddresses())))
+    return frozenset(key)
+
+@attr.s
+class Daemon:
+    """
+    Keeps the network graph in memory and follows hopglass by applying
+    the differences between snapshots. Rules are regenerated only for
+    branches whose set of allowed nodes changed. Mechanisms using the
+    clock are evaluated on every cycle.
+    """
+    config = attr.ib()
+    mechanism = attr.ib(type=Mechanism)
+    fetcher = attr.ib(factory=Fetcher)
+    graph = attr.ib(default=None)
+    tree = attr.ib(type=DynamicSpanTree,default=None)
+    documents = attr.ib(default=None)
+    allowed = attr.ib(factory=dict)
+    metrics = attr.ib(factory=lambda: Metrics("upgrade"))
+    metrics_file = attr.ib(default=None)
+    metrics_format = attr.ib(default="prometheus")
+
+    def _attachStartnodes(self,root):
+        """
+        Link startnodes which reappeared to the virtual root node.
+        """
+        added = list()
+        for ident in self.config.startnodes:
+            node = self.graph.identmap.get(ident)
+            if node is not None and self.graph.hasNode(node) and not self.graph.getNode(root).isNeighbor(node):
+                self.graph.getNodeData(node).startnode = True
+                self.graph.addEdge(root,node,[])
+                added.append((root,node))
+        return added
+
+    def _load(self,graph):
+        self.graph = graph
+        if self.config.has_virtal_rootnode():
+            root = addVirtualNode(graph,self.config.startnodes)
+        else:
+            root = graph.getGraphIdentFromIdent(self.config.startnodes[0])
+        self.tree = DynamicSpanTree(graph,root)
+
+    def poll(self):
+        """
+        Fetch hopglass and bring graph and rules up to date.
+        Returns whether the graph changed.
+        """
+        with self.metrics.stage("fetch") as stage:
+            hits = self.fetcher.hits
+            paths = documentPaths(self.config.hopglass,self.fetcher)
+            stage.count("cache_hits",self.fetcher.hits - hits)
+        # Streamed documents can not be compared without reading them
+        documents = [ (str(path), path.stat().st_mtime_ns, path.stat().st_size)
+                for path in paths if isinstance(path,Path) ]
+        if len(documents) == len(paths) and documents == self.documents:
+            logging.debug("Hopglass data unchanged")
+            if self.mechanism.uses_clock:
+                # Nodes turn inactive by time alone
+                self.update()
+            return False
+        self.documents = documents
+        with self.metrics.stage("parse") as stage:
+            graph = readDocuments(paths)
+            stage.count("nodes",graph.numNodes())
+        if self.graph is None:
+            with self.metrics.stage("spantree") as stage:
+                self._load(graph)
+                stage.count("nodes",self.tree.tree.numNodes())
+        else:
+            with self.metrics.stage("delta") as stage:
+                delta = diffGraphs(self.graph,graph,keep=(VIRTUAL_IDENT,))
+                stage.count("added_nodes",len(delta.added_nodes))
+                stage.count("removed_nodes",len(delta.removed_nodes))
+                stage.count("updated_nodes",len(delta.updated_nodes))
+                stage.count("lastseen_updates",len(delta.lastseen))
+                if not delta.isEmpty():
+                    changes = delta.apply(self.graph)
+            if not delta.changesTopology() and len(delta.updated_nodes) == 0:
+                # Changes of lastseen and link weights only matter to
+                # mechanisms using the clock
+                if self.mechanism.uses_clock:
+                    self.update()
+                return not delta.isEmpty()
+            with self.metrics.stage("spantree") as stage:
+                if self.config.has_virtal_rootnode():
+                    changes.added_edges.extend(self._attachStartnodes(self.tree.root))
+                self.tree.repair(changes.removed_nodes,changes.removed_edges,changes.added_edges)
+                stage.count("nodes",self.tree.tree.numNodes())
+        self.update()
+        return True
+
+    def update(self):
+        with self.metrics.stage("mechanism") as stage:
+            upgrade = UpgradeModel(self.graph,self.tree.tree,self.mechanism)
+            results = upgrade.evaluate(self.config,workers=self.config.workers,executor=self.config.executor)
+            stage.count("allowed_nodes",sum(len(nodes) for _, nodes, _ in results))
+            stage.count("manifest_cache_hits",self.config.manifests.hits)
+            stage.count("manifest_cache_misses",self.config.manifests.misses)
+            self.config.manifests.save()
+        with self.metrics.stage("htaccess") as stage:
+            changed = 0
+            known = None
+            if self.config.aggregate == "prefix":
+                # Rules also depend on the addresses of all other nodes
+                known = self.graph.addressindex.knownAddresses()
+                known_key = frozenset(known)
+            for branch, nodes, _ in results:
+                key = allowKey(nodes) if known is None else (allowKey(nodes),known_key)
+                if self.allowed.get(branch) == key:
+                    logging.debug(f"Branch { branch }: allowed nodes unchanged")
+                    continue
+                self.allowed[branch] = key
+                changed += generateRulesForBranch(branch,nodes,self.config,known).changed
+            if self.config.output == "rewritemap":
+                writeRewriteSnippet(self.config)
+            stage.count("changed_files",changed)
+
+    def run(self,interval):
+        while True:
+            start = time.monotonic()
+            self.metrics.reset()
+            try:
+                changed = self.poll()
+                logging.info(f"Cycle took { time.monotonic() - start:.3f}s, graph { 'changed' if changed else 'unchanged' }")
+                if self.metrics_file is not None:
+                    self.metrics.write(self.metrics_file,self.metrics_format)
+            except Exception as e:
+                logging.exception(e)
+            time.sleep(max(0,interval - (time.monotonic() - start)))
@@ -0,0 +1,169 @@
+import attr
+import logging
+
+from ffua.node import NodeMetaData
+
+def _identEdges(graph,keep):
+    edges = dict()
+    for n1,n2 in graph.getEdges():
+        i1 = graph.getNode(n1).ident
+        i2 = graph.getNode(n2).ident
+        if i1 is None or i2 is None or i1 in keep or i2 in keep:
+            continue
+        edges[(i1,i2)] = graph.getOutEdges(n1)[n2]
+    return edges
+
+def _identNodes(graph,keep):
+    return { ident: node for ident, node in graph.identmap.items()
+            if ident not in keep and graph.hasNode(node) }
+
+def _sameData(old,new):
+    """
+    Whether node data differs at most in lastseen, which hopglass bumps
+    on every fetch.
+    """
+    if old is None or new is None:
+        return old is new
+    return attr.evolve(new,lastseen=old.lastseen) == old
+
+@attr.s
+class GraphChanges:
+    """
+    Changes of an applied delta in terms of node ids.
+    """
+    removed_nodes = attr.ib(factory=list)
+    removed_edges = attr.ib(factory=list)
+    added_edges = attr.ib(factory=list)
+
+@attr.s
+class GraphDelta:
+    """
+    Difference between two graphs, with nodes identified by their ident.
+    Edges are given as pairs of idents. Nodes whose data only differs in
+    lastseen are not updated, their new lastseen is in lastseen.
+    """
+    removed_nodes = attr.ib(factory=list)
+    added_nodes = attr.ib(factory=dict)
+    updated_nodes = attr.ib(factory=dict)
+    removed_edges = attr.ib(factory=list)
+    added_edges = attr.ib(factory=dict)
+    reweighted_edges = attr.ib(factory=dict)
+    lastseen = attr.ib(factory=dict)
+
+    def changesTopology(self):
+        return len(self.removed_nodes) > 0 or len(self.added_nodes) > 0 \
+                or len(self.removed_edges) > 0 or len(self.added_edges) > 0
+
+    def isEmpty(self):
+        return not self.changesTopology() and len(self.updated_nodes) == 0 \
+                and len(self.reweighted_edges) == 0 and len(self.lastseen) == 0
+
+    def without(self,idents):
+        """
+        Copy of the delta leaving out the nodes with an ident in idents
+        and their edges.
+        """
+        keep = lambda edge: edge[0] not in idents and edge[1] not in idents
+        return GraphDelta(
+                [ ident for ident in self.removed_nodes if ident not in idents ],
+                { ident: data for ident, data in self.added_nodes.items() if ident not in idents },
+                { ident: data for ident, data in self.updated_nodes.items() if ident not in idents },
+                [ edge for edge in self.removed_edges if keep(edge) ],
+                { edge: w for edge, w in self.added_edges.items() if keep(edge) },
+                { edge: w for edge, w in self.reweighted_edges.items() if keep(edge) },
+                { ident: lastseen for ident, lastseen in self.lastseen.items() if ident not in idents })
+
+    def to_dict(self):
+        nodes = lambda nodes: { ident: None if data is None else data.to_dict() for ident, data in nodes.items() }
+        edges = lambda edges: [ [ i1, i2, w ] for (i1, i2), w in edges.items() ]
+        return { 'removed_nodes': self.removed_nodes, 'added_nodes': nodes(self.added_nodes),
+                'updated_nodes': nodes(self.updated_nodes),
+                'removed_edges': [ list(edge) for edge in self.removed_edges ],
+                'added_edges': edges(self.added_edges), 'reweighted_edges': edges(self.reweighted_edges),
+                'lastseen': self.lastseen }
+
+    @classmethod
+    def from_dict(cls,data):
+        nodes = lambda nodes: { ident: None if node is None else NodeMetaData.from_dict(node) for ident, node in nodes.items() }
+        edges = lambda edges: { (i1, i2): w for i1, i2, w in edges }
+        return cls(list(data['removed_nodes']),nodes(data['added_nodes']),nodes(data['updated_nodes']),
+                [ tuple(edge) for edge in data['removed_edges'] ],
+                edges(data['added_edges']),edges(data['reweighted_edges']),
+                dict(data.get('lastseen',{})))
+
+    def apply(self,graph):
+        """
+        Apply the delta to graph in place. New nodes get fresh node ids,
+        node data of updated nodes keeps its startnode flag.
+        Returns the GraphChanges.
+        """
+        changes = GraphChanges()
+        for ident in self.removed_nodes:
+            node = graph.identmap.pop(ident)
+            graph.removeNode(node)
+            changes.removed_nodes.append(node)
+        next_id = max(graph.getNodes(),default=-1) + 1
+        for ident, data in self.added_nodes.items():
+            graph.setNodeIdent(next_id,ident)
+            graph.setNodeData(next_id,data)
+            graph.updateAddressIndex(next_id)
+            next_id += 1
+        for ident, data in self.updated_nodes.items():
+            node = graph.identmap[ident]
+            current = graph.getNodeData(node)
+            if current is not None and data is not None:
+                data.startnode = current.startnode
+            graph.setNodeData(node,data)
+            graph.updateAddressIndex(node)
+        for ident, lastseen in self.lastseen.items():
+            graph.getNodeData(graph.identmap[ident]).lastseen = lastseen
+        for i1, i2 in self.removed_edges:
+            edge = (graph.identmap[i1],graph.identmap[i2])
+            graph.removeEdge(*edge)
+            changes.removed_edges.append(edge)
+        for (i1, i2), weight in self.added_edges.items():
+            edge = (graph.identmap[i1],graph.identmap[i2])
+            graph.addEdge(*edge,weight)
+            changes.added_edges.append(edge)
+        for (i1, i2), weight in self.reweighted_edges.items():
+            graph.addEdge(graph.identmap[i1],graph.identmap[i2],weight)
+        logging.debug(f"Applied delta: { len(self.added_nodes) } nodes added, "
+                f"{ len(self.removed_nodes) } removed, { len(self.updated_nodes) } updated, "
+                f"{ len(self.added_edges) } links added, { len(self.removed_edges) } removed")
+        return changes
+
+def diffGraphs(old,new,keep=()):
+    """
+    Delta turning old into new. Nodes with an ident in keep and their
+    edges are left out, e.g. the virtual root node.
+    """
+    delta = GraphDelta()
+    old_nodes = _identNodes(old,keep)
+    new_nodes = _identNodes(new,keep)
+    for ident, node in old_nodes.items():
+        if ident not in new_nodes:
+            delta.removed_nodes.append(ident)
+    for ident, node in new_nodes.items():
+        data = new.getNodeData(node)
+        if ident not in old_nodes:
+            delta.added_nodes[ident] = data
+        else:
+            old_data = old.getNodeData(old_nodes[ident])
+            if not _sameData(old_data,data):
+                delta.updated_nodes[ident] = data
+            elif data is not None and data.lastseen != old_data.lastseen:
+                delta.lastseen[ident] = data.lastseen
+
+    old_edges = _identEdges(old,keep)
+    new_edges = _identEdges(new,keep)
+    removed = set(delta.removed_nodes)
+    for edge in old_edges:
+        # Edges of removed nodes vanish with the node
+        if edge not in new_edges and edge[0] not in removed and edge[1] not in removed:
+            delta.removed_edges.append(edge)
+    for edge, weight in new_edges.items():
+        if edge not in old_edges:
+            delta.added_edges[edge] = weight
+        elif old_edges[edge] != weight:
+            delta.reweighted_edges[edge] = weight
+    return delta
@@ -1,6 +1,11 @@
 import attr
+from bisect import bisect_left
+import heapq
 import logging
 
+from ffua.address import AddressIndex
+from ffua.compact import CompactGraph, CompactTree
+
 @attr.s
 class Graph:
     """ 
@@ -22,11 +27,16 @@ class Graph:
     
     nodes = attr.ib(factory=dict)
     identmap = attr.ib(factory=dict)
+    addressindex = attr.ib(default=None)
 
     def addEdge(self,n1,n2,w):
         self.getNode(n1).arrows_out[n2] = w
         self.getNode(n2).arrows_in[n1] = w
 
+    def removeEdge(self,n1,n2):
+        del self.getNode(n1).arrows_out[n2]
+        del self.getNode(n2).arrows_in[n1]
+
     def getOutEdges(self,node):
         try:
             return self.getNode(node).arrows_out
@@ -52,6 +62,8 @@ class Graph:
             for neighbor in gnode.arrows_in:
                 del self.nodes[neighbor].arrows_out[node]
             del self.nodes[node]
+            if self.addressindex is not None:
+                self.addressindex.remove(node)
         assert node not in self.nodes
 
     def getNodes(self):
@@ -81,6 +93,35 @@ class Graph:
         except:
             raise Exception(f"No graph ident for { ident }")
 
+    def buildAddressIndex(self):
+        """
+        Index the addresses of all nodes carrying node data.
+        The index follows removeNode.
+        """
+        self.addressindex = AddressIndex.from_graph(self)
+        return self.addressindex
+
+    def updateAddressIndex(self,node):
+        """
+        Reindex the addresses of node after its node data changed.
+        """
+        if self.addressindex is not None:
+            self.addressindex.remove(node)
+            data = self.getNodeData(node)
+            if data is not None:
+                self.addressindex.add(node,data.getAddresses())
+
+    def getNodeByAddress(self,address):
+        if self.addressindex is None:
+            self.buildAddressIndex()
+        return self.addressindex.find(address)
+
+    def compact(self):
+        """
+        Array backed copy of the graph, see ffua.compact.
+        """
+        return CompactGraph.from_graph(self)
+
     def hasNode(self,n):
         return n in self.nodes
 
@@ -91,6 +132,120 @@ class Graph:
 @attr.s
 class Tree(Graph):
     root_node = attr.ib(default=None)
+    subtreeindex = attr.ib(default=None)
+
+    def addEdge(self,n1,n2,w):
+        self.subtreeindex = None
+        super().addEdge(n1,n2,w)
+
+    def removeEdge(self,n1,n2):
+        self.subtreeindex = None
+        super().removeEdge(n1,n2)
+
+    def removeNode(self,node):
+        self.subtreeindex = None
+        super().removeNode(node)
+
+
+@attr.s
+class SubtreeIndex:
+    """
+    Euler tour of a tree. Nodes are numbered in depth first preorder, so
+    the subtree of a node is the interval from its position to end.
+    """
+    order = attr.ib(factory=list)
+    position = attr.ib(factory=dict)
+    end = attr.ib(factory=list)
+    parent = attr.ib(factory=list)
+    leafs = attr.ib(factory=set)
+    branches = attr.ib(default=None)
+
+    @classmethod
+    def from_tree(cls,tree):
+        index = cls()
+        root = tree.root_node
+        pending = [(root,-1)]
+        while len(pending) > 0:
+            node, parent = pending.pop()
+            if node is None:
+                # All descendants of parent are numbered
+                index.end[parent] = len(index.order)
+                continue
+            pos = len(index.order)
+            index.order.append(node)
+            index.position[node] = pos
+            index.end.append(None)
+            index.parent.append(parent)
+            childs = list(tree.getOutEdges(node).keys())
+            # By definition of getLeafs, the root is a leaf with a single child
+            if len(childs) + (parent >= 0) == 1:
+                index.leafs.add(node)
+            pending.append((None,pos))
+            pending.extend((child,pos) for child in reversed(childs))
+        return index
+
+    def hasNode(self,node):
+        return node in self.position
+
+    def subtreeNodes(self,node):
+        pos = self.position[node]
+        return self.order[pos:self.end[pos]]
+
+    def indexBranches(self,graph):
+        """
+        Positions of the nodes of each branch, the branch is read from the
+        node data in graph.
+        """
+        self.branches = dict()
+        for pos, node in enumerate(self.order):
+            data = graph.getNodeData(node)
+            if data is not None:
+                self.branches.setdefault(data.getBranch(),list()).append(pos)
+        return self.branches
+
+    def containsBranch(self,node,branch):
+        positions = self.branches.get(branch,())
+        pos = self.position[node]
+        found = bisect_left(positions,pos)
+        return found < len(positions) and positions[found] < self.end[pos]
+
+    def prune(self,tree,nodes):
+        """
+        Copy of tree without the subtrees of the given nodes.
+        """
+        starts = set(self.position[node] for node in nodes)
+        kept = list()
+        pos = 0
+        while pos < len(self.order):
+            if pos in starts:
+                pos = self.end[pos]
+            else:
+                kept.append(pos)
+                pos += 1
+        order = self.order
+        if isinstance(tree,CompactGraph):
+            pruned = CompactTree.from_edges(
+                    [ order[pos] for pos in kept ],
+                    [ (order[self.parent[pos]], order[pos], tree.getNodeData(order[pos]))
+                        for pos in kept if self.parent[pos] >= 0 ],
+                    [ tree.getNodeData(order[pos]) for pos in kept ])
+        else:
+            pruned = Tree()
+            for pos in kept:
+                node = order[pos]
+                pruned.setNodeData(node,tree.getNodeData(node))
+                if self.parent[pos] >= 0:
+                    pruned.addEdge(order[self.parent[pos]],node,tree.getNodeData(node))
+        pruned.root_node = tree.root_node
+        return pruned
+
+def getSubtreeIndex(tree):
+    """
+    The SubtreeIndex of tree, built on first use after each change.
+    """
+    if tree.subtreeindex is None:
+        tree.subtreeindex = SubtreeIndex.from_tree(tree)
+    return tree.subtreeindex
 
 
 def clone_graph(graph):
@@ -101,13 +256,15 @@ def clone_graph(graph):
     clone = Graph()
     for n1,n2 in graph.getEdges():
         clone.addEdge(n1,n2,None)
-    for node in graph.nodes:
+    for node in graph.getNodes():
         clone.setNodeData(node,graph.getNodeData(node))
 
     return graph
 
 
 def spantree(graph,start):
+    if isinstance(graph,CompactGraph):
+        return graph.spantree(start)
     tree = Tree()
     tree.root_node = start
     if not graph.hasNode(start):
@@ -126,6 +283,86 @@ def spantree(graph,start):
     return tree
 
 
+@attr.s
+class DynamicSpanTree:
+    """
+    Breadth first spanning tree of a graph, which is repaired instead of
+    rebuilt when the graph changes. Distance labels stored as node data
+    are always the ones spantree would compute, the choice of parents
+    among equally distant nodes may differ.
+    """
+    graph = attr.ib(type=Graph)
+    root = attr.ib()
+    tree = attr.ib(type=Tree,default=None)
+
+    def __attrs_post_init__(self):
+        if self.tree is None:
+            self.tree = spantree(self.graph,self.root)
+
+    def _subtree(self,node,invalid):
+        pending = [node]
+        while len(pending) > 0:
+            node = pending.pop()
+            if node not in invalid:
+                invalid.add(node)
+                if self.tree.hasNode(node):
+                    pending.extend(self.tree.getOutEdges(node).keys())
+
+    def _label(self,node,distance,parent):
+        tree = self.tree
+        if tree.hasNode(node):
+            for old_parent in list(tree.getNode(node).arrows_in):
+                tree.removeEdge(old_parent,node)
+        tree.addEdge(parent,node,distance)
+        tree.setNodeData(node,distance)
+
+    def repair(self,removed_nodes=(),removed_edges=(),added_edges=()):
+        """
+        Bring the tree up to date after the graph changed. The graph has to
+        contain the changes already, edges of removed nodes need not be given.
+        """
+        tree = self.tree
+        if self.root in removed_nodes:
+            raise Exception(f"Root node { self.root } removed")
+        invalid = set()
+        for node in removed_nodes:
+            if tree.hasNode(node):
+                for child in tree.getOutEdges(node):
+                    self._subtree(child,invalid)
+                tree.removeNode(node)
+        for n1,n2 in removed_edges:
+            if tree.hasNode(n1) and n2 in tree.getOutEdges(n1):
+                self._subtree(n2,invalid)
+        for node in invalid:
+            tree.removeNode(node)
+
+        # Candidate labels, from the intact part of the tree into the
+        # invalidated subtrees and along new edges.
+        queue = list()
+        for node in invalid:
+            if self.graph.hasNode(node):
+                for neighbor in self.graph.getNode(node).arrows_in:
+                    if tree.hasNode(neighbor):
+                        queue.append((tree.getNodeData(neighbor) + 1,node,neighbor))
+        for n1,n2 in added_edges:
+            if tree.hasNode(n1) and self.graph.hasNode(n2):
+                queue.append((tree.getNodeData(n1) + 1,n2,n1))
+        heapq.heapify(queue)
+
+        relabeled = 0
+        while len(queue) > 0:
+            distance, node, parent = heapq.heappop(queue)
+            if tree.hasNode(node) and tree.getNodeData(node) <= distance:
+                continue
+            self._label(node,distance,parent)
+            relabeled += 1
+            for target in self.graph.getOutEdges(node):
+                if not tree.hasNode(target) or tree.getNodeData(target) > distance + 1:
+                    heapq.heappush(queue,(distance + 1,target,node))
+        logging.debug(f"Spantree repair: { len(invalid) } nodes invalidated, { relabeled } relabeled")
+        return self.tree
+
+
 def getTreeSubtrees(graph,tree):
     """
     Generates a list of childs which are connected.
@@ -137,7 +374,7 @@ def getTreeSubtrees(graph,tree):
     while len(childs) > 0:
         child = childs.pop()
         child_data = graph.getNodeData(child)
-        if child_data.isStartNode():
+        if child_data is not None and child_data.isStartNode():
             logging.debug(f"Node { child } is a starting node")
             childs.extend(tree.getOutEdges(child).keys())
         else:
@@ -148,6 +385,11 @@ def getSubtreeNodes(tree,child):
     Starting from child walks upwards in the graph, and returns
     a stream of childs in the subtree.
     """
+    if isinstance(tree,(Tree,CompactTree)) and tree.root_node is not None:
+        index = getSubtreeIndex(tree)
+        if index.hasNode(child):
+            yield from index.subtreeNodes(child)
+            return
     childs = list(tree.getOutEdges(child).keys())
     yield child
 
@@ -161,6 +403,10 @@ def getLeafs(tree):
     Search for leafs in a graph, by the degree of nodes.
     By definition leafs have a degree equal to one. 
     """
+    if isinstance(tree,(Tree,CompactTree)) and tree.root_node is not None:
+        return list(getSubtreeIndex(tree).leafs)
+    if isinstance(tree,CompactGraph):
+        return tree.getLeafs()
     leafs = list()
     for node in tree.getNodes():
         # Leafs have no outgoing edges in our data model
@@ -168,9 +414,11 @@ def getLeafs(tree):
             leafs.append(node)
     return leafs
 
+VIRTUAL_IDENT = "_VIRTUAL"
+
 def addVirtualNode(graph,neighbors):
     virtual_id = graph.numNodes()
-    graph.setNodeIdent(virtual_id, "_VIRTUAL")
+    graph.setNodeIdent(virtual_id, VIRTUAL_IDENT)
     num = 0
     for neighbor in neighbors:
         try:
@@ -190,6 +438,15 @@ def getComponents(graph):
     """
     Disassemble the graph into its connectivity components.
     """
+    if isinstance(graph,CompactGraph):
+        return graph.getComponents()
+    return _joinComponents(graph.getEdges())
+
+def _joinComponents(edges):
+    """
+    Components of the nodes of edges, in the order getComponents finds
+    them.
+    """
 
     def findComponent(components,node):
         # Search existing components
@@ -212,7 +469,7 @@ def getComponents(graph):
 
 
     components = []
-    for src,dst in graph.getEdges():
+    for src,dst in edges:
         sc = findComponent(components,src)
         dc = findComponent(components,dst)
         joinComponents(components,sc,dc)
@@ -225,3 +482,269 @@ def isConnectedTo(graph,node_id):
     """
     len(getComponents(graph)) == 1
 
+
+def _neighbors(graph,node):
+    """
+    Undirected neighborhood of a node, as seen by getComponents.
+    """
+    gnode = graph.getNode(node)
+    yield from gnode.arrows_out
+    yield from gnode.arrows_in
+
+def splitOff(graph,center,node):
+    """
+    Remove node from graph. Returns the components formerly linked to it
+    which lost their connection to center, as lists of nodes. These are
+    left in the graph. The search from center ends as soon as all former
+    neighbors are reached. Like in getComponents nodes left without any
+    edge do not form a component.
+    """
+    neighbors = set(_neighbors(graph,node))
+    neighbors.discard(node)
+    graph.removeNode(node)
+    missing = set(neighbors)
+    missing.discard(center)
+    seen = set([center])
+    pending = [center]
+    while len(pending) > 0 and len(missing) > 0:
+        current = pending.pop()
+        for neighbor in _neighbors(graph,current):
+            if neighbor not in seen:
+                seen.add(neighbor)
+                missing.discard(neighbor)
+                pending.append(neighbor)
+    disconnected = list()
+    members = set()
+    for start in missing:
+        if start in members or graph.getNode(start).degree() == 0:
+            continue
+        component = [start]
+        members.add(start)
+        for current in component:
+            for neighbor in _neighbors(graph,current):
+                if neighbor not in members:
+                    members.add(neighbor)
+                    component.append(neighbor)
+        disconnected.append(component)
+    return disconnected
+
+@attr.s
+class SplitTracker:
+    """
+    Offline connectivity oracle for a known sequence of node removals.
+
+    The removal sequence is replayed backwards once with a union find,
+    re-adding each node and recording the pieces its removal leaves
+    behind. Replaying the removals forward then answers the question
+    getComponents answers after every removal, without recomputing the
+    components of the whole graph.
+
+    Nodes without any edge do not belong to a component, just like in
+    getComponents. Disconnected components are returned as getComponents
+    would return them.
+    """
+    graph = attr.ib(type=Graph)
+    center = attr.ib()
+    removals = attr.ib(factory=list)
+    splits = attr.ib(factory=dict)
+    stray = attr.ib(factory=list)
+    center_connected = attr.ib(type=bool,default=False)
+    labels = attr.ib(default=None)
+    looped = attr.ib(factory=set)
+    order = attr.ib(factory=dict)
+
+    def __attrs_post_init__(self):
+        self.order = { node: pos for pos, node in enumerate(self.graph.getNodes()) }
+        self._replay()
+        self._label()
+
+    def _replay(self):
+        time = dict()
+        for idx, node in enumerate(self.removals):
+            if node not in time and node != self.center and self.graph.hasNode(node):
+                time[node] = idx
+        never = len(self.removals)
+
+        parent = dict()
+        size = dict()
+
+        def find(node):
+            root = parent.setdefault(node,node)
+            while root != parent[root]:
+                root = parent[root]
+            while node != root:
+                parent[node], node = root, parent[node]
+            return root
+
+        def union(n1,n2):
+            r1, r2 = find(n1), find(n2)
+            if r1 == r2:
+                return
+            s1, s2 = size.get(r1,1), size.get(r2,1)
+            if s1 < s2:
+                r1, r2 = r2, r1
+            parent[r2] = r1
+            size[r1] = s1 + s2
+
+        looped = self.looped
+        for n1,n2 in self.graph.getEdges():
+            if n1 == n2:
+                looped.add(n1)
+            elif n1 not in time and n2 not in time:
+                union(n1,n2)
+
+        for node, idx in sorted(time.items(), key=lambda item: item[1], reverse=True):
+            pieces = dict()
+            for neighbor in _neighbors(self.graph,node):
+                if neighbor != node and time.get(neighbor,never) > idx:
+                    pieces.setdefault(find(neighbor),neighbor)
+            center_root = find(self.center)
+            self.splits[node] = [
+                    (rep, size.get(root,1) > 1 or rep in looped, root == center_root)
+                    for root, rep in pieces.items()
+                    ]
+            for rep in pieces.values():
+                union(node,rep)
+
+    def _label(self):
+        """
+        Label the components of the graph as it is before any removal.
+        """
+        self.labels = dict()
+        for start in self.graph.getNodes():
+            if start in self.labels or self.graph.getNode(start).degree() == 0:
+                continue
+            self.labels[start] = start
+            pending = [start]
+            while len(pending) > 0:
+                node = pending.pop()
+                for neighbor in _neighbors(self.graph,node):
+                    if neighbor not in self.labels:
+                        self.labels[neighbor] = start
+                        pending.append(neighbor)
+            if start == self.labels.get(self.center):
+                self.center_connected = True
+            else:
+                self.stray.append(start)
+
+    def _component(self,start):
+        component = [start]
+        seen = set(component)
+        for node in component:
+            for neighbor in _neighbors(self.graph,node):
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    component.append(neighbor)
+        return component
+
+    def _edges(self,nodes):
+        """
+        Edges of the disconnected nodes, in the order of getEdges.
+        """
+        for node in sorted(nodes,key=self.order.__getitem__):
+            for neighbor in self.graph.getNode(node).arrows_out:
+                yield (node,neighbor)
+
+    def split(self,node):
+        """
+        Account for the removal of node, which must already be removed from
+        the graph. Returns the components which are no longer connected to
+        the center, or an empty list if the graph has a single component.
+        The caller is expected to remove the returned nodes from the graph.
+        """
+        pieces = self.splits[node]
+        if len(pieces) > 0 or node in self.looped:
+            connected = [rep for rep, has_edges, _ in pieces if has_edges]
+            if any(is_center for _, _, is_center in pieces):
+                self.center_connected = any(
+                        is_center and has_edges for _, has_edges, is_center in pieces)
+                connected = [rep for rep, has_edges, is_center in pieces if has_edges and not is_center]
+            elif len(self.stray) == 1:
+                self.stray = []
+            else:
+                # Several stray components only exist before the first check
+                label = self.labels[node]
+                self.stray = [rep for rep in self.stray if self.labels[rep] != label]
+            self.stray.extend(connected)
+        self.labels = None
+
+        if len(self.stray) + self.center_connected <= 1:
+            return []
+        nodes = set()
+        for rep in self.stray:
+            nodes.update(self._component(rep))
+        self.stray = []
+        return _joinComponents(self._edges(nodes))
+
+@attr.s
+class BlockCutTree:
+    """
+    Biconnected blocks and articulation points of the component of root,
+    found in a single iterative Tarjan pass over the undirected graph.
+    Every articulation point is linked to the blocks containing it.
+    Removing a node disconnects part of the component from root exactly
+    if it is an articulation point.
+    """
+    root = attr.ib()
+    articulation = attr.ib(factory=set)
+    blocks = attr.ib(factory=list)
+    reached = attr.ib(factory=dict)
+
+    @classmethod
+    def from_graph(cls,graph,root):
+        cut = cls(root)
+        disc = cut.reached
+        low = dict()
+        disc[root] = low[root] = 0
+        edges = list()
+        root_childs = 0
+        pending = [(root,None,iter(set(_neighbors(graph,root))))]
+        while len(pending) > 0:
+            node, parent, neighbors = pending[-1]
+            for neighbor in neighbors:
+                if neighbor == node or neighbor == parent:
+                    continue
+                if neighbor not in disc:
+                    disc[neighbor] = low[neighbor] = len(disc)
+                    edges.append((node,neighbor))
+                    pending.append((neighbor,node,iter(set(_neighbors(graph,neighbor)))))
+                    break
+                if disc[neighbor] < disc[node]:
+                    # Back edge to an ancestor
+                    low[node] = min(low[node],disc[neighbor])
+                    edges.append((node,neighbor))
+            else:
+                pending.pop()
+                if parent is None:
+                    continue
+                low[parent] = min(low[parent],low[node])
+                if low[node] >= disc[parent]:
+                    # parent separates the subtree of node
+                    block = set()
+                    while True:
+                        edge = edges.pop()
+                        block.update(edge)
+                        if edge == (parent,node):
+                            break
+                    cut.blocks.append(block)
+                    if parent == root:
+                        root_childs += 1
+                    else:
+                        cut.articulation.add(parent)
+        if root_childs > 1:
+            cut.articulation.add(root)
+        return cut
+
+    def isArticulation(self,node):
+        return node in self.articulation
+
+    def isReached(self,node):
+        return node in self.reached
+
+    def edges(self):
+        """
+        Edges of the block-cut tree as (block index, articulation point).
+        """
+        for idx, block in enumerate(self.blocks):
+            for node in block & self.articulation:
+                yield (idx, node)
@@ -1,40 +1,430 @@
-import requests
+import attr
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+
 from ffua.graph import Graph
-from ffua.node import NodeMetaData
-
-def getDataFromHopGlass(url):
-    graphurl = url + "/graph.json"
-    nodesurl = url + "/nodes.json"
-    request = requests.get(nodesurl)
-
-    if request.ok:
-        nodes = request.json()
-        nodemap = dict()
-        for node in nodes['nodes']:
-            node_id = node['nodeinfo']['node_id']
-            if node_id in nodemap:
-                if node['nodeinfo']['flags']['online']:
-                  nodemap[node_id] = node
+from ffua.node import NodeMetaData, logMissingFields
+
+class JsonStream:
+    """
+    Incremental reader for a JSON document on a text stream.
+    Only single array elements and scalar values are decoded at once,
+    so memory is bounded by the largest element instead of the document.
+    """
+
+    def __init__(self,stream,chunksize=1 << 16):
+        self.stream = stream
+        self.chunksize = chunksize
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunksize)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise Exception("Unexpected end of JSON document")
+
+    def _expect(self,chars):
+        char = self._peek()
+        if char not in chars:
+            raise Exception(f"Malformed JSON document, expected { chars } got { char }")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer,self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # Numbers and literals at the end of the buffer may be cut off
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def items(self,paths,prefix=()):
+        """
+        Walks the document and yields (path, element) for every element of
+        the arrays at the given key paths. Everything else is skipped.
+        """
+        char = self._peek()
+        wanted = any(path[:len(prefix)] == prefix for path in paths)
+        if char == '{' and wanted:
+            self.pos += 1
+            if self._peek() == '}':
+                self.pos += 1
+                return
+            while True:
+                key = self.value()
+                self._expect(':')
+                yield from self.items(paths,prefix + (key,))
+                if self._expect(',}') == '}':
+                    return
+        elif char == '[' and prefix not in paths:
+            # Skip arrays element by element
+            self.pos += 1
+            if self._peek() == ']':
+                self.pos += 1
+                return
+            while True:
+                yield from self.items([],prefix)
+                if self._expect(',]') == ']':
+                    return
+        elif char == '[':
+            self.pos += 1
+            if self._peek() == ']':
+                self.pos += 1
+                return
+            while True:
+                yield (prefix, self.value())
+                if self._expect(',]') == ']':
+                    return
+        else:
+            self.value()
+
+def isLocal(url):
+    return url.startswith("file://") or "://" not in url
+
+def localPath(url):
+    if url.startswith("file://"):
+        url = url[7:]
+    return Path(url)
+
+def listSnapshots(url):
+    """
+    Snapshot directories below a local path, oldest first.
+    A directory directly holding the json documents is its own snapshot.
+    """
+    path = localPath(url)
+    if (path / "graph.json").is_file():
+        return [path]
+    return sorted(child for child in path.iterdir() if (child / "graph.json").is_file())
+
+def createSession(pool_size=4):
+    # requests takes a while to import and is only needed for remote hopglass
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,pool_maxsize=pool_size)
+    session.mount("http://",adapter)
+    session.mount("https://",adapter)
+    session.headers['Accept-Encoding'] = 'gzip'
+    return session
+
+@attr.s
+class RemoteDocument:
+    """
+    A hopglass document read straight from the web server, the response
+    is decoded while it is parsed and never held as a whole.
+    Opened like a Path.
+    """
+    session = attr.ib()
+    url = attr.ib()
+    name = attr.ib()
+    timeout = attr.ib(default=30)
+
+    def open(self,mode='r',encoding='utf-8'):
+        response = self.session.get(self.url.rstrip("/") + "/" + self.name,stream=True,timeout=self.timeout)
+        if not response.ok:
+            raise Exception(f"Fetching { self.name } from { self.url } failed with { response.status_code }")
+        response.raw.decode_content = True
+        return io.TextIOWrapper(response.raw,encoding=encoding)
+
+@attr.s
+class Fetcher:
+    """
+    Downloads hopglass documents into an on-disk snapshot cache.
+
+    Cached documents younger than max_age are used as they are, older
+    ones are revalidated with a conditional GET. If hopglass is not
+    reachable the cached document is used regardless of its age.
+    Without a cache path nothing is downloaded up front, the documents
+    are streamed into the parser as RemoteDocument. The HTTP session is
+    created on the first request and closed with the fetcher.
+    """
+    path = attr.ib(default=None)
+    max_age = attr.ib(default=300)
+    timeout = attr.ib(default=30)
+    session = attr.ib(default=None)
+    hits = attr.ib(default=0)
+    lock = attr.ib(factory=threading.Lock,repr=False,eq=False)
+
+    @classmethod
+    def from_config(cls,config):
+        fetcher = cls()
+        if 'path' in config:
+            fetcher.path = Path(config['path'])
+        if 'max_age' in config:
+            fetcher.max_age = config['max_age']
+        if 'timeout' in config:
+            fetcher.timeout = config['timeout']
+        return fetcher
+
+    def close(self):
+        with self.lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def _cacheDirectory(self,url):
+        directory = self.path / hashlib.sha256(url.encode()).hexdigest()[:16]
+        directory.mkdir(parents=True,exist_ok=True)
+        return directory
+
+    def _hit(self):
+        with self.lock:
+            self.hits += 1
+
+    def _session(self):
+        with self.lock:
+            if self.session is None:
+                self.session = createSession()
+        return self.session
+
+    def fetch(self,url,name):
+        """
+        Returns the path of an up to date copy of the document, or the
+        RemoteDocument to stream without a cache path.
+        """
+        import requests
+
+        if self.path is None:
+            return RemoteDocument(self._session(),url,name,self.timeout)
+        directory = self._cacheDirectory(url)
+        document = directory / name
+        meta_path = directory / (name + ".meta")
+        meta = dict()
+        if document.is_file() and meta_path.is_file():
+            meta = json.loads(meta_path.read_text())
+            if time.time() - meta.get('fetched',0) < self.max_age:
+                logging.debug(f"Using cached { name } from { url }")
+                self._hit()
+                return document
+
+        headers = dict()
+        if 'etag' in meta:
+            headers['If-None-Match'] = meta['etag']
+        if 'last_modified' in meta:
+            headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            response = self._session().get(url.rstrip("/") + "/" + name,
+                    headers=headers,stream=True,timeout=self.timeout)
+            if response.status_code == 304:
+                logging.debug(f"{ name } from { url } not modified")
+                self._hit()
             else:
-                nodemap[node_id] = node
-
-    graph = Graph()
-    request = requests.get(graphurl)
-    if request.ok:
-        jgraph = request.json()
-        cnt = 0
-        n2g = dict()
-        g2n = dict()
-        for node in jgraph['batadv']['nodes']:
-            if "node_id" in node:
-                node_id = node['node_id']
-                graph.setNodeData(cnt,NodeMetaData(node_id,nodemap[node_id]))
-                graph.setNodeIdent(cnt,node_id)
+                response.raise_for_status()
+                with tempfile.NamedTemporaryFile(dir=directory,delete=False) as output:
+                    try:
+                        for chunk in response.iter_content(chunk_size=1 << 16):
+                            output.write(chunk)
+                    except:
+                        output.close()
+                        os.unlink(output.name)
+                        raise
+                try:
+                    os.replace(output.name,document)
+                except:
+                    os.unlink(output.name)
+                    raise
+                meta = dict()
+                if 'ETag' in response.headers:
+                    meta['etag'] = response.headers['ETag']
+                if 'Last-Modified' in response.headers:
+                    meta['last_modified'] = response.headers['Last-Modified']
+        except requests.RequestException as e:
+            if not document.is_file():
+                raise Exception(f"Fetching { name } from { url } failed: { e }")
+            logging.warning(f"Fetching { name } from { url } failed, using cached copy: { e }")
+            self._hit()
+            return document
+        meta['fetched'] = time.time()
+        meta_path.write_text(json.dumps(meta))
+        return document
+
+    def fetchAll(self,url,names):
+        """
+        Fetch several documents of one hopglass instance concurrently.
+        """
+        if self.path is not None:
+            self._cacheDirectory(url)
+        self._session()
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            return list(executor.map(lambda name: self.fetch(url,name),names))
+
+def readNodes(stream,missing=None):
+    """
+    Parse nodes.json into NodeMetaData by node_id, the raw records are
+    dropped right away. Lacking fields are counted in missing.
+    """
+    nodemap = dict()
+    for _, node in JsonStream(stream).items([('nodes',)]):
+        node_id = node['nodeinfo']['node_id']
+        data = NodeMetaData.from_raw(node_id,node,missing)
+        if node_id in nodemap:
+            if data.isOnline():
+                nodemap[node_id] = data
+        else:
+            nodemap[node_id] = data
+    return nodemap
+
+def _readGraph(stream,nodemap,graph=None,missing=None):
+    """
+    Build the network graph out of graph.json and the node data of
+    nodemap. Given the graph of other mesh domains, the nodes are added to
+    it with fresh node ids, nodes already in it are merged by their ident.
+    The address index is left to the caller.
+    """
+    if missing is None:
+        missing = Counter()
+    if graph is None:
+        graph = Graph()
+        ids = None
+    else:
+        # Node ids of the positions in graph.json
+        ids = list()
+        known = dict(graph.identmap)
+        # Links to positions not read yet
+        pending = list()
+    cnt = graph.numNodes()
+    for path, item in JsonStream(stream).items([('batadv','nodes'),('batadv','links')]):
+        if path[-1] == 'nodes':
+            data = None
+            if "node_id" in item:
+                node_id = item['node_id']
+                if node_id in nodemap:
+                    data = nodemap[node_id]
+                else:
+                    logging.warning(f"Node { node_id } missing in nodes.json")
+                    data = NodeMetaData.from_raw(node_id,missing=missing)
             else:
-                node_id = node['id'].replace(':','')
-                graph.setNodeIdent(cnt,node_id)
+                node_id = item['id'].replace(':','')
+            if ids is not None and node_id in known:
+                # Node seen in another mesh domain, prefer its online copy
+                node = known[node_id]
+                if data is not None and (graph.getNodeData(node) is None or data.isOnline()):
+                    graph.setNodeData(node,data)
+                ids.append(node)
+                continue
+            if data is not None:
+                graph.setNodeData(cnt,data)
+            graph.setNodeIdent(cnt,node_id)
+            if ids is not None:
+                ids.append(cnt)
             cnt = cnt + 1
-        for link in jgraph['batadv']['links']:
-            graph.addEdge(link['source'],link['target'],link['tq'])
+        elif ids is None:
+            graph.addEdge(item['source'],item['target'],item['tq'])
+        elif max(item['source'],item['target']) >= len(ids):
+            pending.append((item['source'],item['target'],item['tq']))
+        else:
+            graph.addEdge(ids[item['source']],ids[item['target']],item['tq'])
+    if ids is not None:
+        for source, target, tq in pending:
+            graph.addEdge(ids[source],ids[target],tq)
+    logMissingFields(missing)
+    return graph
+
+def _documentPaths(url,fetcher):
+    if isLocal(url):
+        snapshots = listSnapshots(url)
+        if len(snapshots) == 0:
+            raise Exception(f"No hopglass snapshot in { url }")
+        return [ snapshots[-1] / "nodes.json", snapshots[-1] / "graph.json" ]
+    return fetcher.fetchAll(url,["nodes.json","graph.json"])
 
+def hopglassSources(url):
+    """
+    The hopglass setting as list, it is a url or a list of urls.
+    """
+    sources = [ url ] if isinstance(url,str) else list(url)
+    if len(sources) == 0:
+        raise Exception("No hopglass source given")
+    return sources
+
+def documentPaths(url,fetcher=None):
+    """
+    Local paths of nodes.json and graph.json of a hopglass instance or
+    local snapshot. With a list of those, one per mesh domain, the paths
+    of all are returned in turn. Remote documents are fetched concurrently
+    through the fetcher, without a cache path they are RemoteDocument to
+    be streamed.
+    """
+    sources = hopglassSources(url)
+    if fetcher is None:
+        fetcher = Fetcher()
+    if len(sources) == 1:
+        return _documentPaths(sources[0],fetcher)
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        paths = list(executor.map(lambda source: _documentPaths(source,fetcher),sources))
+    return [ path for pair in paths for path in pair ]
+
+def readDocuments(paths):
+    """
+    Network graph of the nodes.json and graph.json paths of one or more
+    mesh domains, as given by documentPaths. The domains are merged into
+    one graph.
+    """
+    if len(paths) == 0 or len(paths) % 2 != 0:
+        raise Exception("Expected nodes.json and graph.json of every hopglass source")
+    graph = None
+    for nodes_path, graph_path in zip(paths[0::2],paths[1::2]):
+        # Fields lacking in the nodes of this domain
+        missing = Counter()
+        with nodes_path.open('r',encoding='utf-8') as stream:
+            nodemap = readNodes(stream,missing)
+        with graph_path.open('r',encoding='utf-8') as stream:
+            graph = _readGraph(stream,nodemap,graph,missing)
+    graph.buildAddressIndex()
     return graph
+
+def getDataFromHopGlass(url,fetcher=None):
+    """
+    Build the network graph from a hopglass instance or a local snapshot,
+    or a list of those. Both documents are parsed incrementally.
+    """
+    if fetcher is None:
+        with Fetcher() as fetcher:
+            return readDocuments(documentPaths(url,fetcher))
+    return readDocuments(documentPaths(url,fetcher))
+
+def iterSnapshots(url):
+    """
+    Replay a directory of snapshots, yields (name, graph) oldest first.
+    """
+    for snapshot in listSnapshots(url):
+        yield (snapshot.name, getDataFromHopGlass(str(snapshot)))
@@ -1,35 +1,250 @@
+import attr
+import importlib
+import io
+import ipaddress
 import logging
+import os
+from pathlib import Path
+import shutil
+import tempfile
 
-def htAllowNode(node,output):
-    print(f"# { node.getHostname() }",file=output)
-    print(f"# { node.getFirmwareVersion() }",file=output)
-    branch = node.getBranch()
-    if branch is not None:
-        print(f"# { branch }",file=output)
-    for address in node.getAddresses():
-        print(f"allow from { address }",file=output)
-
-def generateHtAccessRulesForBranch(branch,generator,config):
-    branch = config.branches[branch]
-    htaccess_path = branch.getSysupgradePath() / ".htaccess"
-    with open(htaccess_path,"w") as output:
-        generateHtAccessRules(generator, config.nets, output)
+from ffua.util import writeIfChanged
+
+@attr.s
+class HtAccessUpdate:
+    """
+    Outcome of regenerating the htaccess file of a branch.
+    """
+    branch = attr.ib(type=str)
+    changed = attr.ib(type=bool,default=False)
+    # Written for the first time, nothing to compare with
+    created = attr.ib(type=bool,default=False)
+    added = attr.ib(factory=set)
+    removed = attr.ib(factory=set)
+
+def htAllowNode(node,output,addresses=True,comments=True):
+    if comments:
+        print(f"# { node.getHostname() }",file=output)
+        print(f"# { node.getFirmwareVersion() }",file=output)
+        branch = node.getBranch()
+        if branch is not None:
+            print(f"# { branch }",file=output)
+    if addresses:
+        for address in node.getAddresses():
+            print(f"allow from { address }",file=output)
+
+def aggregateAddresses(addresses,known=None):
+    """
+    Smallest set of networks covering addresses. Given the addresses known
+    in the mesh, IPv6 addresses are widened to their /64 as long as no
+    known address outside of addresses falls inside.
+    """
+    allowed = set(addresses)
+    blocked = set()
+    if known is not None:
+        for address in known:
+            if address.version == 6 and address not in allowed:
+                blocked.add(ipaddress.ip_network((address,64),strict=False))
+    networks = { 4: list(), 6: list() }
+    for address in allowed:
+        network = ipaddress.ip_network(address)
+        if known is not None and address.version == 6:
+            prefix = ipaddress.ip_network((address,64),strict=False)
+            if prefix not in blocked:
+                network = prefix
+        networks[address.version].append(network)
+    return list(ipaddress.collapse_addresses(networks[4])) + list(ipaddress.collapse_addresses(networks[6]))
+
+def _network(network):
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return network.with_prefixlen
+
+def allowedAddresses(content):
+    """
+    Addresses allowed by the rules in content.
+    """
+    return set(line[11:] for line in content.splitlines() if line.startswith("allow from "))
+
+def generateHtAccessRulesForBranch(branch,generator,config,known=None):
+    """
+    Write the htaccess file of branch allowing the nodes of generator.
+    known are the addresses of all nodes in the mesh, needed to aggregate
+    by prefix.
+    """
+    htaccess_path = config.branches[branch].getSysupgradePath() / ".htaccess"
+    output = io.StringIO()
+    if config.aggregate == "prefix" and known is None:
+        raise Exception("Aggregating by prefix needs the addresses known in the mesh")
+    generateHtAccessRules(generator, config.nets, output, config.aggregate, known, config.comments)
+    content = output.getvalue()
+    update = HtAccessUpdate(branch)
+    previous = writeIfChanged(htaccess_path,content)
+    if previous is None:
+        logging.info(f"Branch { branch }: rules unchanged")
+    else:
+        allowed = allowedAddresses(content)
+        allowed_before = allowedAddresses(previous)
+        update.changed = True
+        update.added = allowed - allowed_before
+        update.removed = allowed_before - allowed
+        logging.info(f"Branch { branch }: { len(update.added) } addresses added, { len(update.removed) } removed")
+    return update
+
+# Python dbm modules writing the formats of the Apache dbm map types
+DBM_MODULES = { 'gdbm': "dbm.gnu", 'ndbm': "dbm.ndbm" }
+
+def mapAddresses(content):
+    """
+    Addresses allowed by a RewriteMap in txt format.
+    """
+    return set(line.split(" ",1)[0] for line in content.splitlines() if line.endswith(" allow"))
+
+def writeDbm(path,entries,maptype):
+    """
+    Build a dbm map of maptype from entries in a fresh directory, named
+    map in there, and swap the symlink path over to it. ndbm writes
+    several files, replacing those one by one could show Apache a mix of
+    the old and new map. The directories of former maps are removed.
+    """
+    try:
+        module = importlib.import_module(DBM_MODULES[maptype])
+    except ImportError:
+        raise Exception(f"Python lacks { DBM_MODULES[maptype] } to write { maptype } maps, set the rewritemap type to txt")
+    directory = Path(tempfile.mkdtemp(dir=path.parent,prefix=path.name + "."))
+    try:
+        db = module.open(str(directory / "map"),"n")
+        try:
+            for key in entries:
+                db[key] = "allow"
+        finally:
+            db.close()
+        os.chmod(directory,0o755)
+        link = path.parent / (directory.name + ".link")
+        os.symlink(directory.name,link)
+        os.replace(link,path)
+    except:
+        shutil.rmtree(directory)
+        raise
+    for former in path.parent.glob(path.name + ".*"):
+        if former != directory and former.is_dir() and not former.is_symlink():
+            shutil.rmtree(former)
+
+def mapType(config):
+    return config.rewritemap.get('type',"gdbm")
+
+def rewriteMapPath(branch,config):
+    return Path(config.rewritemap['path']) / f"{ branch }.map"
+
+def dbmPath(branch,config):
+    """
+    Symlink to the directory holding the dbm map of branch.
+    """
+    path = rewriteMapPath(branch,config)
+    return path.parent / f"{ path.name }.{ mapType(config) }"
+
+def generateRewriteMapForBranch(branch,generator,config):
+    """
+    Write the RewriteMap of branch, mapping every address of the allowed
+    nodes to allow. The map is written in txt format and, unless the type
+    is txt, also converted into a hashed dbm map.
+    """
+    path = rewriteMapPath(branch,config)
+    addresses = dict()
+    for nodedata in generator:
+        try:
+            for address in nodedata.getAddresses():
+                addresses[str(address)] = None
+        except Exception as e:
+            logging.exception(e)
+    content = f"# Allowed nodes of { branch }\n" + "".join(f"{ address } allow\n" for address in addresses)
+    update = HtAccessUpdate(branch)
+    path.parent.mkdir(parents=True,exist_ok=True)
+    maptype = mapType(config)
+    served = path if maptype == "txt" else dbmPath(branch,config)
+    update.created = not served.exists()
+    previous = writeIfChanged(str(path),content)
+    if previous is None and not update.created:
+        logging.info(f"Branch { branch }: map unchanged")
+        return update
+    if maptype != "txt":
+        writeDbm(served,addresses,maptype)
+    update.changed = True
+    if update.created:
+        logging.info(f"Branch { branch }: map created with { len(addresses) } addresses")
+        return update
+    allowed = set(addresses)
+    allowed_before = mapAddresses(previous or "")
+    update.added = allowed - allowed_before
+    update.removed = allowed_before - allowed
+    logging.info(f"Branch { branch }: { len(update.added) } addresses added, { len(update.removed) } removed")
+    return update
+
+def rewriteSnippet(config):
+    """
+    Apache configuration looking up the maps of all branches. Requests
+    from the denied nets to a sysupgrade directory are forbidden unless
+    the map of the branch allows the client address, like the htaccess
+    rules do.
+    """
+    maptype = mapType(config)
+    lines = [ "# Generated by ffua, include in the server or virtual host configuration" ]
+    for branch in config.branches:
+        if maptype == "txt":
+            source = f"txt:{ rewriteMapPath(branch,config) }"
+        else:
+            source = f"dbm={ maptype }:{ dbmPath(branch,config) / 'map' }"
+        lines.append(f'RewriteMap ffua-{ branch } "{ source }"')
+    for branch, branchdata in config.branches.items():
+        lines.append(f'<Directory "{ branchdata.getSysupgradePath() }">')
+        lines.append("    RewriteEngine on")
+        if len(config.nets) > 0:
+            nets = " || ".join(f"-R '{ net }'" for net in config.nets)
+            lines.append(f'    RewriteCond expr "{ nets }"')
+        lines.append(f"    RewriteCond ${{ffua-{ branch }:%{{REMOTE_ADDR}}|deny}} !=allow")
+        lines.append("    RewriteRule ^ - [F]")
+        lines.append("</Directory>")
+    return "\n".join(lines) + "\n"
+
+def writeRewriteSnippet(config):
+    path = Path(config.rewritemap['path']) / "ffua.conf"
+    path.parent.mkdir(parents=True,exist_ok=True)
+    if writeIfChanged(str(path),rewriteSnippet(config)) is not None:
+        logging.info(f"Rewrite snippet { path } changed, reload Apache")
+
+def generateRulesForBranch(branch,generator,config,known=None):
+    """
+    Write the rules of branch with the configured output backend.
+    """
+    if config.output == "rewritemap":
+        return generateRewriteMapForBranch(branch,generator,config)
+    return generateHtAccessRulesForBranch(branch,generator,config,known)
 
 def generateHtAccessRulesForBranches(generator,config):
     generator = list(generator)
-    for branch in config.branches:
-        generateHtAccessRulesForBranch(branch,generator,config)
+    return [ generateHtAccessRulesForBranch(branch,generator,config) for branch in config.branches ]
 
-def generateHtAccessRules(generator, nets, output):
-    
+def generateHtAccessRules(generator, nets, output, aggregate=None, known=None, comments=True):
+    """
+    Without aggregate every address gets its own allow line after the
+    comments of its node. With aggregate "cidr" the addresses of all nodes
+    are collapsed into covering networks, "prefix" also widens them to
+    /64 where possible, see aggregateAddresses.
+    """
     print("order deny,allow",file=output)
     num = 0
+    addresses = list()
     for nodedata in generator:
         try:
-            htAllowNode(nodedata,output)
+            htAllowNode(nodedata,output,aggregate is None,comments)
+            if aggregate is not None:
+                addresses.extend(nodedata.getAddresses())
             num = num + 1
         except Exception as e:
             logging.exception(e)
+    if aggregate is not None:
+        for network in aggregateAddresses(addresses,known if aggregate == "prefix" else None):
+            print(f"allow from { _network(network) }",file=output)
     if len(nets) == 0:
         print("deny from all",file=output)
     else:
@@ -0,0 +1,263 @@
+import calendar
+from contextlib import nullcontext
+from enum import auto,Enum
+from itertools import repeat
+import os
+import re
+import sys
+import time
+from typing import NamedTuple
+
+# Apache LogFormat of the firmware log, see README
+FIRMWARE_FORMAT = '%h "%r" %>s %b'
+
+# Bytes of a log file parsed by one worker
+CHUNK_SIZE = 32 * 2**20
+
+# Path of the standard input
+STDIN = "-"
+
+class RequestType(Enum):
+    Firmware = auto()
+    Manifest = auto()
+
+class Request(NamedTuple):
+    type: RequestType
+    source: str
+    method: str
+    branch: str
+    filename: str
+    time: float = None
+
+_directive = re.compile(r'%(?:!?[0-9,]+)?(?:\{([^}]*)\})?([<>]?)([a-zA-Z%])')
+
+_fields = {
+    'h': r'(?P<source>\S+)',
+    'a': r'(?P<source>\S+)',
+    'r': r'(?P<method>[A-Z]+) (?P<path>\S+)(?: [^"\s]*)?',
+    's': r'(?P<status>\d{3})',
+    'm': r'(?P<method>[A-Z]+)',
+    'U': r'(?P<path>\S+)',
+    't': r'\[(?P<time>[^\]]+)\]',
+    '%': r'%',
+}
+
+_months = { month: num for num, month in enumerate(["Jan","Feb","Mar","Apr","May","Jun",
+        "Jul","Aug","Sep","Oct","Nov","Dec"],1) }
+_logtime = re.compile(r'(\d{1,2})/(\w{3})/(\d{4}):(\d{2}):(\d{2}):(\d{2}) ([+-])(\d{2})(\d{2})')
+
+def parseLogTime(value):
+    """
+    Epoch of a %t timestamp like 10/Oct/2000:13:55:36 -0700, None if it
+    is malformed.
+    """
+    match = _logtime.fullmatch(value)
+    if match is None or match.group(2) not in _months:
+        return None
+    day, month, year, hour, minute, second, sign, tzhour, tzminute = match.groups()
+    epoch = calendar.timegm((int(year),_months[month],int(day),int(hour),int(minute),int(second)))
+    offset = int(tzhour) * 3600 + int(tzminute) * 60
+    return epoch - offset if sign == "+" else epoch + offset
+
+def compileLogFormat(logformat):
+    """
+    Translate an Apache LogFormat string into a single regular expression.
+    Directives not needed for request parsing are matched, but not captured.
+    """
+    pattern = []
+    groups = set()
+    pos = 0
+    for match in _directive.finditer(logformat):
+        pattern.append(re.escape(logformat[pos:match.start()]))
+        argument, _, directive = match.groups()
+        field = _fields.get(directive)
+        names = set(re.findall(r'\(\?P<(\w+)>',field or ''))
+        if field is None or argument or names & groups:
+            # Arguments like %{User-agent}i may contain blanks
+            field = r'.*?' if argument else r'\S*'
+        else:
+            groups.update(names)
+        pattern.append(field)
+        pos = match.end()
+    pattern.append(re.escape(logformat[pos:]))
+    regex = re.compile(''.join(pattern))
+    missing = {'source','method','path','status'} - set(regex.groupindex)
+    if len(missing) > 0:
+        raise Exception(f"LogFormat '{ logformat }' lacks fields for { ', '.join(sorted(missing)) }")
+    return regex
+
+def parse_logfile(logfile,with_manifest = False,logformat = FIRMWARE_FORMAT):
+    """
+    Stream sysupgrade requests out of a log file, line by line.
+    Lines not touching a sysupgrade directory are skipped before matching.
+    """
+    match = compileLogFormat(logformat).match
+    for line in logfile:
+        if "/sysupgrade/" not in line:
+            continue
+        request = _request(match(line),with_manifest)
+        if request is not None:
+            yield request
+
+def open_logfile(path):
+    """
+    Open a log file as bytes. Rotated archives compressed with gzip,
+    bzip2, xz or zstd are decompressed on the fly, zstd needs the
+    zstandard module. The path - reads the standard input, which is left
+    open.
+    """
+    path = str(path)
+    if path == STDIN:
+        return nullcontext(sys.stdin.buffer)
+    if path.endswith(".gz"):
+        import gzip
+        return gzip.open(path,"rb")
+    if path.endswith(".bz2"):
+        import bz2
+        return bz2.open(path,"rb")
+    if path.endswith(".xz"):
+        import lzma
+        return lzma.open(path,"rb")
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception(f"Reading { path } needs the zstandard module")
+        return zstandard.open(path,"rb")
+    return open(path,"rb")
+
+def _compressed(path):
+    return str(path).endswith((".gz",".bz2",".xz",".zst"))
+
+def _unseekable(path):
+    return str(path) == STDIN or _compressed(path)
+
+def logfile_chunks(path,chunk_size = CHUNK_SIZE):
+    """
+    Split a log file into (path, start, end) byte ranges of about
+    chunk_size, each ending at a line boundary. Compressed files and the
+    standard input can not be split and form a single chunk with end None.
+    """
+    if _unseekable(path):
+        return [ (str(path),0,None) ]
+    chunks = list()
+    with open(path,"rb") as logfile:
+        size = os.fstat(logfile.fileno()).st_size
+        start = 0
+        while start < size:
+            logfile.seek(start + chunk_size)
+            logfile.readline()
+            end = min(logfile.tell(),size)
+            chunks.append((str(path),start,end))
+            start = end
+    return chunks
+
+def _lines(chunk):
+    path, start, end = chunk
+    with open_logfile(path) as logfile:
+        if end is None:
+            for line in logfile:
+                yield line.decode("utf-8","replace")
+            return
+        logfile.seek(start)
+        # Chunks end at line boundaries, so splitting on newlines is exact
+        yield from logfile.read(end - start).decode("utf-8","replace").splitlines(True)
+
+def _parse_chunk(chunk,with_manifest,logformat):
+    return list(parse_logfile(_lines(chunk),with_manifest,logformat))
+
+def parse_logfiles(paths,with_manifest = False,logformat = FIRMWARE_FORMAT,jobs = None,chunk_size = CHUNK_SIZE):
+    """
+    Sysupgrade requests out of several, possibly compressed, log files,
+    in the order of paths and lines. The files are split into chunks,
+    which are parsed by a pool of jobs processes, all cpus by default.
+    A path - reads the standard input, then all chunks are parsed here.
+    """
+    # Fail on a broken format before starting any worker
+    compileLogFormat(logformat)
+    chunks = [ chunk for path in paths for chunk in logfile_chunks(path,chunk_size) ]
+    jobs = (os.cpu_count() or 1) if jobs is None else jobs
+    # Only this process can read the standard input
+    if jobs <= 1 or len(chunks) <= 1 or any(path == STDIN for path, _, _ in chunks):
+        for chunk in chunks:
+            yield from parse_logfile(_lines(chunk),with_manifest,logformat)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(min(jobs,len(chunks))) as pool:
+        # map returns the results in the order of the chunks
+        for requests in pool.map(_parse_chunk,chunks,repeat(with_manifest),repeat(logformat)):
+            yield from requests
+
+def follow_logfile(path,with_manifest = False,logformat = FIRMWARE_FORMAT,interval = 1.0,from_start = False):
+    """
+    Stream sysupgrade requests appended to a log file, like tail -F.
+    A rotated log file is read to its end before switching to the new
+    file, a truncated one is read again from the start. Whenever no new
+    line arrived, None is yielded after waiting interval seconds, so the
+    caller gets a chance for periodic work.
+    """
+    match = compileLogFormat(logformat).match
+    logfile = None
+    partial = b""
+    try:
+        while True:
+            if logfile is None:
+                try:
+                    logfile = open(path,"rb")
+                except FileNotFoundError:
+                    time.sleep(interval)
+                    yield None
+                    continue
+                if not from_start:
+                    logfile.seek(0,os.SEEK_END)
+                # Files showing up later are new, read them completely
+                from_start = True
+                partial = b""
+            line = logfile.readline()
+            if line:
+                if not line.endswith(b"\n"):
+                    partial += line
+                    continue
+                line = (partial + line).decode("utf-8","replace")
+                partial = b""
+                if "/sysupgrade/" in line:
+                    request = _request(match(line),with_manifest)
+                    if request is not None:
+                        yield request
+                continue
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                current = None
+            opened = os.fstat(logfile.fileno())
+            if current is None or (current.st_ino,current.st_dev) != (opened.st_ino,opened.st_dev):
+                logfile.close()
+                logfile = None
+                continue
+            if current.st_size < logfile.tell():
+                logfile.seek(0)
+                partial = b""
+                continue
+            time.sleep(interval)
+            yield None
+    finally:
+        if logfile is not None:
+            logfile.close()
+
+def _request(match,with_manifest):
+    if match is None:
+        return None
+    method, path, status = match.group('method','path','status')
+    if method != "GET" or status != "200":
+        return None
+    parts = path.rsplit("/",3)
+    if len(parts) < 2 or parts[-2] != "sysupgrade":
+        return None
+    branch = parts[-3] if len(parts) > 2 else ""
+    filename = parts[-1]
+    logtime = parseLogTime(match.group('time')) if 'time' in match.re.groupindex else None
+    if filename.endswith(".manifest") and filename != ".manifest":
+        if with_manifest:
+            return Request(RequestType.Manifest,match.group('source'),method,branch,filename,logtime)
+        return None
+    return Request(RequestType.Firmware,match.group('source'),method,branch,filename,logtime)
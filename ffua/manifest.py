@@ -1,6 +1,11 @@
 import attr
 from datetime import datetime
+import json
+import logging
+import os
 from pathlib import Path
+import tempfile
+import threading
 
 @attr.s
 class Manifest:
@@ -8,14 +13,30 @@ class Manifest:
     branch = attr.ib(type=str,default=None)
     priority = attr.ib(type=int,default=None)
     targets = attr.ib(factory=dict)
+    versions = attr.ib(default=None,repr=False)
 
     #date = attr.ib(type=datetime,factory=datetime)
 
     def getFirmwareVersion(self):
-        versions = dict()
-        for target in self.targets.values():
-            versions[target.version] = None
-        return list(versions.keys())
+        if self.versions is None:
+            versions = dict()
+            for target in self.targets.values():
+                versions[target.version] = None
+            self.versions = tuple(versions.keys())
+        return list(self.versions)
+
+    def to_dict(self):
+        return { 'branch': self.branch, 'priority': self.priority,
+                'targets': [ attr.asdict(firmware) for firmware in self.targets.values() ],
+                'versions': self.getFirmwareVersion() }
+
+    @classmethod
+    def from_dict(cls,manifest_path,data):
+        manifest = cls(manifest_path,data['branch'],data['priority'])
+        for firmware in data['targets']:
+            manifest.targets[firmware['target']] = Firmware(**firmware)
+        manifest.versions = tuple(data['versions'])
+        return manifest
 
     @classmethod
     def from_path(cls,manifest_path):
@@ -65,5 +86,52 @@ class Firmware:
     filename = attr.ib(type=str,default=None)
     filesize = attr.ib(type=str,default=None)
 
+@attr.s
+class ManifestCache:
+    """
+    Parsed manifests by path, valid as long as mtime and size of the file
+    are unchanged. With a path the cache is kept in a JSON file across
+    runs, save writes it once at the end of a run if a manifest had to be
+    parsed.
+    """
+    path = attr.ib(type=Path,default=None)
+    entries = attr.ib(factory=dict)
+    hits = attr.ib(default=0)
+    misses = attr.ib(default=0)
+    dirty = attr.ib(default=False,repr=False)
+    lock = attr.ib(factory=threading.Lock,repr=False)
+
+    def __attrs_post_init__(self):
+        if self.path is not None and self.path.is_file():
+            try:
+                self.entries = json.loads(self.path.read_text())
+            except ValueError as e:
+                logging.warning(f"Ignoring broken manifest cache { self.path }: { e }")
+
+    def save(self):
+        with self.lock:
+            if self.path is None or not self.dirty:
+                return
+            self.path.parent.mkdir(parents=True,exist_ok=True)
+            with tempfile.NamedTemporaryFile("w",dir=self.path.parent,prefix=self.path.name + ".",delete=False) as output:
+                json.dump(self.entries,output)
+            os.replace(output.name,self.path)
+            self.dirty = False
+
+    def load(self,manifest_path):
+        stat = manifest_path.stat()
+        stamp = [ stat.st_mtime_ns, stat.st_size ]
+        key = str(manifest_path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['stamp'] == stamp:
+                self.hits += 1
+                return Manifest.from_dict(manifest_path,entry['manifest'])
+            self.misses += 1
+            manifest = Manifest.from_path(manifest_path)
+            self.entries[key] = { 'stamp': stamp, 'manifest': manifest.to_dict() }
+            self.dirty = True
+            return manifest
+
 def parse_manifest(manifest_path):
     return Manifest.from_path(Path(manifest_path))
@@ -1,6 +1,8 @@
 import attr
-from datetime import datetime, timedelta
 import logging
+import time
+
+from ffua.graph import BlockCutTree
 
 
 
@@ -9,20 +11,23 @@ def has_active_childs(graph,tree,fwv,node):
     Check if a node has active childs in the tree.
     A child is active when it is offline or already has active firmware.
     """
-    now = datetime.utcnow()
+    now = time.time()
     for gchild,_ in tree.getOutEdges(node).items():
         data = graph.getNodeData(gchild)
-        lastseen = data.getLastSeen()
+        lastseen = data.getLastSeenEpoch()
         if data.getFirmwareVersion() in fwv:
             continue
         elif lastseen is not None:
-            if now - lastseen < timedelta(minutes=30):
+            if now - lastseen < 30 * 60:
                 return True
     return False
 
 @attr.s
 class Mechanism:
     config = attr.ib(factory=dict)
+    # Whether the allowed nodes depend on the time and lastseen, so they
+    # change without any change of the graph
+    uses_clock = False
 
 @attr.s
 class OuterToInnerUpgrade(Mechanism):
@@ -30,6 +35,7 @@ class OuterToInnerUpgrade(Mechanism):
     Allow updates only for the leafs of the spantree of the network graph.
     Except for the situation where every child of a node is inactive.
     """
+    uses_clock = True
     
     def __call__(self,graph,tree,branches):
 
@@ -48,6 +54,16 @@ class OuterToInnerUpgrade(Mechanism):
             except Exception as e:
                 logging.exception(e)
 
+    def allowMask(self,table,kept,branches):
+        """
+        Columnar version of __call__ on a NodeTable, see ffua.columns.
+        """
+        fwv = [ b.getFirmwareVersion().pop() for b in branches.values() ]
+        active = kept & ~table.isVersion(fwv) & (time.time() - table.lastseen < 30 * 60)
+        # A child without node data fails the check like an active one
+        blocking = table.childCount(active | (kept & ~table.hasdata))
+        return (table.degree(kept) == 1) | (blocking == 0)
+
 class MiauEnforce(Mechanism):
     """
     Enforce miau usage by allowing all nodes with distance less 
@@ -85,9 +101,49 @@ class MiauEnforce(Mechanism):
             except Exception as e:
                 logging.exception(e)
 
+    def allowMask(self,table,kept,branches):
+        """
+        Columnar version of __call__ on a NodeTable, see ffua.columns.
+        """
+        targetversions = [ b.getFirmwareVersion().pop() for b in branches.values() ]
+        uptodate = table.isVersion(targetversions) | ~table.isBranch(branches.keys())
+        return (table.distance <= self.config['min_distance']) | (table.hasdata & uptodate)
+
+@attr.s
+class SafeRemovalUpgrade(Mechanism):
+    """
+    Allow updates for every node whose removal does not disconnect any
+    other node from the starting nodes, i.e. every node of the spantree
+    except the articulation points of the network graph.
+    """
+    _cut = attr.ib(default=None,init=False,repr=False)
+
+    def prepare(self,graph,tree):
+        """
+        Find the articulation points once for all branches.
+        """
+        self._cut = BlockCutTree.from_graph(graph,tree.root_node)
+        logging.debug(f"{ len(self._cut.articulation) } articulation points, "
+                f"{ len(self._cut.blocks) } blocks")
+
+    def __call__(self,graph,tree,branches):
+        cut = self._cut
+        if cut is None or cut.root != tree.root_node:
+            cut = BlockCutTree.from_graph(graph,tree.root_node)
+        for node in tree.getNodes():
+            if node == cut.root or not cut.isReached(node) or cut.isArticulation(node):
+                continue
+            nodedata = graph.getNodeData(node)
+            if nodedata is None:
+                # Nodes lacking in nodes.json have no addresses to allow
+                logging.debug(f"Node { graph.getNode(node).ident } has no nodedata")
+                continue
+            yield nodedata
+
 mechansim_dict = {
         'outerToInnerUpgrade': OuterToInnerUpgrade,
-        'miauEnforce': MiauEnforce
+        'miauEnforce': MiauEnforce,
+        'safeRemovalUpgrade': SafeRemovalUpgrade
         }
 
 def mechanismFactory(name,config):
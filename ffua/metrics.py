@@ -0,0 +1,119 @@
+import attr
+import contextlib
+import cProfile
+import json
+import logging
+from pathlib import Path
+import resource
+import sys
+import time
+import tracemalloc
+
+from ffua.util import writeIfChanged
+
+def _maxrss():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+def _labels(**labels):
+    return ",".join(f'{ key }="{ value }"' for key, value in labels.items())
+
+@attr.s
+class Stage:
+    """
+    Measurements of one stage of a run. maxrss is the high water mark of
+    the whole process so far, as of the end of the stage, not of the
+    stage alone. peak is the largest traced allocation during the stage
+    if profiling.
+    """
+    name = attr.ib(type=str)
+    seconds = attr.ib(type=float,default=0.0)
+    maxrss = attr.ib(type=int,default=0)
+    peak = attr.ib(type=int,default=None)
+    counts = attr.ib(factory=dict)
+
+    def count(self,name,value):
+        self.counts[name] = value
+
+@attr.s
+class Metrics:
+    """
+    Collects per stage wall time, memory and counts of a run of tool.
+    With a profile directory every stage also dumps its cProfile stats and
+    a tracemalloc snapshot there.
+    """
+    tool = attr.ib(type=str)
+    profile = attr.ib(type=Path,default=None)
+    stages = attr.ib(factory=list)
+    timestamp = attr.ib(factory=time.time)
+
+    @contextlib.contextmanager
+    def stage(self,name):
+        stage = Stage(name)
+        self.stages.append(stage)
+        profiler = None
+        if self.profile is not None:
+            self.profile.mkdir(parents=True,exist_ok=True)
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                _, stage.peak = tracemalloc.get_traced_memory()
+                prefix = f"{ self.tool }-{ len(self.stages):02d}-{ name }"
+                profiler.dump_stats(self.profile / (prefix + ".prof"))
+                tracemalloc.take_snapshot().dump(self.profile / (prefix + ".tracemalloc"))
+            stage.maxrss = _maxrss()
+            logging.debug(f"Stage { name } took { stage.seconds:.3f}s { stage.counts }")
+
+    def reset(self):
+        self.stages = list()
+        self.timestamp = time.time()
+
+    def prometheus(self):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        families = dict()
+
+        def add(metric,help,stage,value):
+            family = families.setdefault(metric,[ f"# HELP { metric } { help }", f"# TYPE { metric } gauge" ])
+            family.append(f"{ metric }{{{ _labels(tool=self.tool,stage=stage.name) }}} { value }")
+
+        for stage in self.stages:
+            add("ffua_stage_duration_seconds","Wall time of the stage",stage,f"{ stage.seconds:.6f}")
+            add("ffua_process_maxrss_bytes","Resident memory high water mark of the process at the end of the stage",stage,stage.maxrss)
+            if stage.peak is not None:
+                add("ffua_stage_traced_peak_bytes","Peak of traced allocations during the stage",stage,stage.peak)
+            for name, value in stage.counts.items():
+                add(f"ffua_stage_{ name }",f"Number of { name.replace('_',' ') } in the stage",stage,value)
+        lines = [ line for family in families.values() for line in family ]
+        lines.append("# HELP ffua_run_timestamp_seconds Start of the run")
+        lines.append("# TYPE ffua_run_timestamp_seconds gauge")
+        lines.append(f"ffua_run_timestamp_seconds{{{ _labels(tool=self.tool) }}} { self.timestamp:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def json(self):
+        return json.dumps({ 'tool': self.tool, 'timestamp': self.timestamp,
+            'stages': [ attr.asdict(stage) for stage in self.stages ] },indent=2) + "\n"
+
+    def write(self,path,format="prometheus"):
+        """
+        Atomically write the metrics, so a textfile collector never reads
+        a partial file.
+        """
+        if format == "prometheus":
+            content = self.prometheus()
+        elif format == "json":
+            content = self.json()
+        else:
+            raise Exception(f"Unknown metrics format { format }")
+        writeIfChanged(str(path),content)
@@ -1,55 +1,129 @@
 import attr
-from datetime import datetime
+import calendar
+from collections import Counter
+from datetime import datetime, timezone
+import ipaddress
 import logging
+import sys
+import time
 
-@attr.s
+def _get(raw,*path):
+    try:
+        for key in path:
+            raw = raw[key]
+        return raw
+    except (KeyError, TypeError, IndexError):
+        return None
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value,str) else value
+
+def _parseAddresses(ident,addresses,missing):
+    parsed = list()
+    for address in addresses:
+        try:
+            parsed.append(ipaddress.ip_address(address))
+        except ValueError:
+            logging.debug(f"Node { ident } has invalid address { address }")
+            missing['valid address'] += 1
+    return tuple(parsed)
+
+def _parseLastSeen(lastseen):
+    try:
+        return calendar.timegm(time.strptime(lastseen[0:19],"%Y-%m-%dT%H:%M:%S"))
+    except (TypeError, ValueError):
+        return None
+
+def logMissingFields(missing):
+    """
+    Log how many nodes lacked which field, as counted by from_raw.
+    """
+    for field, count in sorted(missing.items()):
+        logging.warning(f"{ count } nodes have no { field }")
+
+@attr.s(slots=True)
 class NodeMetaData:
+    """
+    The fields of a hopglass node record, parsed once.
+    """
     ident = attr.ib(type=str)
-    raw = attr.ib(factory=dict)
-    startnode = attr.ib(type=bool,default=False)
+    hostname = attr.ib(type=str,default=None)
+    branch = attr.ib(type=str,default=None)
+    release = attr.ib(type=str,default=None)
+    addresses = attr.ib(type=tuple,default=())
+    lastseen = attr.ib(type=int,default=None)
+    online = attr.ib(type=bool,default=False)
+    metadata = attr.ib(type=bool,default=False)
+    startnode = attr.ib(type=bool,default=False,eq=False)
+
+    @classmethod
+    def from_raw(cls,ident,raw=None,missing=None):
+        """
+        Node data of a raw nodes.json record. The fields it lacks are
+        counted in the Counter missing, if given.
+        """
+        if missing is None:
+            missing = Counter()
+        if not raw:
+            missing['metadata'] += 1
+            return cls(ident)
+        data = cls(ident,
+                hostname=_get(raw,'nodeinfo','hostname'),
+                branch=_intern(_get(raw,'nodeinfo','software','autoupdater','branch')),
+                release=_intern(_get(raw,'nodeinfo','software','firmware','release')),
+                addresses=_parseAddresses(ident,_get(raw,'nodeinfo','network','addresses') or (),missing),
+                lastseen=_parseLastSeen(_get(raw,'lastseen')),
+                online=bool(_get(raw,'nodeinfo','flags','online')),
+                metadata=True)
+        if data.branch is None:
+            missing['branch'] += 1
+        if data.hostname is None:
+            missing['hostname'] += 1
+        if len(data.addresses) == 0:
+            missing['addresses'] += 1
+        if data.lastseen is None:
+            missing['lastseen value'] += 1
+        return data
+
+    def to_dict(self):
+        return { 'ident': self.ident, 'hostname': self.hostname, 'branch': self.branch,
+                'release': self.release, 'addresses': [ str(address) for address in self.addresses ],
+                'lastseen': self.lastseen, 'online': self.online, 'metadata': self.metadata,
+                'startnode': self.startnode }
+
+    @classmethod
+    def from_dict(cls,data):
+        return cls(data['ident'],hostname=data['hostname'],branch=_intern(data['branch']),
+                release=_intern(data['release']),
+                addresses=tuple(ipaddress.ip_address(address) for address in data['addresses']),
+                lastseen=data['lastseen'],online=data['online'],metadata=data['metadata'],
+                startnode=data['startnode'])
 
     def hasMetaData(self):
-        return len(self.raw) > 0
+        return self.metadata
 
     def isOnline(self):
-        try:
-            return self.raw['nodeinfo']['flags']['online']
-        except:
-            return False
+        return self.online
 
     def isStartNode(self):
         return self.startnode
 
     def getBranch(self):
-        try:
-            return self.raw['nodeinfo']['software']['autoupdater']['branch']
-        except:
-            logging.error(f"Node { self.ident } has no Branch")
-            return None
+        return self.branch
 
     def getFirmwareVersion(self):
-        try:
-            return self.raw['nodeinfo']['software']['firmware']['release']
-        except:
-            return None
+        return self.release
 
     def getHostname(self):
-        try:
-            return self.raw['nodeinfo']['hostname']
-        except:
-            logging.error(f"Node { self.ident } has no Hostname")
-            return None
+        return self.hostname
 
     def getAddresses(self):
-        try:
-            return self.raw['nodeinfo']['network']['addresses']
-        except:
-            logging.error(f"Node { self.ident } has addresses")
-            return list()
+        return self.addresses
+
+    def getLastSeenEpoch(self):
+        return self.lastseen
 
     def getLastSeen(self):
-        try:
-          return datetime.strptime(self.raw['lastseen'][0:18],"%Y-%m-%dT%H:%M:%S")
-        except:
-            logging.error(f"Node { self.ident } has no lastseen value")
+        if self.lastseen is None:
             return None
+        return datetime.fromtimestamp(self.lastseen,timezone.utc)
@@ -0,0 +1,297 @@
+import array
+import attr
+import ipaddress
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from ffua.graph import Graph, Tree
+from ffua.node import NodeMetaData
+
+MAGIC = b"FFUASNAP"
+VERSION = 1
+
+# magic, version, byte order, number of sections
+_header = struct.Struct("<8sIII")
+# name, offset and number of items of a section
+_section = struct.Struct("<8sqq")
+
+# Typecode of every section, all arrays are stored in native byte order
+SECTIONS = {
+        b"root": 'q',
+        b"nodes": 'q',
+        b"idents": 'i',
+        b"src": 'i',
+        b"dst": 'i',
+        b"weight": 'd',
+        b"flags": 'B',
+        b"dident": 'i',
+        b"hostname": 'i',
+        b"branch": 'i',
+        b"release": 'i',
+        b"lastseen": 'q',
+        b"addrptr": 'i',
+        b"addrver": 'B',
+        b"addr": 'B',
+        b"strptr": 'q',
+        b"str": 'B',
+        b"treepos": 'i',
+        b"treepar": 'i',
+        b"treedst": 'i',
+        }
+
+# Bits of the flags section
+HAS_DATA = 1
+METADATA = 2
+ONLINE = 4
+STARTNODE = 8
+
+# lastseen of node data without a lastseen value
+NO_LASTSEEN = -2**63
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+def _weight(w):
+    try:
+        return float(w)
+    except (TypeError, ValueError):
+        return math.nan
+
+class StringTable:
+    """
+    Deduplicated strings, referenced by their index. None is -1.
+    """
+
+    def __init__(self):
+        self.index = dict()
+        self.ptr = array.array('q',[0])
+        self.blob = bytearray()
+
+    def add(self,value):
+        if value is None:
+            return -1
+        pos = self.index.get(value)
+        if pos is None:
+            pos = self.index[value] = len(self.ptr) - 1
+            self.blob += value.encode("utf-8")
+            self.ptr.append(len(self.blob))
+        return pos
+
+def _treeOrder(tree):
+    """
+    Nodes of a spanning tree in breadth first order with their parents.
+    """
+    order = [tree.root_node]
+    parents = [None]
+    for node in order:
+        for child in tree.getOutEdges(node):
+            order.append(child)
+            parents.append(node)
+    return order, parents
+
+def encodeSnapshot(graph,tree=None,root=None):
+    """
+    Serialize graph, its node data and identmap and optionally a spanning
+    tree of it into the binary snapshot format. root defaults to the root
+    of tree.
+    """
+    if root is None and tree is not None:
+        root = tree.root_node
+    strings = StringTable()
+    nodes = array.array('q',graph.getNodes())
+    position = { node: pos for pos, node in enumerate(nodes) }
+    sections = { name: array.array(code) for name, code in SECTIONS.items() }
+    sections[b"nodes"] = nodes
+    if root is not None:
+        sections[b"root"].append(root)
+    for node in nodes:
+        gnode = graph.getNode(node)
+        sections[b"idents"].append(strings.add(gnode.ident))
+        for target, weight in gnode.arrows_out.items():
+            sections[b"src"].append(position[node])
+            sections[b"dst"].append(position[target])
+            sections[b"weight"].append(_weight(weight))
+        data = gnode.data
+        if data is None:
+            flags = 0
+            for name in (b"dident",b"hostname",b"branch",b"release"):
+                sections[name].append(-1)
+            sections[b"lastseen"].append(NO_LASTSEEN)
+        else:
+            flags = HAS_DATA | METADATA * data.metadata | ONLINE * data.online | STARTNODE * data.startnode
+            sections[b"dident"].append(strings.add(data.ident))
+            sections[b"hostname"].append(strings.add(data.hostname))
+            sections[b"branch"].append(strings.add(data.branch))
+            sections[b"release"].append(strings.add(data.release))
+            sections[b"lastseen"].append(NO_LASTSEEN if data.lastseen is None else data.lastseen)
+            for address in data.addresses:
+                sections[b"addrver"].append(address.version)
+                sections[b"addr"].frombytes(address.packed.ljust(16,b"\0"))
+        sections[b"flags"].append(flags)
+        sections[b"addrptr"].append(len(sections[b"addrver"]))
+    sections[b"addrptr"].insert(0,0)
+    sections[b"strptr"] = strings.ptr
+    sections[b"str"].frombytes(bytes(strings.blob))
+    if tree is not None:
+        order, parents = _treeOrder(tree)
+        sections[b"treepos"].extend(position[node] for node in order)
+        sections[b"treepar"].extend(-1 if parent is None else position[parent] for parent in parents)
+        sections[b"treedst"].extend(tree.getNodeData(node) for node in order)
+
+    header = _header.pack(MAGIC,VERSION,sys.byteorder == "big",len(sections))
+    offset = _align(len(header) + _section.size * len(sections))
+    table = list()
+    payload = list()
+    for name, values in sections.items():
+        table.append(_section.pack(name,offset,len(values)))
+        content = values.tobytes()
+        padding = _align(len(content)) - len(content)
+        payload.append(content + b"\0" * padding)
+        offset += len(content) + padding
+    prefix = header + b"".join(table)
+    return prefix + b"\0" * (_align(len(prefix)) - len(prefix)) + b"".join(payload)
+
+def writeSnapshot(path,graph,tree=None,root=None):
+    """
+    Atomically write a snapshot of graph and tree to path.
+    """
+    content = encodeSnapshot(graph,tree,root)
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("wb",dir=directory,prefix=os.path.basename(path) + ".",delete=False) as output:
+        output.write(content)
+    try:
+        os.replace(output.name,path)
+    except:
+        os.unlink(output.name)
+        raise
+    logging.debug(f"Wrote snapshot of { len(graph.getNodes()) } nodes, { len(content) } bytes to { path }")
+
+@attr.s
+class Snapshot:
+    """
+    Snapshot of a graph, its node data and spanning tree. The sections
+    are typed memoryviews on the buffer, usually a memory mapped file.
+    """
+    sections = attr.ib(factory=dict)
+    buffer = attr.ib(default=None,repr=False)
+
+    @classmethod
+    def from_buffer(cls,buffer):
+        view = memoryview(buffer)
+        if len(view) < _header.size:
+            raise Exception("Snapshot is truncated")
+        magic, version, bigendian, count = _header.unpack_from(view)
+        if magic != MAGIC:
+            raise Exception("Not an ffua snapshot")
+        if version != VERSION:
+            raise Exception(f"Unsupported snapshot version { version }")
+        if bigendian != (sys.byteorder == "big"):
+            raise Exception("Snapshot was written on a machine of another byte order")
+        snapshot = cls(buffer=buffer)
+        for num in range(count):
+            name, offset, items = _section.unpack_from(view,_header.size + num * _section.size)
+            name = name.rstrip(b"\0")
+            if name not in SECTIONS:
+                continue
+            size = array.array(SECTIONS[name]).itemsize * items
+            if offset + size > len(view):
+                raise Exception(f"Snapshot section { name.decode() } is truncated")
+            snapshot.sections[name] = view[offset:offset + size].cast(SECTIONS[name])
+        missing = set(SECTIONS) - set(snapshot.sections)
+        if len(missing) > 0:
+            raise Exception(f"Snapshot lacks sections { ', '.join(sorted(name.decode() for name in missing)) }")
+        return snapshot
+
+    def __getitem__(self,name):
+        return self.sections[name]
+
+    def root(self):
+        root = self[b"root"]
+        return root[0] if len(root) > 0 else None
+
+    def hasTree(self):
+        return len(self[b"treepos"]) > 0
+
+    def strings(self):
+        ptr = self[b"strptr"]
+        blob = bytes(self[b"str"])
+        return [ sys.intern(blob[ptr[pos]:ptr[pos + 1]].decode("utf-8")) for pos in range(len(ptr) - 1) ]
+
+    def _addresses(self,pos):
+        ptr = self[b"addrptr"]
+        versions = self[b"addrver"]
+        packed = self[b"addr"]
+        addresses = list()
+        for num in range(ptr[pos],ptr[pos + 1]):
+            value = bytes(packed[num * 16:num * 16 + 16])
+            if versions[num] == 4:
+                addresses.append(ipaddress.IPv4Address(value[:4]))
+            else:
+                addresses.append(ipaddress.IPv6Address(value))
+        return tuple(addresses)
+
+    def graph(self):
+        """
+        The graph with node data and identmap. The address index is built
+        on the first lookup. Edge weights without a numeric value are
+        restored as None.
+        """
+        strings = self.strings()
+        string = lambda pos: None if pos < 0 else strings[pos]
+        nodes = self[b"nodes"]
+        idents = self[b"idents"]
+        flags = self[b"flags"]
+        columns = zip(self[b"dident"],self[b"hostname"],self[b"branch"],self[b"release"],self[b"lastseen"])
+        graph = Graph()
+        for pos, (dident, hostname, branch, release, lastseen) in enumerate(columns):
+            node = nodes[pos]
+            graph.getNode(node)
+            if idents[pos] >= 0:
+                graph.setNodeIdent(node,strings[idents[pos]])
+            if flags[pos] & HAS_DATA:
+                graph.setNodeData(node,NodeMetaData(string(dident),
+                        hostname=string(hostname),
+                        branch=string(branch),
+                        release=string(release),
+                        addresses=self._addresses(pos),
+                        lastseen=None if lastseen == NO_LASTSEEN else lastseen,
+                        online=bool(flags[pos] & ONLINE),
+                        metadata=bool(flags[pos] & METADATA),
+                        startnode=bool(flags[pos] & STARTNODE)))
+        for source, target, weight in zip(self[b"src"],self[b"dst"],self[b"weight"]):
+            graph.addEdge(nodes[source],nodes[target],None if math.isnan(weight) else weight)
+        return graph
+
+    def tree(self):
+        """
+        The breadth first spanning tree, as spantree returns it.
+        """
+        if not self.hasTree():
+            raise Exception("Snapshot has no spanning tree")
+        nodes = self[b"nodes"]
+        tree = Tree()
+        tree.root_node = self.root()
+        for pos, parent, distance in zip(self[b"treepos"],self[b"treepar"],self[b"treedst"]):
+            node = nodes[pos]
+            tree.getNode(node)
+            tree.setNodeData(node,distance)
+            if parent >= 0:
+                tree.addEdge(nodes[parent],node,distance)
+        return tree
+
+def readSnapshot(path):
+    """
+    Memory map the snapshot at path.
+    """
+    with open(path,"rb") as snapshot_file:
+        try:
+            buffer = mmap.mmap(snapshot_file.fileno(),0,access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can not be mapped
+            raise Exception(f"Snapshot { path } is empty")
+    return Snapshot.from_buffer(buffer)
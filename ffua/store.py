@@ -0,0 +1,118 @@
+import attr
+from bisect import bisect_right
+import gzip
+import json
+import logging
+from pathlib import Path
+
+from ffua.delta import GraphDelta, diffGraphs
+from ffua.util import writeIfChanged
+from ffua.snapshot import readSnapshot, writeSnapshot
+
+STORE_VERSION = 1
+
+@attr.s
+class StoreEntry:
+    """
+    One recorded state. Every entry but the first has the delta from the
+    state before, every keyframes entry also a full snapshot.
+    """
+    time = attr.ib(type=float)
+    delta = attr.ib(type=str,default=None)
+    snapshot = attr.ib(type=str,default=None)
+
+@attr.s
+class SnapshotStore:
+    """
+    Hopglass states over time in a directory. States are stored as deltas
+    to the state before, with a full snapshot every keyframes records, so
+    any state is rebuilt from the latest snapshot before it and at most
+    keyframes - 1 deltas. index.json lists the entries by time.
+    """
+    path = attr.ib(type=Path)
+    keyframes = attr.ib(default=24)
+    entries = attr.ib(factory=list)
+    last = attr.ib(default=None,repr=False)
+
+    @classmethod
+    def open(cls,path,keyframes=24):
+        store = cls(Path(path),keyframes)
+        index = store.path / "index.json"
+        if index.is_file():
+            data = json.loads(index.read_text())
+            if data['version'] != STORE_VERSION:
+                raise Exception(f"Unsupported snapshot store version { data['version'] }")
+            store.entries = [ StoreEntry(**entry) for entry in data['entries'] ]
+        return store
+
+    def times(self):
+        return [ entry.time for entry in self.entries ]
+
+    def _writeIndex(self):
+        writeIfChanged(str(self.path / "index.json"),json.dumps({ 'version': STORE_VERSION,
+            'entries': [ attr.asdict(entry) for entry in self.entries ] },indent=1))
+
+    def _readDelta(self,entry):
+        with gzip.open(self.path / entry.delta,"rt") as delta_file:
+            return GraphDelta.from_dict(json.load(delta_file))
+
+    def _position(self,time):
+        """
+        Position of the entry live at time, the first one for earlier times.
+        """
+        if len(self.entries) == 0:
+            raise Exception(f"Snapshot store { self.path } is empty")
+        return max(bisect_right(self.times(),time) - 1,0)
+
+    def _graph(self,pos):
+        start = pos
+        while self.entries[start].snapshot is None:
+            start -= 1
+        graph = readSnapshot(self.path / self.entries[start].snapshot).graph()
+        for entry in self.entries[start + 1:pos + 1]:
+            self._readDelta(entry).apply(graph)
+        return graph
+
+    def graphAt(self,time):
+        """
+        The graph as recorded last at or before time. Returns the time of
+        the record and the graph.
+        """
+        pos = self._position(time)
+        return self.entries[pos].time, self._graph(pos)
+
+    def deltas(self,after,until=None):
+        """
+        Yields (time, delta) of the records after time after, up to until.
+        """
+        for entry in self.entries[bisect_right(self.times(),after):]:
+            if until is not None and entry.time > until:
+                return
+            yield entry.time, self._readDelta(entry)
+
+    def record(self,graph,time):
+        """
+        Add the state graph at time, which has to be later than all
+        recorded states. The graph must not carry the virtual node, it is
+        kept as base of the next delta and must not be changed.
+        """
+        if len(self.entries) > 0 and time <= self.entries[-1].time:
+            raise Exception(f"Record at { time } is not later than the last one at { self.entries[-1].time }")
+        self.path.mkdir(parents=True,exist_ok=True)
+        entry = StoreEntry(time)
+        name = f"{ len(self.entries):08d}"
+        if len(self.entries) > 0:
+            if self.last is None:
+                self.last = self._graph(len(self.entries) - 1)
+            delta = diffGraphs(self.last,graph)
+            entry.delta = name + ".delta.json.gz"
+            with gzip.open(self.path / entry.delta,"wt") as delta_file:
+                json.dump(delta.to_dict(),delta_file)
+        if len(self.entries) % self.keyframes == 0:
+            entry.snapshot = name + ".snap"
+            writeSnapshot(self.path / entry.snapshot,graph)
+        self.entries.append(entry)
+        self._writeIndex()
+        self.last = graph
+        logging.debug(f"Recorded state at { time } as { entry }")
+        return entry
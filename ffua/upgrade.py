@@ -1,8 +1,18 @@
 import attr
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
+from ffua import columns
 from ffua.mechanism import Mechanism
-from ffua.graph import Graph, Tree, getSubtreeNodes, getTreeSubtrees, clone_graph
+from ffua.graph import Graph, Tree, getSubtreeIndex, getTreeSubtrees
+
+# Model, config and output of a running process pool evaluation. Workers
+# are forked and inherit it, so the graph is not pickled per branch.
+_shared = None
+
+def _evaluateBranch(branch):
+    model, config, output = _shared
+    return model.evaluateBranch(branch,config,output)
 
 @attr.s
 class UpgradeModel:
@@ -15,20 +25,82 @@ class UpgradeModel:
     graph = attr.ib(type=Graph)
     tree = attr.ib(type=Tree)
     mechanism = attr.ib(type=Mechanism)
+    _subtrees = attr.ib(default=None,init=False,repr=False)
+    _table = attr.ib(default=None,init=False,repr=False)
+
+    def _prepare(self):
+        self._subtrees = list(getTreeSubtrees(self.graph,self.tree))
+        getSubtreeIndex(self.tree).indexBranches(self.graph)
+        if hasattr(self.mechanism,'prepare'):
+            self.mechanism.prepare(self.graph,self.tree)
+        if columns.available() and hasattr(self.mechanism,'allowMask'):
+            self._table = columns.NodeTable.from_tree(self.graph,self.tree)
+
+    def _prunedSubtrees(self,branch,config):
+        index = getSubtreeIndex(self.tree)
+        incompatible = config.incompatible.get(branch,())
+        return [ st for st in self._subtrees
+                if any(index.containsBranch(st,other) for other in incompatible) ]
+
+    def branchTree(self,branch,config):
+        """
+        The tree without subtrees containing a node of an incompatible branch.
+        """
+        tree = getSubtreeIndex(self.tree).prune(self.tree,self._prunedSubtrees(branch,config))
+        logging.debug(f"Branch: { branch } ; Nodes in Tree: { tree.numNodes() }")
+        return tree
+
+    def allowedNodes(self,branch,config):
+        """
+        Node data of the nodes allowed to upgrade to branch. With a node
+        table the mechanism is evaluated on columns without building the
+        pruned tree.
+        """
+        if self._table is None:
+            return self.mechanism(self.graph, self.branchTree(branch,config), config.branches)
+        kept = self._table.keptMask(self._prunedSubtrees(branch,config))
+        logging.debug(f"Branch: { branch } ; Nodes in Tree: { kept.sum() }")
+        return self._table.select(kept & self.mechanism.allowMask(self._table,kept,config.branches))
 
     def __call__(self,config):
-        subtrees = list(getTreeSubtrees(self.graph,self.tree))
+        self._prepare()
         for branch in config.branches:
-            tree = clone_graph(self.tree)
-            num_compatible = 0
-            for st in subtrees:
-                for stn in getSubtreeNodes(tree,st):
-                    data = self.graph.getNodeData(stn)
-                    if data.getBranch() in config.incompatible[branch]:
-                        for stn in getSubtreeNodes(tree,st):
-                            std = self.graph.getNodeData(stn)
-                            self.tree.removeNode(stn)
-                        break
-            logging.debug(f"Branch: { branch } ; Nodes in Tree: { tree.numNodes() }")
-            generator = self.mechanism(self.graph, self.tree, config.branches)
-            yield (branch,generator)
+            yield (branch,self.allowedNodes(branch,config))
+
+    def evaluateBranch(self,branch,config,output=None):
+        nodes = list(self.allowedNodes(branch,config))
+        result = None
+        if output is not None:
+            result = output(branch,nodes,config)
+        return (branch,nodes,result)
+
+    def evaluate(self,config,output=None,workers=1,executor="thread"):
+        """
+        Evaluate all branches, optionally in parallel, and pass the allowed
+        nodes of each branch to output. Returns a list of (branch, nodes,
+        output result) in the order of config.branches.
+        """
+        global _shared
+        self._prepare()
+        branches = list(config.branches)
+        if workers <= 1 or len(branches) <= 1:
+            return [ self.evaluateBranch(branch,config,output) for branch in branches ]
+        if executor == "thread":
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(lambda branch: self.evaluateBranch(branch,config,output),branches))
+        elif executor == "process":
+            from concurrent.futures import ProcessPoolExecutor
+            import multiprocessing
+
+            # Read the manifests before forking, the workers would parse
+            # them each and their manifest cache is lost
+            for branch in config.branches.values():
+                branch.getFirmwareVersion()
+            _shared = (self,config,output)
+            try:
+                with ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context("fork")) as pool:
+                    return list(pool.map(_evaluateBranch,branches))
+            finally:
+                _shared = None
+        else:
+            raise Exception(f"Unknown executor { executor }")
@@ -0,0 +1,30 @@
+import os
+import tempfile
+
+def writeIfChanged(path,content):
+    """
+    Atomically replace the file at path with content, unless it already
+    has this content. Returns the previous content or None if nothing was
+    written.
+    """
+    try:
+        with open(path,"r") as current:
+            previous = current.read()
+    except FileNotFoundError:
+        previous = ""
+    else:
+        if previous == content:
+            return None
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    with tempfile.NamedTemporaryFile("w",dir=os.path.dirname(path),prefix=os.path.basename(path) + ".",delete=False) as output:
+        output.write(content)
+    try:
+        os.chmod(output.name,mode)
+        os.replace(output.name,path)
+    except:
+        os.unlink(output.name)
+        raise
+    return previous
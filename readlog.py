@@ -1,120 +1,252 @@
 #!/usr/bin/env python3
 
-import attr
 import click
-from enum import auto,Enum
 import logging
 from pathlib import Path
+import time
 
 import ffua
-
-class RequestType(Enum):
-    Firmware = auto()
-    Manifest = auto()
-
-@attr.s(auto_attribs=True)
-class Request:
-    type: RequestType
-    source: str
-    method: str
-    branch: str
-    filename: str
-
-def parse_logfile(logfile,*args,**kargs):
-    for line in logfile.readlines():
-        yield parse_logline(line,*args,**kargs)
-
-def parse_logline(line,with_manifest = False):
-    try:
-        fields = line.split()
-        if len(fields) < 5:
-            return
-        address = fields[0]
-        method = fields[1][1:]
-        path = Path(fields[2])
-        status = int(fields[4])
-        if method == "GET" and status == 200:
-            if path.parent.name == "sysupgrade":
-                branch = path.parent.parent.name
-                if path.suffix == ".manifest":
-                    if with_manifest:
-                        return Request(RequestType.Manifest,address,method,branch,path.name)
-                else:
-                    filename = path.name
-                    return Request(RequestType.Firmware,address,method,branch,path.name)
-
-    except:
-        return None
+from ffua.logfile import FIRMWARE_FORMAT, follow_logfile, parse_logfiles
+from ffua.metrics import Metrics
 
 @click.group()
 @click.option("--debug/--no-debug",default=False,help="Debugging output")
 @click.option('--config','-c','config_file',type=click.File(mode='r'),prompt=True)
+@click.option('--format','logformat',default=FIRMWARE_FORMAT,show_default=True,help="Apache LogFormat of the logfiles")
+@click.option("--jobs","-j",type=int,help="Processes parsing the logfiles, all cpus by default")
+@click.option("--metrics","metrics_file",type=click.Path(dir_okay=False),help="Write per stage metrics to this file")
+@click.option("--metrics-format",type=click.Choice(["prometheus","json"]),default="prometheus",show_default=True)
+@click.option("--profile","profile_path",type=click.Path(file_okay=False),help="Dump cProfile and tracemalloc snapshots of every stage into this directory")
+@click.option("--snapshot","snapshot_file",type=click.Path(exists=True,dir_okay=False),help="Start from this graph snapshot instead of hopglass")
+@click.option("--save-snapshot","save_snapshot_file",type=click.Path(dir_okay=False),help="Save a snapshot of the graph to this file")
 @click.pass_context
-def cli(ctx,debug,config_file):
+def cli(ctx,debug,config_file,logformat,jobs,metrics_file,metrics_format,profile_path,snapshot_file,save_snapshot_file):
     if debug:
         logging.basicConfig(level=logging.DEBUG)
     else:
         logging.basicConfig(level=logging.INFO)
 
-    config = ffua.config.Config()
-    config.load(config_file)
+    metrics = Metrics("readlog",Path(profile_path) if profile_path else None)
+    with metrics.stage("config") as stage:
+        config = ffua.config.Config()
+        config.load(config_file)
+        stage.count("branches",len(config.branches))
     ctx.obj['config'] =  config
+    ctx.obj['logformat'] = logformat
+    ctx.obj['jobs'] = jobs
+    ctx.obj['snapshot'] = snapshot_file
+    ctx.obj['save_snapshot'] = save_snapshot_file
+    ctx.obj['metrics'] = metrics
+    if metrics_file is not None:
+        ctx.call_on_close(lambda: metrics.write(metrics_file,metrics_format))
 
 
 @cli.command()
 @click.option("--with-manifest/--without-manifest",default=False,help="Output manifest requests")
-@click.argument("logfiles",type=click.File(mode='r+'),nargs=-1)
-def parse(with_manifest,logfiles):
+@click.argument("logfiles",type=click.Path(exists=True,dir_okay=False,allow_dash=True),nargs=-1)
+@click.pass_context
+def parse(ctx,with_manifest,logfiles):
     print("Start reading")
-    for logfile in logfiles:
-        for request in parse_logfile(logfile,with_manifest):
-            if request is not None:
-                print(request.source,request.type,request.branch,request.filename)
+    for request in parse_logfiles(logfiles,with_manifest,ctx.obj['logformat'],ctx.obj['jobs']):
+        if request is not None:
+            print(request.source,request.type,request.branch,request.filename)
 
 def find_node_from_address(graph,address):
-    nodes_data = map(lambda node_id: (node_id,graph.getNodeData(node_id)),graph.getNodes())
-    nodes_data = filter(lambda data: data[1] is not None,nodes_data)
-    try:
-        return next(filter(lambda node_data: address in node_data[1].getAddresses(),nodes_data))
-    except StopIteration:
+    node_id = graph.getNodeByAddress(address)
+    if node_id is None:
         return (None,None)
+    return (node_id,graph.getNodeData(node_id))
+
+def fetch_graph(ctx):
+    """
+    Network graph of the configured hopglass instance.
+    """
+    config = ctx.obj['config']
+    metrics = ctx.obj['metrics']
+    with metrics.stage("fetch") as stage:
+        fetcher = ffua.hopglass.Fetcher.from_config(config.cache)
+        paths = ffua.hopglass.documentPaths(config.hopglass,fetcher)
+        stage.count("cache_hits",fetcher.hits)
+    with metrics.stage("parse") as stage:
+        graph = ffua.hopglass.readDocuments(paths)
+        stage.count("nodes",graph.numNodes())
+        stage.count("edges",sum(1 for _ in graph.getEdges()))
+    return graph
+
+def load_graph(ctx):
+    """
+    Network graph with the magic starting node, returns (graph, center).
+    """
+    from ffua.snapshot import readSnapshot, writeSnapshot
+
+    config = ctx.obj['config']
+    metrics = ctx.obj['metrics']
+    if ctx.obj['snapshot'] is not None:
+        with metrics.stage("snapshot") as stage:
+            snapshot = readSnapshot(ctx.obj['snapshot'])
+            graph = snapshot.graph()
+            stage.count("nodes",graph.numNodes())
+        if snapshot.root() is None:
+            # Snapshots of the snapshot store carry no starting node
+            return (graph,ffua.graph.addVirtualNode(graph,config.startnodes))
+        return (graph,snapshot.root())
+    graph = fetch_graph(ctx)
+    # Add magic starting node
+    center = ffua.graph.addVirtualNode(graph,config.startnodes)
+    if ctx.obj['save_snapshot'] is not None:
+        writeSnapshot(ctx.obj['save_snapshot'],graph,root=center)
+    return (graph,center)
+
+def report_split(graph,node_id,node_data,disconnected):
+    """
+    Warn about the components disconnected by the removal of node_id and
+    remove them from the graph. Returns the number of removed nodes.
+    """
+    logging.warning(f"Remove of ({ node_data.getBranch() }) { node_id }:{ node_data.getHostname() } disconnects graph")
+    removed = 0
+    for dis_component in disconnected:
+        for dis_node_id in dis_component:
+            dis_node_data = graph.getNodeData(dis_node_id)
+            if dis_node_data is None:
+                logging.warning(f"Disconnect { dis_node_id }:{ graph.getNode(dis_node_id).ident }")
+            else:
+                logging.warning(f"Disconnect ({ node_data.getBranch() }) { dis_node_id }:{ dis_node_data.getHostname() }")
+            graph.removeNode(dis_node_id)
+            removed += 1
+    return removed
+
+def reachable_nodes(graph,center):
+    """
+    The nodes connected to center, center included.
+    """
+    reached = set([center])
+    pending = [center]
+    while len(pending) > 0:
+        for neighbor in ffua.graph._neighbors(graph,pending.pop()):
+            if neighbor not in reached:
+                reached.add(neighbor)
+                pending.append(neighbor)
+    return reached
+
+def verify_history(ctx,store,logfiles):
+    """
+    Verify every request against the graph recorded in store at the time
+    of the request. Nodes removed once, by an upgrade or a split, stay
+    removed. Nodes without connection to the startnodes are skipped as
+    long as they lack it.
+    """
+    config = ctx.obj['config']
+    metrics = ctx.obj['metrics']
+    with metrics.stage("logparse") as stage:
+        requests = [ request for request in parse_logfiles(logfiles,logformat=ctx.obj['logformat'],jobs=ctx.obj['jobs'])
+                if request is not None ]
+        stage.count("requests",len(requests))
+    if len(requests) == 0:
+        print("No requests to verify")
+        return
+    if any(request.time is None for request in requests):
+        raise Exception("Verification against the snapshot store needs %t in the LogFormat")
+    # Logfiles may be given in any order, rotated ones overlap
+    requests.sort(key=lambda request: request.time)
+    with metrics.stage("verify") as stage:
+        state_time, graph = store.graphAt(requests[0].time)
+        if requests[0].time < state_time:
+            logging.warning("Requests before the first recorded state are verified against it")
+        center = ffua.graph.addVirtualNode(graph,config.startnodes)
+        removed = set()
+        reached = reachable_nodes(graph,center)
+        deltas = store.deltas(state_time)
+        pending = next(deltas,None)
+        print("Start verification process")
+        success = True
+        upgraded = 0
+        disconnected_nodes = 0
+        states = 1
+        for request in requests:
+            while pending is not None and pending[0] <= request.time:
+                pending[1].without(removed).apply(graph)
+                reached = reachable_nodes(graph,center)
+                states += 1
+                pending = next(deltas,None)
+            node_id, node_data = find_node_from_address(graph,request.source)
+            if node_id is None or not graph.hasNode(node_id):
+                logging.debug(f"Node for {request.source} not found")
+                continue
+            if node_id not in reached:
+                logging.debug(f"Node {node_id} has no connection to the startnodes")
+                continue
+            logging.info(f"Upgrade {request.branch} on {node_id}:{ node_data.getHostname() }")
+            removed.add(graph.getNode(node_id).ident)
+            upgraded += 1
+            disconnected = ffua.graph.splitOff(graph,center,node_id)
+            if len(disconnected) > 0:
+                success = False
+                removed.update(graph.getNode(dis_node_id).ident for component in disconnected for dis_node_id in component)
+                reached.difference_update(dis_node_id for component in disconnected for dis_node_id in component)
+                disconnected_nodes += report_split(graph,node_id,node_data,disconnected)
+        stage.count("states",states)
+        stage.count("upgraded_nodes",upgraded)
+        stage.count("disconnected_nodes",disconnected_nodes)
+
+    print("Verfication ended")
+    if success:
+        print("No graph split detected")
+    else:
+        print("WARNING: Graph split was detected")
 
 @cli.command()
-@click.argument("logfiles",type=click.File(mode='r+'),nargs=-1)
+@click.option("--store","store_path",type=click.Path(exists=True,file_okay=False),help="Verify against the graph recorded in this snapshot store at the time of each request")
+@click.argument("logfiles",type=click.Path(exists=True,dir_okay=False,allow_dash=True),nargs=-1)
 @click.pass_context
-def verify(ctx,logfiles):
+def verify(ctx,store_path,logfiles):
 
-    config = ctx.obj['config']
+    if store_path is not None:
+        from ffua.store import SnapshotStore
+        verify_history(ctx,SnapshotStore.open(store_path),logfiles)
+        return
+    metrics = ctx.obj['metrics']
     logging.info("Get graph data")
-    graph = ffua.hopglass.getDataFromHopGlass(config.hopglass)
-    # Add magic starting node
-    graph_center = ffua.graph.addVirtualNode(graph,config.startnodes)
-    # Remove none connected nodes from graph
-    print("Start verification process")
-    success = True
-    for logfile in logfiles:
-        for request in parse_logfile(logfile):
-            if request is not None:
-                (node_id,node_data) = find_node_from_address(graph,request.source)
-                if node_id is None:
-                    logging.debug(f"Node for {request.source} not found")
-                else:
-                    # delete node from graph
-                    logging.info(f"Upgrade {request.branch} on {node_id}:{ node_data.getHostname() }")
-                    graph.removeNode(node_id)
-                    # check if graph is still connected
-                    components = ffua.graph.getComponents(graph)
-                    if len(components) > 1:
-                        logging.warning(f"Remove of ({ node_data.getBranch() }) { node_id }:{ node_data.getHostname() } disconnects graph")
-                        disconnected = filter(lambda component: graph_center not in component,components)
-                        success = False
-                        for dis_component in disconnected:
-                            for dis_node_id in dis_component:
-                                dis_node_data = graph.getNodeData(dis_node_id)
-                                logging.warning(f"Disconnect ({ node_data.getBranch() }) { dis_node_id }:{ dis_node_data.getHostname() }")
-                                graph.removeNode(dis_node_id)
-
-                    # if check fails, report disconnected nodes
+    graph, graph_center = load_graph(ctx)
+    # Resolve all requests up front, so the connectivity of the graph can
+    # be tracked for the whole removal sequence at once.
+    with metrics.stage("logparse") as stage:
+        requests = [ request for request in parse_logfiles(logfiles,logformat=ctx.obj['logformat'],jobs=ctx.obj['jobs'])
+                if request is not None ]
+        planned = [ graph.getNodeByAddress(request.source) for request in requests ]
+        stage.count("requests",len(requests))
+        stage.count("resolved_requests",sum(1 for node_id in planned if node_id is not None))
+    with metrics.stage("verify") as stage:
+        tracker = ffua.graph.SplitTracker(graph,graph_center,[node_id for node_id in planned if node_id is not None])
+        print("Start verification process")
+        success = True
+        upgraded = 0
+        disconnected_nodes = 0
+        replans = 0
+        for num, request in enumerate(requests):
+            node_id, node_data = find_node_from_address(graph,request.source)
+            if node_id is not None and node_id != planned[num]:
+                # The planned node shared its address and is gone, plan
+                # the remaining requests on the graph as it is now.
+                planned[num:] = [ graph.getNodeByAddress(later.source) for later in requests[num:] ]
+                tracker = ffua.graph.SplitTracker(graph,graph_center,[planned_id for planned_id in planned[num:] if planned_id is not None])
+                replans += 1
+            if node_id is None:
+                logging.debug(f"Node for {request.source} not found")
+            else:
+                # delete node from graph
+                logging.info(f"Upgrade {request.branch} on {node_id}:{ node_data.getHostname() }")
+                graph.removeNode(node_id)
+                upgraded += 1
+                # check if graph is still connected
+                disconnected = tracker.split(node_id)
+                if len(disconnected) > 0:
+                    # report disconnected nodes
+                    success = False
+                    disconnected_nodes += report_split(graph,node_id,node_data,disconnected)
+        stage.count("upgraded_nodes",upgraded)
+        stage.count("disconnected_nodes",disconnected_nodes)
+        stage.count("replans",replans)
+
     print("Verfication ended")
     if success:
         print("No graph split detected")
@@ -131,6 +263,62 @@ def verify(ctx,logfiles):
                 else:
                     print(f" Node ({ node.data.getBranch() }) { node_id }:{ node.data.getHostname() }")
 
+@cli.command()
+@click.option("--interval",default=1.0,show_default=True,help="Seconds between checks of the logfile")
+@click.option("--from-start/--from-end",default=False,help="Also verify the requests already in the logfile")
+@click.option("--reload","reload_interval",default=0,show_default=True,help="Seconds between reloads of the hopglass data, 0 to never reload")
+@click.argument("logfile",type=click.Path(dir_okay=False))
+@click.pass_context
+def follow(ctx,interval,from_start,reload_interval,logfile):
+    """
+    Verify requests as they are appended to the logfile.
+    """
+    metrics = ctx.obj['metrics']
+    graph, graph_center = load_graph(ctx)
+    loaded = time.monotonic()
+    # Idents of upgraded nodes, removed again after a reload
+    upgraded = set()
+    logging.info(f"Following { logfile }")
+    for request in follow_logfile(logfile,logformat=ctx.obj['logformat'],interval=interval,from_start=from_start):
+        if reload_interval > 0 and time.monotonic() - loaded >= reload_interval:
+            metrics.reset()
+            graph, graph_center = load_graph(ctx)
+            loaded = time.monotonic()
+            for ident in upgraded:
+                node_id = graph.identmap.get(ident)
+                if node_id is not None and graph.hasNode(node_id):
+                    # Disconnects were reported when they happened
+                    for component in ffua.graph.splitOff(graph,graph_center,node_id):
+                        for dis_node_id in component:
+                            graph.removeNode(dis_node_id)
+            logging.info(f"Reloaded graph data, { graph.numNodes() } nodes left")
+        if request is None:
+            continue
+        node_id, node_data = find_node_from_address(graph,request.source)
+        if node_id is None or not graph.hasNode(node_id):
+            logging.debug(f"Node for {request.source} not found")
+            continue
+        logging.info(f"Upgrade {request.branch} on {node_id}:{ node_data.getHostname() }")
+        upgraded.add(graph.getNode(node_id).ident)
+        disconnected = ffua.graph.splitOff(graph,graph_center,node_id)
+        if len(disconnected) > 0:
+            report_split(graph,node_id,node_data,disconnected)
+
+@cli.command()
+@click.option("--keyframes",default=24,show_default=True,help="Store a full snapshot every this many states")
+@click.option("--time","timestamp",type=float,help="Epoch of the state, now by default")
+@click.argument("store",type=click.Path(file_okay=False))
+@click.pass_context
+def record(ctx,keyframes,timestamp,store):
+    """
+    Record the current hopglass state in a snapshot store.
+    """
+    from ffua.store import SnapshotStore
+
+    graph = fetch_graph(ctx)
+    entry = SnapshotStore.open(store,keyframes).record(graph,time.time() if timestamp is None else timestamp)
+    logging.info(f"Recorded { graph.numNodes() } nodes at { entry.time }")
+
 
 if __name__ == "__main__":
     cli(obj=dict())
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from ffua.graph import Graph
+from ffua.node import NodeMetaData
+
+def build_graph(nodes,links):
+    graph = Graph()
+    for cnt,(ident,addresses) in enumerate(nodes):
+        graph.setNodeIdent(cnt,ident)
+        graph.setNodeData(cnt,NodeMetaData.from_raw(ident,{'nodeinfo': {'network': {'addresses': addresses}}}))
+    for source,target,tq in links:
+        graph.addEdge(source,target,tq)
+    graph.buildAddressIndex()
+    return graph
+
+@pytest.fixture
+def make_graph():
+    """
+    Builds a graph of (ident, addresses) nodes, numbered in order, and
+    (source, target, tq) links.
+    """
+    return build_graph
+
+def hopglass_node(ident,addresses,lastseen):
+    return { 'lastseen': lastseen, 'nodeinfo': { 'node_id': ident, 'hostname': ident,
+        'network': { 'addresses': addresses },
+        'software': { 'firmware': { 'release': '0.9' }, 'autoupdater': { 'branch': 'stable' } } } }
+
+def write_hopglass(path,idents,links,lastseen="2023-01-01T00:00:00",shared=()):
+    path.mkdir(parents=True)
+    nodes = [ hopglass_node(ident,[ f"fe80::{ cnt + 1 }" ] + [ "fe80::ff" ] * (ident in shared),lastseen)
+            for cnt, ident in enumerate(idents) ]
+    (path / "nodes.json").write_text(json.dumps({ 'nodes': nodes }))
+    graph = { 'batadv': { 'nodes': [ { 'node_id': ident } for ident in idents ],
+        'links': [ { 'source': s, 'target': t, 'tq': 1 } for s, t in links ] } }
+    (path / "graph.json").write_text(json.dumps(graph))
+
+@pytest.fixture
+def hopglass_documents():
+    """
+    Writes nodes.json and graph.json of a mesh into a directory, the node
+    at position n of idents gets the address fe80::n+1, the nodes in
+    shared also fe80::ff.
+    """
+    return write_hopglass
+
+@pytest.fixture
+def config_file(tmp_path):
+    """
+    config.json of a stable branch and the hopglass data in tmp_path,
+    with the startnode gw.
+    """
+    sysupgrade = tmp_path / "firmware" / "stable" / "sysupgrade"
+    sysupgrade.mkdir(parents=True)
+    (sysupgrade / "stable.manifest").write_text("BRANCH=stable\nx86-64 1.0 " + "0" * 64 + " fw.bin\n")
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({ 'hopglass': str(tmp_path / "hopglass"), 'startnodes': ["gw"],
+        'firmware_path': str(tmp_path / "firmware") }))
+    return path
@@ -0,0 +1,38 @@
+from ffua.address import LINK_LOCAL, ULA
+from ffua.graph import Graph
+from ffua.node import NodeMetaData
+
+def node_data(ident,addresses):
+    return NodeMetaData.from_raw(ident,{'nodeinfo': {'network': {'addresses': addresses}}})
+
+def build_graph():
+    graph = Graph()
+    graph.setNodeData(0,node_data("a",["fe80::1","fda1:384a:74de:4242::1"]))
+    graph.setNodeData(1,node_data("b",["fe80::2","2001:db8::2"]))
+    graph.setNodeData(2,node_data("c",["fda1:384a:74de:4242:0:0:0:3"]))
+    graph.addEdge(0,1,1)
+    graph.addEdge(1,2,1)
+    graph.buildAddressIndex()
+    return graph
+
+def test_address_lookup():
+    graph = build_graph()
+    assert graph.getNodeByAddress("fe80::1") == 0
+    assert graph.getNodeByAddress("2001:DB8:0::2") == 1
+    assert graph.getNodeByAddress("fda1:384a:74de:4242::3") == 2
+    assert graph.getNodeByAddress("2001:db8::3") is None
+    assert graph.getNodeByAddress("no address") is None
+
+def test_address_prefix_lookup():
+    index = build_graph().addressindex
+    assert index.findPrefix("fda1:384a:74de:4242::/64") == {0,2}
+    assert index.findPrefix("fda1:384a:74de:4242::3/128") == {2}
+    assert index.findPrefix("2001:db8::/32") == {1}
+    assert index.findScope(LINK_LOCAL) == {0,1}
+    assert index.findScope(ULA) == {0,2}
+
+def test_address_index_follows_remove():
+    graph = build_graph()
+    graph.removeNode(0)
+    assert graph.getNodeByAddress("fe80::1") is None
+    assert graph.addressindex.findPrefix("fda1:384a:74de:4242::/64") == {2}
@@ -0,0 +1,32 @@
+from benchmarks.firmware import writeFirmwareLog, writeFirmwareTree
+from benchmarks.mesh import BRANCHES, generateMesh
+from benchmarks.run import benchmarks, runBenchmarks
+from ffua.branch import recurse_firmware_directory
+from ffua.graph import addVirtualNode, getComponents
+from ffua.hopglass import getDataFromHopGlass
+from ffua.logfile import parse_logfile
+
+def test_generated_mesh(tmp_path):
+    mesh = generateMesh(500,seed=1)
+    graph = getDataFromHopGlass(str(mesh.write(tmp_path / "hopglass")))
+    assert graph.numNodes() == 500
+    addVirtualNode(graph,mesh.startnodes())
+    assert len(getComponents(graph)) == 1
+    branches = set(graph.getNodeData(node).getBranch() for node in graph.getNodes()
+            if graph.getNodeData(node) is not None)
+    assert set(BRANCHES) <= branches
+
+def test_firmware_tree_and_log(tmp_path):
+    mesh = generateMesh(200)
+    branches = dict(recurse_firmware_directory(writeFirmwareTree(tmp_path / "firmware")))
+    assert set(branches) == set(BRANCHES)
+    assert branches['stable'].getFirmwareVersion() == [ BRANCHES['stable'][1] ]
+    with writeFirmwareLog(tmp_path / "firmware.log",mesh).open() as logfile:
+        requests = list(parse_logfile(logfile))
+    assert len(requests) > 0
+    assert all(request.branch in BRANCHES for request in requests)
+
+def test_run_benchmarks(tmp_path):
+    results = list(runBenchmarks([100],repeat=1,workdir=tmp_path))
+    assert [ result.name for result in results ] == list(benchmarks)
+    assert all(result.seconds >= 0 and result.peak > 0 for result in results)
@@ -0,0 +1,52 @@
+import random
+
+from ffua.compact import CompactGraph
+from ffua.graph import Graph, getComponents, getLeafs, spantree
+
+def random_graph(rnd,num_nodes,num_edges):
+    graph = Graph()
+    for node in range(num_nodes):
+        graph.getNode(node)
+        graph.setNodeIdent(node,f"node{ node }")
+    for _ in range(num_edges):
+        n1, n2 = rnd.randrange(num_nodes), rnd.randrange(num_nodes)
+        graph.addEdge(n1,n2,rnd.random())
+        graph.addEdge(n2,n1,rnd.random())
+    return graph
+
+def tree_edges(tree):
+    return sorted((n1,n2,tree.getOutEdges(n1)[n2]) for n1,n2 in tree.getEdges())
+
+def test_compact_graph_api():
+    graph = random_graph(random.Random(1),20,30)
+    compact = graph.compact()
+    assert isinstance(compact,CompactGraph)
+    assert sorted(compact.getEdges()) == sorted(graph.getEdges())
+    assert compact.getGraphIdentFromIdent("node3") == 3
+    for node in graph.getNodes():
+        assert dict(compact.getOutEdges(node)) == graph.getOutEdges(node)
+        assert compact.getNode(node).degree() == graph.getNode(node).degree()
+
+    graph.removeNode(3)
+    compact.removeNode(3)
+    assert not compact.hasNode(3)
+    assert compact.numNodes() == graph.numNodes()
+    assert sorted(compact.getEdges()) == sorted(graph.getEdges())
+    for node in graph.getNodes():
+        assert dict(compact.getOutEdges(node)) == graph.getOutEdges(node)
+        assert 3 not in compact.getNode(node).arrows_in
+
+def test_compact_fast_paths():
+    rnd = random.Random(2)
+    for _ in range(50):
+        graph = random_graph(rnd,40,rnd.randrange(10,60))
+        compact = graph.compact()
+        for node in rnd.sample(range(1,40),5):
+            graph.removeNode(node)
+            compact.removeNode(node)
+        tree = spantree(graph,0)
+        ctree = spantree(compact,0)
+        assert tree_edges(ctree) == tree_edges(tree)
+        assert all(ctree.getNodeData(n) == tree.getNodeData(n) for n in tree.getNodes())
+        assert sorted(getLeafs(ctree)) == sorted(getLeafs(tree))
+        assert sorted(map(sorted,getComponents(compact))) == sorted(map(sorted,getComponents(graph)))
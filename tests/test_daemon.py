@@ -0,0 +1,72 @@
+import time
+
+from ffua.branch import Branch
+from ffua.config import Config
+from ffua.daemon import Daemon
+from ffua.mechanism import MiauEnforce, OuterToInnerUpgrade
+
+def make_config(tmp_path):
+    sysupgrade = tmp_path / "firmware" / "stable" / "sysupgrade"
+    sysupgrade.mkdir(parents=True)
+    (sysupgrade / "stable.manifest").write_text("BRANCH=stable\nx86-64 1.0 " + "0" * 64 + " fw.bin\n")
+    config = Config()
+    config.hopglass = str(tmp_path / "snapshots")
+    config.startnodes = ["gw"]
+    config.branches['stable'] = Branch.from_path(tmp_path / "firmware" / "stable")
+    config.incompatible['stable'] = []
+    return config, sysupgrade / ".htaccess"
+
+def test_daemon_follows_snapshots(tmp_path,hopglass_documents):
+    config, htaccess = make_config(tmp_path)
+    (tmp_path / "snapshots").mkdir()
+    hopglass_documents(tmp_path / "snapshots" / "1",["gw","a","b"],[(0,1),(1,0),(1,2),(2,1)])
+    daemon = Daemon(config,MiauEnforce({ 'virtual_rootnode': True }))
+
+    assert daemon.poll()
+    assert "fe80::2" in htaccess.read_text()
+    assert "fe80::3" not in htaccess.read_text()
+    assert not daemon.poll()
+
+    # b moves next to the gateway
+    hopglass_documents(tmp_path / "snapshots" / "2",["gw","a","b"],[(0,1),(1,0),(0,2),(2,0)])
+    assert daemon.poll()
+    assert "fe80::3" in htaccess.read_text()
+    assert daemon.graph.numNodes() == 4
+
+def test_daemon_ignores_lastseen_churn(tmp_path,hopglass_documents):
+    config, htaccess = make_config(tmp_path)
+    (tmp_path / "snapshots").mkdir()
+    hopglass_documents(tmp_path / "snapshots" / "1",["gw","a","b"],[(0,1),(1,0),(1,2),(2,1)])
+    # The allowed nodes of MiauEnforce do not depend on lastseen
+    daemon = Daemon(config,MiauEnforce({ 'virtual_rootnode': True }))
+    assert daemon.poll()
+    updates = list()
+    daemon.update = lambda: updates.append(True)
+
+    hopglass_documents(tmp_path / "snapshots" / "2",["gw","a","b"],[(0,1),(1,0),(1,2),(2,1)],
+            lastseen="2023-01-01T00:05:00")
+    assert daemon.poll()
+    assert updates == []
+    assert daemon.graph.getNodeDataByIdent("b").getLastSeenEpoch() == 1672531500
+
+def test_daemon_follows_lastseen_for_clock_mechanisms(tmp_path,hopglass_documents,monkeypatch):
+    config, htaccess = make_config(tmp_path)
+    (tmp_path / "snapshots").mkdir()
+    links = [(0,1),(1,0),(1,2),(2,1)]
+    hopglass_documents(tmp_path / "snapshots" / "1",["gw","a","b"],links,lastseen="2020-01-01T00:00:00")
+    daemon = Daemon(config,OuterToInnerUpgrade({ 'virtual_rootnode': True }))
+    # a may upgrade as its only child b is inactive
+    assert daemon.poll()
+    assert "fe80::2" in htaccess.read_text()
+
+    now = time.strftime("%Y-%m-%dT%H:%M:%S",time.gmtime())
+    hopglass_documents(tmp_path / "snapshots" / "2",["gw","a","b"],links,lastseen=now)
+    assert daemon.poll()
+    assert "fe80::2" not in htaccess.read_text()
+    assert "fe80::3" in htaccess.read_text()
+
+    # b turns inactive again by time alone
+    later = time.time() + 3600
+    monkeypatch.setattr(time,"time",lambda: later)
+    assert not daemon.poll()
+    assert "fe80::2" in htaccess.read_text()
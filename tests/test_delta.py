@@ -0,0 +1,56 @@
+import json
+
+from ffua.delta import GraphDelta, diffGraphs
+
+def ident_edges(graph):
+    return sorted((graph.getNode(n1).ident,graph.getNode(n2).ident,graph.getOutEdges(n1)[n2])
+            for n1,n2 in graph.getEdges())
+
+def test_apply_delta(make_graph):
+    old = make_graph([("a",["fe80::a"]),("b",["fe80::b"]),("c",["fe80::c"])],
+            [(0,1,1.0),(1,2,1.0)])
+    new = make_graph([("d",["fe80::d"]),("a",["fe80::a"]),("b",["fe80::bb"])],
+            [(1,2,0.5),(2,0,1.0)])
+    old.getNodeData(1).startnode = True
+    delta = diffGraphs(old,new)
+    assert delta.removed_nodes == ["c"]
+    assert list(delta.added_nodes) == ["d"]
+    assert list(delta.updated_nodes) == ["b"]
+    assert delta.changesTopology()
+
+    delta.apply(old)
+    assert ident_edges(old) == ident_edges(new)
+    assert sorted(old.identmap[ident] for ident in ["a","b","d"]) == sorted(old.getNodes())
+    assert old.getNodeDataByIdent("b").startnode
+    assert old.getNodeByAddress("fe80::c") is None
+    assert old.getNodeByAddress("fe80::b") is None
+    assert old.getNodeByAddress("fe80::bb") == old.identmap["b"]
+    assert old.getNodeByAddress("fe80::d") == old.identmap["d"]
+    assert diffGraphs(old,new).isEmpty()
+
+def test_delta_serialization(make_graph):
+    old = make_graph([("a",["fe80::a"]),("b",["fe80::b"]),("c",["fe80::c"])],
+            [(0,1,1.0),(1,2,1.0)])
+    new = make_graph([("d",["fe80::d"]),("a",["fe80::a"]),("b",["fe80::bb"])],
+            [(1,2,0.5),(2,0,1.0)])
+    delta = diffGraphs(old,new)
+    assert GraphDelta.from_dict(json.loads(json.dumps(delta.to_dict()))) == delta
+
+    without = delta.without({"d"})
+    assert without.added_nodes == {}
+    assert all("d" not in edge for edge in without.added_edges)
+    assert without.updated_nodes == delta.updated_nodes
+
+def test_lastseen_is_no_update(make_graph):
+    old = make_graph([("a",["fe80::a"]),("b",["fe80::b"])],[(0,1,1.0)])
+    new = make_graph([("a",["fe80::a"]),("b",["fe80::b"])],[(0,1,1.0)])
+    new.getNodeData(1).lastseen = 1700000000
+    delta = diffGraphs(old,new)
+    assert delta.updated_nodes == {}
+    assert delta.lastseen == { "b": 1700000000 }
+    assert not delta.isEmpty()
+    assert GraphDelta.from_dict(json.loads(json.dumps(delta.to_dict()))) == delta
+
+    delta.apply(old)
+    assert old.getNodeData(1).getLastSeenEpoch() == 1700000000
+    assert diffGraphs(old,new).isEmpty()
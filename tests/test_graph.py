@@ -0,0 +1,183 @@
+import random
+
+from click.testing import CliRunner
+
+from ffua.graph import BlockCutTree, Graph, SplitTracker, getComponents, splitOff, _neighbors
+import readlog
+
+def random_graph(rnd,num_nodes,num_edges):
+    graph = Graph()
+    for node in range(num_nodes):
+        graph.getNode(node)
+    for _ in range(num_edges):
+        graph.addEdge(rnd.randrange(num_nodes),rnd.randrange(num_nodes),1)
+    return graph
+
+def copy_graph(graph):
+    copy = Graph()
+    for node in graph.getNodes():
+        copy.getNode(node)
+    for n1,n2 in graph.getEdges():
+        copy.addEdge(n1,n2,1)
+    return copy
+
+def test_split_tracker_matches_components():
+    rnd = random.Random(4242)
+    for _ in range(200):
+        num_nodes = rnd.randrange(2,30)
+        graph = random_graph(rnd,num_nodes,rnd.randrange(0,2 * num_nodes))
+        reference = copy_graph(graph)
+        removals = [rnd.randrange(1,num_nodes) for _ in range(num_nodes)]
+        tracker = SplitTracker(graph,0,removals)
+        for node in removals:
+            if not reference.hasNode(node):
+                continue
+            reference.removeNode(node)
+            components = getComponents(reference)
+            expected = []
+            if len(components) > 1:
+                expected = [c for c in components if 0 not in c]
+                for component in expected:
+                    for dis_node in component:
+                        reference.removeNode(dis_node)
+
+            graph.removeNode(node)
+            disconnected = tracker.split(node)
+            for component in disconnected:
+                for dis_node in component:
+                    graph.removeNode(dis_node)
+            # Same components and nodes in the same order
+            assert list(map(list,disconnected)) == list(map(list,expected))
+        assert set(graph.getNodes()) == set(reference.getNodes())
+
+def test_verify_resolves_shared_addresses(tmp_path,hopglass_documents,config_file):
+    # a and c share an address, d and e hang behind c
+    hopglass_documents(tmp_path / "hopglass",["gw","a","c","d","e"],
+            [(0,1),(1,0),(0,2),(2,0),(2,3),(3,2),(3,4),(4,3)],shared=("a","c"))
+    request = 'fe80::ff "GET /firmware/stable/sysupgrade/gluon.bin HTTP/1.1" 200 1234\n'
+    (tmp_path / "firmware.log").write_text(request * 2)
+    result = CliRunner().invoke(readlog.cli,["-c",str(config_file),"--jobs","1","verify",
+        str(tmp_path / "firmware.log")],obj=dict())
+    assert result.exit_code == 0, result.output
+    assert "Graph split was detected" in result.output
+
+def test_split_off_matches_components():
+    rnd = random.Random(2342)
+    for _ in range(200):
+        num_nodes = rnd.randrange(2,30)
+        graph = random_graph(rnd,num_nodes,rnd.randrange(0,2 * num_nodes))
+        # splitOff only reports what the removal disconnects
+        connected = reachable(graph,0,None)
+        for node in list(graph.getNodes()):
+            if node not in connected:
+                graph.removeNode(node)
+        reference = copy_graph(graph)
+        for node in [rnd.randrange(1,num_nodes) for _ in range(num_nodes)]:
+            if not reference.hasNode(node):
+                continue
+            reference.removeNode(node)
+            expected = [c for c in getComponents(reference) if 0 not in c]
+            for component in expected:
+                for dis_node in component:
+                    reference.removeNode(dis_node)
+
+            disconnected = splitOff(graph,0,node)
+            for component in disconnected:
+                for dis_node in component:
+                    graph.removeNode(dis_node)
+            assert sorted(map(sorted,disconnected)) == sorted(map(sorted,expected))
+        assert set(graph.getNodes()) == set(reference.getNodes())
+
+def test_dynamic_spantree_matches_spantree():
+    from ffua.graph import DynamicSpanTree, spantree
+    rnd = random.Random(2323)
+    for _ in range(100):
+        num_nodes = rnd.randrange(3,40)
+        graph = random_graph(rnd,num_nodes,rnd.randrange(0,3 * num_nodes))
+        dynamic = DynamicSpanTree(graph,0)
+        for _ in range(10):
+            removed_nodes = [ n for n in rnd.sample(range(1,num_nodes),2) if graph.hasNode(n) ]
+            for node in removed_nodes:
+                graph.removeNode(node)
+            removed_edges = rnd.sample(list(graph.getEdges()),min(3,len(list(graph.getEdges()))))
+            for n1,n2 in removed_edges:
+                graph.removeEdge(n1,n2)
+            nodes = list(graph.getNodes())
+            added_edges = [ (rnd.choice(nodes),rnd.choice(nodes)) for _ in range(3) ]
+            for n1,n2 in added_edges:
+                graph.addEdge(n1,n2,1)
+            tree = dynamic.repair(removed_nodes,removed_edges,added_edges)
+            expected = spantree(graph,0)
+            assert { n: tree.getNodeData(n) for n in tree.getNodes() } == \
+                    { n: expected.getNodeData(n) for n in expected.getNodes() }
+            for n1,n2 in tree.getEdges():
+                assert n2 in graph.getOutEdges(n1)
+                assert tree.getNodeData(n2) == tree.getNodeData(n1) + 1
+
+def test_subtree_index():
+    from ffua.graph import SubtreeIndex, getLeafs, spantree
+    from ffua.node import NodeMetaData
+    rnd = random.Random(77)
+    for _ in range(50):
+        num_nodes = rnd.randrange(2,40)
+        graph = random_graph(rnd,num_nodes,rnd.randrange(0,3 * num_nodes))
+        for node in graph.getNodes():
+            branch = rnd.choice(["stable","beta"])
+            graph.setNodeData(node,NodeMetaData.from_raw(str(node),{'nodeinfo': {'software': {'autoupdater': {'branch': branch}}}}))
+        tree = spantree(graph,0)
+        index = SubtreeIndex.from_tree(tree)
+        index.indexBranches(graph)
+
+        def walk(node):
+            nodes = [node]
+            for child in tree.getOutEdges(node):
+                nodes.extend(walk(child))
+            return nodes
+
+        for node in tree.getNodes():
+            subtree = walk(node)
+            assert sorted(index.subtreeNodes(node)) == sorted(subtree)
+            branches = set(graph.getNodeData(n).getBranch() for n in subtree)
+            assert index.containsBranch(node,"beta") == ("beta" in branches)
+        leafs = [ node for node in tree.getNodes() if tree.getNode(node).degree() == 1 ]
+        assert sorted(getLeafs(tree)) == sorted(leafs)
+
+        pruned_roots = rnd.sample(list(tree.getOutEdges(0)),min(1,len(tree.getOutEdges(0))))
+        pruned = index.prune(tree,pruned_roots)
+        removed = set(n for root in pruned_roots for n in walk(root))
+        assert set(pruned.getNodes()) == set(tree.getNodes()) - removed
+        assert all(pruned.getNodeData(n) == tree.getNodeData(n) for n in pruned.getNodes())
+
+def reachable(graph,root,removed):
+    seen = set([root])
+    pending = [root]
+    while len(pending) > 0:
+        node = pending.pop()
+        for neighbor in _neighbors(graph,node):
+            if neighbor != removed and neighbor not in seen:
+                seen.add(neighbor)
+                pending.append(neighbor)
+    return seen
+
+def test_block_cut_tree_articulation_points():
+    rnd = random.Random(1919)
+    for _ in range(200):
+        num_nodes = rnd.randrange(1,30)
+        graph = random_graph(rnd,num_nodes,rnd.randrange(0,2 * num_nodes))
+        if rnd.random() < 0.5:
+            graph = graph.compact()
+        cut = BlockCutTree.from_graph(graph,0)
+        component = reachable(graph,0,None)
+        assert set(cut.reached) == component
+        for node in component:
+            rest = component - {node}
+            if node == 0:
+                separates = len(rest) > 0 and reachable(graph,min(rest),0) != rest
+            else:
+                separates = reachable(graph,0,node) != rest
+            assert cut.isArticulation(node) == separates
+        # Every edge of the component lies in exactly one block
+        edges = set(frozenset(edge) for edge in graph.getEdges() if edge[0] != edge[1] and edge[0] in component)
+        covered = [ edge for edge in edges if sum(edge <= block for block in cut.blocks) == 1 ]
+        assert len(covered) == len(edges)
+        assert all(cut.isArticulation(node) for _, node in cut.edges())
@@ -0,0 +1,139 @@
+import io
+import json
+import pytest
+
+from ffua.hopglass import JsonStream, getDataFromHopGlass, iterSnapshots
+
+NODES = { 'timestamp': '2020-01-01T00:00:00', 'nodes': [
+    { 'nodeinfo': { 'node_id': 'aa', 'hostname': 'a', 'flags': { 'online': True },
+        'network': { 'addresses': [ 'fe80::a' ], 'mac': 'aa:aa' },
+        'software': { 'firmware': { 'release': '1.0' }, 'autoupdater': { 'branch': 'stable' } } },
+      'lastseen': '2020-01-01T00:00:00', 'statistics': { 'clients': 3 } },
+    { 'nodeinfo': { 'node_id': 'bb', 'hostname': 'b', 'network': { 'addresses': [ 'fe80::b' ] } } },
+    ] }
+
+GRAPH = { 'version': 1, 'batadv': { 'links': [ { 'source': 0, 'target': 1, 'tq': 0.5 } ],
+    'directed': False,
+    'nodes': [ { 'node_id': 'aa', 'id': 'aa' }, { 'node_id': 'bb' }, { 'id': 'cc:cc' } ] } }
+
+def write_snapshot(path):
+    path.mkdir()
+    (path / "nodes.json").write_text(json.dumps(NODES))
+    (path / "graph.json").write_text(json.dumps(GRAPH))
+
+def test_json_stream_items():
+    document = json.dumps(GRAPH,indent=2)
+    items = list(JsonStream(io.StringIO(document),chunksize=3).items([('batadv','nodes')]))
+    assert items == [ (('batadv','nodes'),node) for node in GRAPH['batadv']['nodes'] ]
+
+def test_graph_from_local_snapshot(tmp_path):
+    write_snapshot(tmp_path / "2020-01-01")
+    graph = getDataFromHopGlass("file://" + str(tmp_path / "2020-01-01"))
+    assert graph.numNodes() == 3
+    assert graph.getGraphIdentFromIdent("cccc") == 2
+    data = graph.getNodeDataByIdent("aa")
+    assert data.getBranch() == "stable"
+    assert data.getFirmwareVersion() == "1.0"
+    assert data.isOnline()
+    assert data.getLastSeenEpoch() == 1577836800
+    assert [ str(address) for address in data.getAddresses() ] == [ 'fe80::a' ]
+    assert graph.getNodeByAddress("fe80::b") == 1
+
+def test_snapshot_directory(tmp_path):
+    write_snapshot(tmp_path / "2020-01-01")
+    write_snapshot(tmp_path / "2020-01-02")
+    assert [name for name, _ in iterSnapshots(str(tmp_path))] == ["2020-01-01","2020-01-02"]
+    assert getDataFromHopGlass(str(tmp_path)).numNodes() == 3
+
+def serve_directory(path):
+    import functools
+    import http.server
+    import threading
+
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler,directory=str(path))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1",0),handler)
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server, f"http://127.0.0.1:{ server.server_address[1] }/"
+
+def test_fetcher_revalidates_and_falls_back(tmp_path):
+    from ffua.hopglass import Fetcher
+
+    write_snapshot(tmp_path / "www")
+    server, url = serve_directory(tmp_path / "www")
+    fetcher = Fetcher(path=tmp_path / "cache",max_age=0,timeout=5)
+    try:
+        graph = getDataFromHopGlass(url,fetcher)
+        assert graph.numNodes() == 3
+        assert fetcher.hits == 0
+        getDataFromHopGlass(url,fetcher)
+        assert fetcher.hits == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert getDataFromHopGlass(url,fetcher).numNodes() == 3
+    assert fetcher.hits == 4
+
+def test_remote_graph_without_fetcher(tmp_path):
+    from ffua.hopglass import RemoteDocument, documentPaths
+
+    write_snapshot(tmp_path / "www")
+    server, url = serve_directory(tmp_path / "www")
+    try:
+        # Without a cache the documents are streamed, not downloaded
+        assert all(isinstance(path,RemoteDocument) for path in documentPaths(url))
+        assert getDataFromHopGlass(url).numNodes() == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@pytest.mark.parametrize("links_first",[False,True])
+def test_merge_mesh_domains(tmp_path,links_first):
+    write_snapshot(tmp_path / "domain1")
+    # bb is online in the second domain only, dd and ee are new
+    nodes = { 'nodes': [
+        { 'nodeinfo': { 'node_id': 'bb', 'hostname': 'b2', 'flags': { 'online': True },
+            'network': { 'addresses': [ 'fe80::b' ] } } },
+        { 'nodeinfo': { 'node_id': 'dd', 'hostname': 'd', 'network': { 'addresses': [ 'fe80::d' ] } } },
+        { 'nodeinfo': { 'node_id': 'aa', 'hostname': 'a2', 'network': { 'addresses': [ 'fe80::a' ] } } },
+        ] }
+    graph_nodes = [ { 'node_id': 'dd' }, { 'node_id': 'bb' }, { 'node_id': 'aa' }, { 'id': 'ee:ee' } ]
+    links = [ { 'source': 0, 'target': 1, 'tq': 0.8 }, { 'source': 3, 'target': 0, 'tq': 0.9 } ]
+    # JSON objects have no key order
+    graph = { 'batadv': { 'links': links, 'nodes': graph_nodes } if links_first else { 'nodes': graph_nodes, 'links': links } }
+    (tmp_path / "domain2").mkdir()
+    (tmp_path / "domain2" / "nodes.json").write_text(json.dumps(nodes))
+    (tmp_path / "domain2" / "graph.json").write_text(json.dumps(graph))
+
+    merged = getDataFromHopGlass([ str(tmp_path / "domain1"), str(tmp_path / "domain2") ])
+    assert merged.numNodes() == 5
+    assert sorted(merged.getNodes()) == list(range(5))
+    assert sorted(merged.identmap) == [ "aa", "bb", "cccc", "dd", "eeee" ]
+    ident = lambda node: merged.getNode(node).ident
+    assert sorted((ident(n1),ident(n2)) for n1, n2 in merged.getEdges()) == [ ("aa","bb"), ("dd","bb"), ("eeee","dd") ]
+    assert merged.getNodeDataByIdent("bb").getHostname() == "b2"
+    assert merged.getNodeDataByIdent("aa").getHostname() == "a"
+    assert merged.getNodeByAddress("fe80::d") == merged.identmap["dd"]
+
+def test_fetcher_removes_partial_download(tmp_path):
+    import requests
+    from ffua.hopglass import Fetcher
+
+    class Response:
+        status_code = 200
+        headers = dict()
+
+        def raise_for_status(self):
+            pass
+
+        def iter_content(self,chunk_size):
+            yield b'{ "nodes": ['
+            raise requests.ConnectionError("connection reset")
+
+    class Session:
+        def get(self,url,**kwargs):
+            return Response()
+
+    fetcher = Fetcher(path=tmp_path / "cache",session=Session())
+    with pytest.raises(Exception,match="connection reset"):
+        fetcher.fetch("http://hopglass/","nodes.json")
+    assert [ path.name for path in (tmp_path / "cache").glob("*/*") ] == []
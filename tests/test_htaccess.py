@@ -0,0 +1,122 @@
+import ipaddress
+import pytest
+
+from ffua.branch import Branch
+from ffua.config import Config
+from ffua.htaccess import allowedAddresses, generateHtAccessRulesForBranch, generateRulesForBranch, writeRewriteSnippet
+from ffua.node import NodeMetaData
+
+def node_data(ident,addresses):
+    return NodeMetaData.from_raw(ident,{'nodeinfo': {'hostname': ident, 'network': {'addresses': addresses}}})
+
+def make_config(tmp_path):
+    (tmp_path / "stable" / "sysupgrade").mkdir(parents=True)
+    config = Config()
+    config.branches['stable'] = Branch(tmp_path / "stable",False)
+    return config
+
+def test_htaccess_written_on_change_only(tmp_path):
+    config = make_config(tmp_path)
+    path = tmp_path / "stable" / "sysupgrade" / ".htaccess"
+    nodes = [ node_data("a",["fe80::1"]), node_data("b",["fe80::2"]) ]
+
+    update = generateHtAccessRulesForBranch('stable',nodes,config)
+    assert update.changed
+    assert update.added == {"fe80::1","fe80::2"}
+    assert "allow from fe80::2" in path.read_text()
+    mtime = path.stat().st_mtime_ns
+
+    update = generateHtAccessRulesForBranch('stable',nodes,config)
+    assert not update.changed
+    assert path.stat().st_mtime_ns == mtime
+
+    update = generateHtAccessRulesForBranch('stable',nodes[:1] + [node_data("c",["fe80::3"])],config)
+    assert update.changed
+    assert update.added == {"fe80::3"}
+    assert update.removed == {"fe80::2"}
+    assert list(path.parent.iterdir()) == [path]
+
+def test_aggregate_cidr(tmp_path):
+    config = make_config(tmp_path)
+    config.aggregate = "cidr"
+    path = tmp_path / "stable" / "sysupgrade" / ".htaccess"
+    nodes = [ node_data(f"n{ num }",[f"2001:db8::{ num }",f"10.0.0.{ num }"]) for num in range(4) ]
+    generateHtAccessRulesForBranch('stable',nodes,config)
+    content = path.read_text()
+    assert allowedAddresses(content) == {"10.0.0.0/30","2001:db8::/126"}
+    assert "# n3" in content
+    assert content.splitlines()[-1] == "#Allowed nodes: 4"
+
+    config.comments = False
+    generateHtAccessRulesForBranch('stable',nodes[1:2],config)
+    assert path.read_text() == "order deny,allow\nallow from 10.0.0.1\nallow from 2001:db8::1\ndeny from all\n#Allowed nodes: 1\n"
+
+def test_aggregate_prefix(tmp_path):
+    config = make_config(tmp_path)
+    config.aggregate = "prefix"
+    nodes = [ node_data("a",["2001:db8:0:1::1","fe80::1"]), node_data("b",["2001:db8:0:2::1"]) ]
+    disallowed = [ ipaddress.ip_address(address) for address in ["2001:db8:0:2::2","fe80::2"] ]
+    known = [ address for node in nodes for address in node.getAddresses() ] + disallowed
+    with pytest.raises(Exception,match="known"):
+        generateHtAccessRulesForBranch('stable',nodes,config)
+    update = generateHtAccessRulesForBranch('stable',nodes,config,known)
+    assert update.added == {"2001:db8:0:1::/64","2001:db8:0:2::1","fe80::1"}
+
+def test_rewritemap(tmp_path):
+    config = make_config(tmp_path)
+    config.output = "rewritemap"
+    config.rewritemap = { 'path': str(tmp_path / "maps"), 'type': "txt" }
+    config.nets = [ "fda1:384a:74de:4242::/64" ]
+    nodes = [ node_data("a",["fe80::1","fda1:384a:74de:4242::1"]), node_data("b",["fe80::2"]) ]
+    update = generateRulesForBranch('stable',nodes,config)
+    assert update.changed and update.created
+    assert update.added == set()
+    assert "fe80::2 allow\n" in (tmp_path / "maps" / "stable.map").read_text()
+    assert not generateRulesForBranch('stable',nodes,config).changed
+    update = generateRulesForBranch('stable',nodes[:1],config)
+    assert not update.created
+    assert update.removed == {"fe80::2"}
+
+    writeRewriteSnippet(config)
+    snippet = (tmp_path / "maps" / "ffua.conf").read_text()
+    assert f'RewriteMap ffua-stable "txt:{ tmp_path / "maps" / "stable.map" }"' in snippet
+    assert f'<Directory "{ tmp_path / "stable" / "sysupgrade" }">' in snippet
+    assert "RewriteCond expr \"-R 'fda1:384a:74de:4242::/64'\"" in snippet
+    assert "RewriteCond ${ffua-stable:%{REMOTE_ADDR}|deny} !=allow" in snippet
+
+def test_rewritemap_dbm(tmp_path):
+    gnu = pytest.importorskip("dbm.gnu")
+    config = make_config(tmp_path)
+    config.output = "rewritemap"
+    config.rewritemap = { 'path': str(tmp_path / "maps") }
+    generateRulesForBranch('stable',[ node_data("a",["fe80::1"]) ],config)
+    with gnu.open(str(tmp_path / "maps" / "stable.map.gdbm" / "map"),"r") as db:
+        assert db[b"fe80::1"] == b"allow"
+    writeRewriteSnippet(config)
+    snippet = (tmp_path / "maps" / "ffua.conf").read_text()
+    assert f'RewriteMap ffua-stable "dbm=gdbm:{ tmp_path / "maps" / "stable.map.gdbm" / "map" }"' in snippet
+
+def test_rewritemap_dbm_swapped_at_once(tmp_path,monkeypatch):
+    import dbm.dumb
+    from ffua import htaccess
+
+    # dbm.dumb writes several files like ndbm
+    monkeypatch.setitem(htaccess.DBM_MODULES,"ndbm","dbm.dumb")
+    config = make_config(tmp_path)
+    config.output = "rewritemap"
+    config.rewritemap = { 'path': str(tmp_path / "maps"), 'type': "ndbm" }
+    link = tmp_path / "maps" / "stable.map.ndbm"
+    # The map is written even if the txt map is unchanged
+    generateRulesForBranch('stable',[ node_data("a",["fe80::1"]) ],config)
+    link.unlink()
+    update = generateRulesForBranch('stable',[ node_data("a",["fe80::1"]) ],config)
+    assert update.created
+    first = link.resolve()
+    update = generateRulesForBranch('stable',[ node_data("b",["fe80::2"]) ],config)
+    assert not update.created
+    assert update.added == {"fe80::2"} and update.removed == {"fe80::1"}
+    assert link.is_symlink() and link.resolve() != first
+    assert not first.exists()
+    with dbm.dumb.open(str(link / "map"),"r") as db:
+        assert list(db.keys()) == [b"fe80::2"]
+    assert sorted(path.name for path in (tmp_path / "maps").iterdir()) == sorted(["stable.map",link.name,link.resolve().name])
@@ -0,0 +1,28 @@
+import pytest
+import subprocess
+import sys
+from pathlib import Path
+
+import ffua
+
+ROOT = Path(__file__).parents[1]
+
+# Slow to import and not needed to start the command line tools
+HEAVY = { "requests", "numpy", "ffua.daemon", "ffua.snapshot", "ffua.store" }
+
+def imported(code):
+    result = subprocess.run([sys.executable,"-c",code + "\nimport sys\nprint(' '.join(sys.modules))"],
+            cwd=ROOT,capture_output=True,text=True,check=True)
+    return set(result.stdout.split())
+
+def test_package_imports_lazily():
+    modules = imported("import ffua")
+    assert not any(module.startswith("ffua.") for module in modules)
+    assert "ffua.node" in imported("import ffua\nffua.node.NodeMetaData")
+    assert "graph" in dir(ffua)
+    with pytest.raises(AttributeError,match="nosuchmodule"):
+        ffua.nosuchmodule
+
+def test_tools_start_without_heavy_modules():
+    assert imported("import readlog") & (HEAVY | { "ffua.hopglass", "ffua.graph" }) == set()
+    assert imported("import upgrade") & HEAVY == set()
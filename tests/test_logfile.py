@@ -0,0 +1,98 @@
+import gzip
+import io
+import os
+import pytest
+
+from ffua.logfile import RequestType, compileLogFormat, follow_logfile, logfile_chunks, parseLogTime, parse_logfile, parse_logfiles
+
+LOG = """\
+10.0.0.1 "GET /firmware/stable/sysupgrade/gluon-x.bin HTTP/1.1" 200 1234
+fe80::1 "GET /firmware/stable/sysupgrade/stable.manifest HTTP/1.1" 200 12
+fe80::2 "GET /firmware/stable/factory/gluon-x.bin HTTP/1.1" 200 1234
+fe80::3 "GET /firmware/nightly/sysupgrade/gluon-y.bin HTTP/1.1" 404 0
+fe80::4 "HEAD /firmware/nightly/sysupgrade/gluon-y.bin HTTP/1.1" 200 0
+"""
+
+def test_parse_firmware_log():
+    requests = list(parse_logfile(io.StringIO(LOG)))
+    assert len(requests) == 1
+    assert requests[0].type == RequestType.Firmware
+    assert requests[0].source == "10.0.0.1"
+    assert requests[0].branch == "stable"
+    assert requests[0].filename == "gluon-x.bin"
+
+def test_parse_with_manifest():
+    requests = list(parse_logfile(io.StringIO(LOG),True))
+    assert [r.type for r in requests] == [RequestType.Firmware, RequestType.Manifest]
+
+def test_parse_combined_format():
+    combined = '%h %l %u %t "%r" %>s %b "%{Referer}i" "%{User-agent}i"'
+    line = '::1 - - [10/Oct/2000:13:55:36 -0700] "GET /fw/beta/sysupgrade/x.bin HTTP/1.0" 200 2326 "-" "Wget 1.0 (x)"\n'
+    requests = list(parse_logfile(io.StringIO(line),logformat=combined))
+    assert requests[0].source == "::1"
+    assert requests[0].branch == "beta"
+
+def test_format_without_request():
+    with pytest.raises(Exception,match="method"):
+        compileLogFormat("%h %>s")
+
+def test_follow_logfile(tmp_path):
+    path = tmp_path / "firmware.log"
+    path.write_text(LOG)
+    follow = follow_logfile(str(path),interval=0)
+    assert next(follow) is None
+
+    line = '10.0.0.2 "GET /firmware/beta/sysupgrade/gluon-z.bin HTTP/1.1" 200 1234\n'
+    with path.open("a") as logfile:
+        logfile.write(line[:20])
+    assert next(follow) is None
+    with path.open("a") as logfile:
+        logfile.write(line[20:])
+    assert next(follow).source == "10.0.0.2"
+    assert next(follow) is None
+
+    # rotation, the old file is read to its end first
+    with path.open("a") as logfile:
+        logfile.write(line.replace("10.0.0.2","10.0.0.3"))
+    os.rename(path,tmp_path / "firmware.log.1")
+    path.write_text(line.replace("10.0.0.2","10.0.0.4"))
+    assert next(follow).source == "10.0.0.3"
+    assert next(follow).source == "10.0.0.4"
+    assert next(follow) is None
+
+    # truncation
+    path.write_text("")
+    assert next(follow) is None
+    path.write_text(line.replace("10.0.0.2","10.0.0.5"))
+    assert next(follow).source == "10.0.0.5"
+    follow.close()
+
+def test_parse_logfiles_chunks(tmp_path):
+    lines = [ f'10.0.{ num // 256 }.{ num % 256 } "GET /firmware/stable/sysupgrade/gluon-{ num }.bin HTTP/1.1" 200 1234\n'
+            for num in range(500) ]
+    path = tmp_path / "firmware.log"
+    path.write_text(LOG + "".join(lines))
+    archive = tmp_path / "firmware.log.1.gz"
+    with gzip.open(archive,"wt") as output:
+        output.write(LOG)
+    expected = list(parse_logfile(io.StringIO(LOG))) + list(parse_logfile(io.StringIO(LOG + "".join(lines))))
+    chunks = logfile_chunks(path,chunk_size=1000)
+    assert len(chunks) > 10
+    assert chunks[0][1] == 0 and chunks[-1][2] == path.stat().st_size
+    assert list(parse_logfiles([archive,path],jobs=1,chunk_size=1000)) == expected
+    assert list(parse_logfiles([archive,path],jobs=3,chunk_size=1000)) == expected
+
+def test_parse_logfiles_from_stdin(tmp_path,monkeypatch):
+    path = tmp_path / "firmware.log"
+    path.write_text(LOG)
+    monkeypatch.setattr("sys.stdin",io.TextIOWrapper(io.BytesIO(LOG.encode())))
+    expected = list(parse_logfile(io.StringIO(LOG))) * 2
+    assert list(parse_logfiles(["-",path],jobs=3,chunk_size=10)) == expected
+
+def test_parse_request_time():
+    combined = '%h %l %u %t "%r" %>s %b'
+    line = '::1 - - [10/Oct/2000:13:55:36 -0700] "GET /fw/beta/sysupgrade/x.bin HTTP/1.0" 200 2326\n'
+    requests = list(parse_logfile(io.StringIO(line),logformat=combined))
+    assert requests[0].time == 971211336
+    assert parseLogTime("10/Foo/2000:13:55:36 -0700") is None
+    assert list(parse_logfile(io.StringIO(LOG)))[0].time is None
@@ -0,0 +1,66 @@
+import io
+import json
+import os
+import pytest
+
+from ffua.config import Config
+from ffua.manifest import Manifest, ManifestCache
+
+def write_branch(path,branch,version):
+    sysupgrade = path / branch / "sysupgrade"
+    sysupgrade.mkdir(parents=True)
+    manifest = sysupgrade / f"{ branch }.manifest"
+    manifest.write_text(f"BRANCH={ branch }\nPRIORITY=0\n"
+            f"x86-64 { version } { '0' * 64 } 1234 fw-x86.bin\n"
+            f"ar71xx { version } { '1' * 64 } fw-ar71xx.bin\n")
+    return manifest
+
+def load_config(tmp_path,config):
+    config.update({ 'startnodes': [], 'firmware_path': str(tmp_path / "firmware"),
+        'cache': { 'path': str(tmp_path / "cache") } })
+    loaded = Config()
+    loaded.load(io.StringIO(json.dumps(config)))
+    return loaded
+
+def test_firmware_versions_are_computed_once(tmp_path):
+    manifest = Manifest.from_path(write_branch(tmp_path,"stable","1.0"))
+    assert manifest.getFirmwareVersion().pop() == "1.0"
+    assert manifest.getFirmwareVersion() == ["1.0"]
+
+def test_only_referenced_branches_are_loaded(tmp_path):
+    for branch in ["stable","beta","archived"]:
+        write_branch(tmp_path / "firmware",branch,f"{ branch }-1")
+    config = load_config(tmp_path,{ 'branches': ["stable"], 'incompatible': { 'stable': ["beta"] } })
+    assert list(config.branches) == ["stable"]
+    assert config.manifests.entries == {}
+    assert config.branches['stable'].getFirmwareVersion() == ["stable-1"]
+    assert list(config.manifests.entries) == [ str(tmp_path / "firmware/stable/sysupgrade/stable.manifest") ]
+
+def test_persistent_manifest_cache(tmp_path):
+    manifest_path = write_branch(tmp_path / "firmware","stable","1.0")
+    config = load_config(tmp_path,{})
+    assert config.branches['stable'].getFirmwareVersion() == ["1.0"]
+    assert config.manifests.hits == 0
+    assert not (tmp_path / "cache" / "manifests.json").exists()
+    config.manifests.save()
+
+    config = load_config(tmp_path,{})
+    manifest = config.branches['stable'].getManifest()
+    assert config.manifests.hits == 1
+    assert manifest.branch == "stable"
+    assert manifest.targets['x86-64'].filesize == "1234"
+    assert manifest.getFirmwareVersion() == ["1.0"]
+
+    manifest_path.write_text(manifest_path.read_text().replace("1.0","1.1"))
+    os.utime(manifest_path,ns=(0,0))
+    cache = ManifestCache(tmp_path / "cache" / "manifests.json")
+    assert cache.load(manifest_path).getFirmwareVersion() == ["1.1"]
+    assert cache.hits == 0
+    assert cache.misses == 1
+
+def test_workers_must_be_positive(tmp_path):
+    (tmp_path / "firmware").mkdir()
+    assert load_config(tmp_path,{ 'workers': 2 }).workers == 2
+    for workers in (0,-1,"4"):
+        with pytest.raises(Exception,match="workers"):
+            load_config(tmp_path,{ 'workers': workers })
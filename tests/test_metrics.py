@@ -0,0 +1,39 @@
+import json
+import pstats
+import tracemalloc
+
+from ffua.metrics import Metrics
+
+def test_stages_and_export(tmp_path):
+    metrics = Metrics("upgrade")
+    with metrics.stage("parse") as stage:
+        stage.count("nodes",3)
+    with metrics.stage("spantree"):
+        pass
+    assert [ stage.name for stage in metrics.stages ] == ["parse","spantree"]
+    assert metrics.stages[0].counts == { 'nodes': 3 }
+    assert metrics.stages[0].maxrss > 0
+
+    metrics.write(tmp_path / "ffua.prom")
+    text = (tmp_path / "ffua.prom").read_text()
+    assert 'ffua_stage_nodes{tool="upgrade",stage="parse"} 3' in text
+    assert text.count("# TYPE ffua_stage_duration_seconds gauge") == 1
+    assert 'ffua_stage_duration_seconds{tool="upgrade",stage="spantree"}' in text
+    assert "# TYPE ffua_process_maxrss_bytes gauge" in text
+    assert list(tmp_path.iterdir()) == [ tmp_path / "ffua.prom" ]
+
+    metrics.write(tmp_path / "ffua.json","json")
+    document = json.loads((tmp_path / "ffua.json").read_text())
+    assert document['tool'] == "upgrade"
+    assert document['stages'][0]['counts'] == { 'nodes': 3 }
+
+def test_profile(tmp_path):
+    metrics = Metrics("readlog",tmp_path / "profile")
+    try:
+        with metrics.stage("verify"):
+            data = [ list(range(100)) for _ in range(100) ]
+    finally:
+        tracemalloc.stop()
+    assert metrics.stages[0].peak > 0
+    pstats.Stats(str(tmp_path / "profile" / "readlog-01-verify.prof"))
+    assert tracemalloc.Snapshot.load(str(tmp_path / "profile" / "readlog-01-verify.tracemalloc")) is not None
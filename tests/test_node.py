@@ -0,0 +1,36 @@
+from collections import Counter
+from datetime import timezone
+import ipaddress
+import logging
+
+from ffua.node import NodeMetaData, logMissingFields
+
+RAW = { 'nodeinfo': { 'hostname': 'a', 'flags': { 'online': True },
+    'network': { 'addresses': [ 'fe80::1', 'invalid' ] },
+    'software': { 'firmware': { 'release': '1.0' }, 'autoupdater': { 'branch': 'stable' } } },
+    'lastseen': '2020-01-01T00:00:15.000Z' }
+
+def test_parse_node():
+    data = NodeMetaData.from_raw("aa",RAW)
+    assert data.isOnline()
+    assert data.getHostname() == "a"
+    assert data.getBranch() == "stable"
+    assert data.getFirmwareVersion() == "1.0"
+    assert data.getAddresses() == (ipaddress.ip_address("fe80::1"),)
+    assert data.getLastSeenEpoch() == 1577836815
+    assert data.getLastSeen().second == 15
+    assert data.getLastSeen().tzinfo == timezone.utc
+    assert not hasattr(data,'__dict__')
+
+def test_missing_fields_summary(caplog):
+    missing = Counter()
+    for _ in range(3):
+        data = NodeMetaData.from_raw("bb",{ 'nodeinfo': { 'hostname': 'b' } },missing)
+        assert data.getBranch() is None
+        assert data.getLastSeen() is None
+    NodeMetaData.from_raw("cc",{ 'nodeinfo': { 'hostname': 'c' } })
+    assert missing['branch'] == 3
+    with caplog.at_level(logging.WARNING):
+        logMissingFields(missing)
+    assert "3 nodes have no branch" in caplog.text
+    assert "3 nodes have no lastseen value" in caplog.text
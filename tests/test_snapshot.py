@@ -0,0 +1,91 @@
+import ipaddress
+import pytest
+import random
+
+from click.testing import CliRunner
+
+from ffua.graph import Graph, addVirtualNode, spantree
+from ffua.node import NodeMetaData
+from ffua.snapshot import Snapshot, encodeSnapshot, readSnapshot, writeSnapshot
+import readlog
+import upgrade
+
+def random_graph(rnd,num_nodes,num_edges):
+    graph = Graph()
+    for node in range(num_nodes):
+        ident = f"node{ node }"
+        graph.setNodeIdent(node,ident)
+        if node % 7 == 0:
+            # anonymous node from graph.json only
+            continue
+        graph.setNodeData(node,NodeMetaData(ident,hostname=f"host-{ node }",
+                branch=rnd.choice(["stable","beta",None]),release="v2023.2",
+                addresses=(ipaddress.ip_address(f"fe80::{ node + 1:x}"),ipaddress.ip_address(f"10.0.0.{ node }")),
+                lastseen=rnd.choice([None,1700000000 + node]),
+                online=rnd.random() < 0.5,metadata=True))
+    for _ in range(num_edges):
+        n1, n2 = rnd.randrange(num_nodes), rnd.randrange(num_nodes)
+        graph.addEdge(n1,n2,rnd.random())
+        graph.addEdge(n2,n1,rnd.random())
+    return graph
+
+def test_snapshot_roundtrip(tmp_path):
+    graph = random_graph(random.Random(5),60,90)
+    root = addVirtualNode(graph,["node1","node2"])
+    tree = spantree(graph,root)
+    writeSnapshot(tmp_path / "graph.snap",graph,tree)
+
+    snapshot = readSnapshot(tmp_path / "graph.snap")
+    assert snapshot.root() == root
+    loaded = snapshot.graph()
+    assert loaded.identmap == graph.identmap
+    assert sorted(loaded.getEdges()) == sorted(graph.getEdges())
+    assert loaded.getOutEdges(1) == graph.getOutEdges(1)
+    # The weight of virtual links is no number
+    assert loaded.getOutEdges(root)[1] is None
+    for node in graph.getNodes():
+        data = graph.getNodeData(node)
+        assert loaded.getNodeData(node) == data
+        if data is not None:
+            assert loaded.getNodeData(node).isStartNode() == data.isStartNode()
+    assert loaded.getNodeByAddress("10.0.0.3") == 3
+
+    loaded_tree = snapshot.tree()
+    assert loaded_tree.root_node == root
+    assert sorted(loaded_tree.getEdges()) == sorted(tree.getEdges())
+    assert all(loaded_tree.getNodeData(node) == tree.getNodeData(node) for node in tree.getNodes())
+
+def test_snapshot_without_tree():
+    graph = random_graph(random.Random(6),10,10)
+    snapshot = Snapshot.from_buffer(encodeSnapshot(graph))
+    assert snapshot.root() is None
+    assert not snapshot.hasTree()
+    assert sorted(snapshot.graph().getEdges()) == sorted(graph.getEdges())
+
+def test_snapshot_rejects_other_files():
+    content = encodeSnapshot(random_graph(random.Random(7),5,5))
+    for broken, message in ((b"NOTASNAP" + content[8:],"Not an ffua snapshot"),
+            (content[:8] + b"\x63" + content[9:],"version"),
+            (content[:-64],"truncated")):
+        with pytest.raises(Exception,match=message):
+            Snapshot.from_buffer(broken)
+
+def test_snapshot_shared_by_tools(tmp_path,hopglass_documents,config_file):
+    hopglass_documents(tmp_path / "hopglass",["gw","a","b"],[(0,1),(1,0),(1,2),(2,1)])
+    htaccess = tmp_path / "firmware" / "stable" / "sysupgrade" / ".htaccess"
+    config = str(config_file)
+    (tmp_path / "firmware.log").write_text("")
+    runner = CliRunner()
+
+    # readlog writes no spanning tree, the store no starting node
+    result = runner.invoke(readlog.cli,["-c",config,"--save-snapshot",str(tmp_path / "readlog.snap"),
+        "verify",str(tmp_path / "firmware.log")],obj=dict())
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(readlog.cli,["-c",config,"record",str(tmp_path / "store")],obj=dict())
+    assert result.exit_code == 0, result.output
+    for snapshot in (tmp_path / "readlog.snap",tmp_path / "store" / "00000000.snap"):
+        htaccess.unlink(missing_ok=True)
+        result = runner.invoke(upgrade.cli,["-c",config,"--snapshot",str(snapshot),"miauEnforce"])
+        assert result.exit_code == 0, result.output
+        assert "fe80::2" in htaccess.read_text()
+        assert "fe80::3" not in htaccess.read_text()
@@ -0,0 +1,98 @@
+import gzip
+import json
+import pytest
+
+from click.testing import CliRunner
+
+from ffua.delta import diffGraphs
+from ffua.store import SnapshotStore
+import readlog
+
+@pytest.fixture
+def states(make_graph):
+    return [
+        (100, make_graph([("a",["fe80::a"]),("b",["fe80::b"]),("c",["fe80::c"])],[(0,1,1.0),(1,2,1.0)])),
+        (200, make_graph([("a",["fe80::a"]),("b",["fe80::b"]),("d",["fe80::d"])],[(0,1,1.0),(0,2,0.5)])),
+        (300, make_graph([("d",["fe80::d"]),("a",["fe80::a"]),("b",["fe80::bb"])],[(1,2,0.5),(1,0,0.5)])),
+        (400, make_graph([("a",["fe80::a"]),("b",["fe80::bb"])],[(0,1,0.7)])),
+    ]
+
+def test_store_rebuilds_states(tmp_path,states):
+    store = SnapshotStore.open(tmp_path / "store",keyframes=2)
+    for time, graph in states:
+        store.record(graph,time)
+    with pytest.raises(Exception,match="not later"):
+        store.record(states[0][1],400)
+
+    store = SnapshotStore.open(tmp_path / "store")
+    assert store.times() == [100,200,300,400]
+    assert [ entry.snapshot is not None for entry in store.entries ] == [True,False,True,False]
+    for time, graph in states:
+        for at in (time,time + 50):
+            state_time, state = store.graphAt(at)
+            assert state_time == time
+            assert diffGraphs(state,graph).isEmpty()
+    assert store.graphAt(50)[0] == 100
+
+    # Replaying the deltas onto an older state gives the newer ones
+    _, state = store.graphAt(100)
+    for (time, delta), (_, graph) in zip(store.deltas(100,300),states[1:3]):
+        delta.apply(state)
+        assert diffGraphs(state,graph).isEmpty()
+    assert [ time for time, _ in store.deltas(100,300) ] == [200,300]
+
+def test_store_keeps_lastseen_as_column(tmp_path,make_graph):
+    store = SnapshotStore.open(tmp_path / "store")
+    store.record(make_graph([("a",["fe80::a"]),("b",["fe80::b"])],[(0,1,1.0)]),100)
+    graph = make_graph([("a",["fe80::a"]),("b",["fe80::b"])],[(0,1,1.0)])
+    graph.getNodeData(0).lastseen = 1700000000
+    entry = store.record(graph,200)
+
+    with gzip.open(tmp_path / "store" / entry.delta,"rt") as delta_file:
+        delta = json.load(delta_file)
+    assert delta['updated_nodes'] == {}
+    assert delta['lastseen'] == { "a": 1700000000 }
+    _, state = SnapshotStore.open(tmp_path / "store").graphAt(200)
+    assert state.getNodeDataByIdent("a").getLastSeenEpoch() == 1700000000
+
+def test_verify_history_in_time_order(tmp_path,hopglass_documents,config_file):
+    runner = CliRunner()
+    config = str(config_file)
+    # b and d first hang behind a, then b links to gw itself
+    idents = ["gw","a","b","c","d"]
+    links = [(0,1),(1,0),(2,4),(4,2),(0,3),(3,0)]
+    hopglass_documents(tmp_path / "hopglass" / "1",idents,links + [(1,2),(2,1)])
+    result = runner.invoke(readlog.cli,["-c",config,"record","--time","100",str(tmp_path / "store")],obj=dict())
+    assert result.exit_code == 0, result.output
+    hopglass_documents(tmp_path / "hopglass" / "2",idents,links + [(0,2),(2,0)])
+    result = runner.invoke(readlog.cli,["-c",config,"record","--time","200",str(tmp_path / "store")],obj=dict())
+    assert result.exit_code == 0, result.output
+
+    request = '{} [01/Jan/1970:00:0{}:{} +0000] "GET /firmware/stable/sysupgrade/gluon.bin HTTP/1.1" 200 1234\n'
+    # The rotated log with the upgrade of a at 150 is given last
+    (tmp_path / "firmware.log").write_text(request.format("fe80::4",4,"10"))
+    (tmp_path / "firmware.log.1").write_text(request.format("fe80::2",2,"30"))
+    result = runner.invoke(readlog.cli,["-c",config,"--jobs","1","--format",'%h %t "%r" %>s %b',"verify",
+        "--store",str(tmp_path / "store"),str(tmp_path / "firmware.log"),str(tmp_path / "firmware.log.1")],obj=dict())
+    assert result.exit_code == 0, result.output
+    assert "Graph split was detected" in result.output
+
+def test_verify_history_reconnected_node(tmp_path,hopglass_documents,config_file):
+    runner = CliRunner()
+    config = str(config_file)
+    # b, c and e are cut off from gw at first, then b links to a
+    idents = ["gw","a","b","c","d","e"]
+    links = [(0,1),(1,0),(2,3),(3,2),(3,5),(5,3),(0,4),(4,0)]
+    hopglass_documents(tmp_path / "hopglass" / "1",idents,links)
+    result = runner.invoke(readlog.cli,["-c",config,"record","--time","100",str(tmp_path / "store")],obj=dict())
+    assert result.exit_code == 0, result.output
+    hopglass_documents(tmp_path / "hopglass" / "2",idents,links + [(1,2),(2,1)])
+    result = runner.invoke(readlog.cli,["-c",config,"record","--time","200",str(tmp_path / "store")],obj=dict())
+    assert result.exit_code == 0, result.output
+
+    request = '{} [01/Jan/1970:00:0{}:{} +0000] "GET /firmware/stable/sysupgrade/gluon.bin HTTP/1.1" 200 1234\n'
+    (tmp_path / "firmware.log").write_text(request.format("fe80::5",2,"30") + request.format("fe80::3",4,"10"))
+    result = runner.invoke(readlog.cli,["-c",config,"--jobs","1","--format",'%h %t "%r" %>s %b',"verify",
+        "--store",str(tmp_path / "store"),str(tmp_path / "firmware.log")],obj=dict())
+    assert result.exit_code == 0, result.output
+    assert "Graph split was detected" in result.output
@@ -0,0 +1,114 @@
+import pytest
+import random
+import time
+
+from ffua.branch import Branch
+from ffua.config import Config
+from ffua.graph import Graph, addVirtualNode, getComponents, spantree
+from ffua.mechanism import MiauEnforce, OuterToInnerUpgrade, SafeRemovalUpgrade
+from ffua.node import NodeMetaData
+from ffua.upgrade import UpgradeModel
+
+BRANCHES = ["stable","beta","experimental"]
+
+def make_config(tmp_path):
+    config = Config()
+    for branch in BRANCHES:
+        sysupgrade = tmp_path / branch / "sysupgrade"
+        sysupgrade.mkdir(parents=True)
+        (sysupgrade / f"{ branch }.manifest").write_text(f"BRANCH={ branch }\nx86-64 { branch }-1 " + "0" * 64 + " fw.bin\n")
+        config.branches[branch] = Branch.from_path(tmp_path / branch)
+    config.incompatible = { "stable": ["experimental"], "beta": ["experimental"], "experimental": ["stable"] }
+    config.startnodes = ["n0","n1"]
+    return config
+
+def make_graph(seed=5,num_nodes=60):
+    rnd = random.Random(seed)
+    graph = Graph()
+    for node in range(num_nodes):
+        lastseen = time.strftime("%Y-%m-%dT%H:%M:%S",time.gmtime(time.time() - rnd.choice([60,7200])))
+        raw = { 'nodeinfo': { 'hostname': f"n{ node }",
+            'network': { 'addresses': [ f"fe80::{ node + 1 }" ] },
+            'software': { 'firmware': { 'release': rnd.choice(['old','stable-1','beta-1']) },
+                'autoupdater': { 'branch': rnd.choice(BRANCHES + [None]) } } },
+            'lastseen': lastseen }
+        graph.setNodeIdent(node,f"n{ node }")
+        graph.setNodeData(node,NodeMetaData.from_raw(f"n{ node }",raw))
+    for node in range(2,num_nodes):
+        parent = rnd.randrange(0,node)
+        graph.addEdge(parent,node,1)
+        graph.addEdge(node,parent,1)
+    return graph
+
+def evaluate(config,mechanism,**kwargs):
+    graph = make_graph()
+    root = addVirtualNode(graph,config.startnodes)
+    model = UpgradeModel(graph,spantree(graph,root),mechanism)
+    return [ (branch,sorted(data.ident for data in nodes if data is not None)) for branch, nodes, _ in model.evaluate(config,**kwargs) ]
+
+def test_parallel_evaluation_is_identical(tmp_path):
+    config = make_config(tmp_path)
+    for mechanism in [ MiauEnforce({ 'virtual_rootnode': True }), OuterToInnerUpgrade(), SafeRemovalUpgrade() ]:
+        sequential = evaluate(config,mechanism)
+        assert [ branch for branch, _ in sequential ] == BRANCHES
+        assert evaluate(config,mechanism,workers=3,executor="thread") == sequential
+        assert evaluate(config,mechanism,workers=3,executor="process") == sequential
+
+def test_generator_interface(tmp_path):
+    config = make_config(tmp_path)
+    graph = make_graph()
+    root = addVirtualNode(graph,config.startnodes)
+    model = UpgradeModel(graph,spantree(graph,root),OuterToInnerUpgrade())
+    evaluated = model.evaluate(config)
+    assert [ (branch,list(generator)) for branch, generator in model(config) ] == \
+            [ (branch,nodes) for branch, nodes, _ in evaluated ]
+
+def test_columnar_evaluation_is_identical(tmp_path):
+    pytest.importorskip("numpy")
+    config = make_config(tmp_path)
+    for seed in range(10):
+        if seed == 5:
+            config.incompatible = {}
+        graph = make_graph(seed,3 + seed * 17)
+        if seed % 2:
+            graph = graph.compact()
+        root = addVirtualNode(graph,config.startnodes) if seed % 2 == 0 else 0
+        for mechanism in [ MiauEnforce({ 'virtual_rootnode': True }), OuterToInnerUpgrade() ]:
+            model = UpgradeModel(graph,spantree(graph,root),mechanism)
+            columnar = list(model(config))
+            assert model._table is not None
+            for branch, nodes in columnar:
+                assert nodes == list(mechanism(graph,model.branchTree(branch,config),config.branches))
+
+def test_safe_removal_upgrade(tmp_path):
+    config = make_config(tmp_path)
+    config.incompatible = {}
+    graph = make_graph()
+    # Close a cycle over three nodes, so its inner nodes may upgrade
+    graph.addEdge(40,41,1)
+    graph.addEdge(41,40,1)
+    root = addVirtualNode(graph,config.startnodes)
+    tree = spantree(graph,root)
+    model = UpgradeModel(graph,tree,SafeRemovalUpgrade())
+    allowed = set(graph.getGraphIdentFromIdent(data.ident) for data in dict(model(config))['stable'])
+    leafs = set(node for node in tree.getNodes() if node != root and len(tree.getOutEdges(node)) == 0)
+    assert leafs < allowed
+    for node in allowed:
+        remaining = Graph()
+        for n1, n2 in graph.getEdges():
+            if node not in (n1,n2):
+                remaining.addEdge(n1,n2,1)
+        assert len(getComponents(remaining)) == 1
+
+def test_safe_removal_skips_nodes_without_data(tmp_path):
+    config = make_config(tmp_path)
+    config.incompatible = {}
+    graph = make_graph()
+    # A leaf only known from graph.json
+    graph.setNodeIdent(60,"n60")
+    graph.addEdge(10,60,1)
+    graph.addEdge(60,10,1)
+    root = addVirtualNode(graph,config.startnodes)
+    model = UpgradeModel(graph,spantree(graph,root),SafeRemovalUpgrade())
+    for branch, nodes in model(config):
+        assert None not in nodes
@@ -1,42 +1,119 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from pathlib import Path
 
 import click
 from ffua.graph import spantree, addVirtualNode
-from ffua.hopglass import getDataFromHopGlass
+from ffua.hopglass import Fetcher, documentPaths, readDocuments
 from ffua.mechanism import mechanismFactory, mechansim_dict
-from ffua.htaccess import generateHtAccessRulesForBranch
+from ffua.htaccess import generateRulesForBranch, writeRewriteSnippet
 from ffua.config import Config
+from ffua.metrics import Metrics
 from ffua.upgrade import UpgradeModel
 
 @click.command()
 @click.option("--debug/--no-debug",default=False,help="Debugging output")
 @click.option('--config', '-c', 'config_file', type=click.File(mode='r'), prompt=True)
+@click.option("--compact/--no-compact",default=False,help="Use the array backed graph")
+@click.option("--daemon/--no-daemon",default=False,help="Keep running and follow hopglass")
+@click.option("--interval",default=60,show_default=True,help="Seconds between hopglass polls in daemon mode")
+@click.option("--metrics","metrics_file",type=click.Path(dir_okay=False),help="Write per stage metrics to this file")
+@click.option("--metrics-format",type=click.Choice(["prometheus","json"]),default="prometheus",show_default=True)
+@click.option("--profile","profile_path",type=click.Path(file_okay=False),help="Dump cProfile and tracemalloc snapshots of every stage into this directory")
+@click.option("--snapshot","snapshot_file",type=click.Path(exists=True,dir_okay=False),help="Start from this graph snapshot instead of hopglass")
+@click.option("--save-snapshot","save_snapshot_file",type=click.Path(dir_okay=False),help="Save a snapshot of graph and spanning tree to this file")
 @click.argument('mechanism', default="outerToInnerUpgrade",type=click.Choice(mechansim_dict.keys()))
-def cli(debug, config_file,mechanism):
+def cli(debug, config_file, compact, daemon, interval, metrics_file, metrics_format, profile_path, snapshot_file, save_snapshot_file, mechanism):
     if debug:
         logging.basicConfig(level=logging.DEBUG)
     else:
         logging.basicConfig(level=logging.INFO)
 
-    config = Config()
-    config.load(config_file)
+    metrics = Metrics("upgrade",Path(profile_path) if profile_path else None)
+    with metrics.stage("config") as stage:
+        config = Config()
+        config.load(config_file)
+        stage.count("branches",len(config.branches))
     hopglass = config.hopglass
     startnode = config.startnodes
+    fetcher = Fetcher.from_config(config.cache)
 
-    graph = getDataFromHopGlass(hopglass)
-    if config.has_virtal_rootnode():
-        # Construct virtual node and add a link to all startnodes.
-        startnode = addVirtualNode(graph,startnode)
+    if daemon:
+        if compact:
+            raise click.UsageError("The compact graph can not follow hopglass changes")
+        if snapshot_file is not None:
+            raise click.UsageError("A snapshot can not follow hopglass changes")
+        from ffua.daemon import Daemon
+        Daemon(config,mechanismFactory(mechanism,config),fetcher,metrics=metrics,
+                metrics_file=metrics_file,metrics_format=metrics_format).run(interval)
+        return
+
+    if snapshot_file is not None:
+        from ffua.snapshot import readSnapshot
+        with metrics.stage("snapshot") as stage:
+            snapshot = readSnapshot(snapshot_file)
+            graph = snapshot.graph()
+            startnode = snapshot.root()
+            if startnode is None:
+                # Snapshots of the snapshot store carry no starting node
+                if not config.has_virtal_rootnode():
+                    raise Exception(f"Snapshot { snapshot_file } has no starting node and no startnodes are configured")
+                startnode = addVirtualNode(graph,config.startnodes)
+            if compact:
+                graph = graph.compact()
+            if compact or not snapshot.hasTree():
+                # readlog snapshots carry no spanning tree
+                tree = spantree(graph, startnode)
+            else:
+                tree = snapshot.tree()
+            stage.count("nodes",graph.numNodes())
     else:
-        startnode = graph.getGraphIdentFromIdent(startnode[0])
-    tree = spantree(graph, startnode)
+        with metrics.stage("fetch") as stage:
+            paths = documentPaths(hopglass,fetcher)
+            stage.count("cache_hits",fetcher.hits)
+        with metrics.stage("parse") as stage:
+            graph = readDocuments(paths)
+            stage.count("nodes",graph.numNodes())
+            stage.count("edges",sum(1 for _ in graph.getEdges()))
+        with metrics.stage("spantree") as stage:
+            if config.has_virtal_rootnode():
+                # Construct virtual node and add a link to all startnodes.
+                startnode = addVirtualNode(graph,startnode)
+            else:
+                startnode = graph.getGraphIdentFromIdent(startnode[0])
+            if compact:
+                graph = graph.compact()
+            tree = spantree(graph, startnode)
+            stage.count("nodes",tree.numNodes())
+    if save_snapshot_file is not None:
+        from ffua.snapshot import writeSnapshot
+        writeSnapshot(save_snapshot_file,graph,tree)
+
+    with metrics.stage("mechanism") as stage:
+        mechanism = mechanismFactory(mechanism,config)
+        upgrade = UpgradeModel(graph,tree,mechanism)
+        results = upgrade.evaluate(config, workers=config.workers, executor=config.executor)
+        stage.count("allowed_nodes",sum(len(nodes) for _, nodes, _ in results))
+        # Manifests are read on first use by the mechanism
+        stage.count("manifest_cache_hits",config.manifests.hits)
+        stage.count("manifest_cache_misses",config.manifests.misses)
+        config.manifests.save()
+    with metrics.stage("htaccess") as stage:
+        known = None
+        if config.aggregate == "prefix":
+            if graph.addressindex is None:
+                graph.buildAddressIndex()
+            known = graph.addressindex.knownAddresses()
+        with ThreadPoolExecutor(max_workers=config.workers) as pool:
+            updates = list(pool.map(lambda result: generateRulesForBranch(result[0],result[1],config,known),results))
+        if config.output == "rewritemap":
+            writeRewriteSnippet(config)
+        stage.count("changed_files",sum(update.changed for update in updates))
 
-    mechanism = mechanismFactory(mechanism,config)
-    upgrade = UpgradeModel(graph,tree,mechanism)
-    for branch, generator in upgrade(config):
-        generateHtAccessRulesForBranch(branch, generator, config)
+    if metrics_file is not None:
+        metrics.write(metrics_file,metrics_format)
 
 
 if __name__ == "__main__":